@@ -0,0 +1,271 @@
+#!/usr/bin/python3
+#
+# Timing-critical sensor reads in a process of their own.
+#
+# The DHT11 and HC-SR04 are read by polling a pin in a tight Python loop and counting/timing what comes back, so
+# a garbage collection, another thread holding the GIL or the scheduler running something else mid read gives
+# a bad result (a DHT11 checksum failure, or a car that's suddenly a metre further away). In the daemon those
+# reads share the interpreter with the webhook, the workers and the LEDs.
+#
+# Acquirer runs a small process that does nothing but those reads, when asked over a pipe. It asks for
+# SCHED_FIFO priority and its own CPU (on a multi-core Pi), and keeps the garbage collector off while it reads,
+# collecting in between instead. Each reply has to come back within a timeout, otherwise the process is killed
+# and a new one started.
+#
+# The reader is forked, so it has the GPIO setup (and the car) as they are. But forking a process with threads
+# running copies whatever locks they hold (logging's, say) into the child, held by a thread it doesn't have, and
+# the child can hang on them. So start() forks a launcher while there are no other threads yet, and that's all it
+# does: each reader, the first and any restart, is forked from the launcher (single threaded, as the daemon was
+# then), and its end of the pipe passed back to us.
+#
+#   acquirer = Acquirer(garage.car)
+#   acquirer.start()                          # before starting any threads
+#   garage.car.acquirer = acquirer
+#   garage.weather.acquirer = acquirer
+#
+# SCHED_FIFO needs root or CAP_SYS_NICE (setcap cap_sys_nice+ep on the python binary). Without it the reads
+# still happen in their own process, at normal priority.
+# -----------------------
+
+from __future__ import print_function
+import gc
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from multiprocessing.connection import Connection
+from multiprocessing.reduction import recv_handle, send_handle
+
+__author__ = "Ryan Hunt <ryan@ryanhunt.net>"
+__copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
+
+DEFAULT_PRIORITY = 50
+
+
+def _realtime(priority, cpu):
+	try:
+		os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(priority))
+	except (AttributeError, OSError) as e:
+		logging.warning("Acquisition process can't have SCHED_FIFO priority ({0}), carrying on without".format(e))
+
+	if cpu is not None:
+		try:
+			os.sched_setaffinity(0, [cpu])
+		except (AttributeError, OSError) as e:
+			logging.warning("Acquisition process can't be pinned to CPU {0} ({1})".format(cpu, e))
+
+
+# The launcher: forks a reader for each ("reader", trigger, echo) it's sent, passes back our end of the reader's
+# pipe and its pid, and goes back to waiting.
+def _launch(control, ours, car, priority, cpu):
+	import garagegpio
+	import gpiotrace
+
+	# our copy of the daemon's end of the pipe, or the launcher never sees it go away
+	ours.close()
+
+	# a trace recorder's file belongs to the daemon, read the pins directly
+	backend = garagegpio.getBackend()
+	if isinstance(backend, gpiotrace.TraceRecorder):
+		garagegpio.setBackend(backend.backend)
+
+	# readers that have finished are reaped without waiting on them
+	signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+	parent = os.getppid()
+
+	while True:
+		try:
+			request = control.recv()
+		except (EOFError, KeyboardInterrupt):
+			return
+		if (request[0] != "reader"):
+			return
+
+		(ours, theirs) = multiprocessing.Pipe()
+		pid = os.fork()
+		if (pid == 0):
+			status = 0
+			try:
+				signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+				control.close()
+				ours.close()
+				_serve(theirs, car, priority, cpu, request[1], request[2])
+			except BaseException:
+				status = 1
+			finally:
+				os._exit(status)
+
+		theirs.close()
+		send_handle(control, ours.fileno(), parent)
+		control.send(pid)
+		ours.close()
+
+
+def _serve(conn, car, priority, cpu, trigger=None, echo=None):
+	import dht11
+	from garagegpio import GPIO
+
+	if (car is not None and trigger is not None and (trigger, echo) != (car.GPIO_TRIGGER, car.GPIO_ECHO)):
+		# the pins have been changed since the launcher was forked
+		GPIO.setup(trigger, GPIO.OUT)
+		GPIO.output(trigger, False)
+		GPIO.setup(echo, GPIO.IN)
+		(car.GPIO_TRIGGER, car.GPIO_ECHO) = (trigger, echo)
+
+	_realtime(priority, cpu)
+
+	# anything freed during a read waits for the collect() after it
+	gc.disable()
+
+	# our own copy of the car (this is a forked process), reading the pins itself
+	if car is not None:
+		car.acquirer = None
+
+	while True:
+		try:
+			request = conn.recv()
+		except (EOFError, KeyboardInterrupt):
+			return
+
+		try:
+			if (request[0] == "dht11"):
+				result = dht11.DHT11(pin=request[1]).read()
+				reply = ("ok", (result.error_code, result.temperature, result.humidity))
+			elif (request[0] == "distance"):
+				reply = ("ok", car._measure_average())
+			elif (request[0] == "ping"):
+				reply = ("ok", car._measure())
+			elif (request[0] == "stop"):
+				return
+			else:
+				reply = ("error", "Unknown request {0}".format(request[0]))
+		except Exception as e:
+			reply = ("error", "{0}: {1}".format(type(e).__name__, e))
+
+		conn.send(reply)
+		gc.collect()
+
+
+class Acquirer():
+	def __init__(self, car=None, priority=DEFAULT_PRIORITY, cpu=None, timeout=5.0):
+		self.car = car
+		self.priority = priority
+		self.timeout = timeout
+
+		# leave CPU 0 to everything else, if there's more than one
+		if cpu is None and hasattr(os, 'sched_getaffinity'):
+			cpus = sorted(os.sched_getaffinity(0))
+			cpu = cpus[-1] if len(cpus) > 1 else None
+		self.cpu = cpu
+
+		self.restarts = 0
+		self._launcher = None
+		self._control = None
+		# the reader's pid, and our end of its pipe
+		self.pid = None
+		self._conn = None
+		self._lock = threading.Lock()
+
+	# Call this before any threads are started: it forks.
+	def start(self):
+		if (threading.active_count() > 1):
+			logging.warning("Starting the acquisition process with other threads running, it may inherit a lock one of them holds")
+		context = multiprocessing.get_context("fork")
+		(self._control, child) = context.Pipe()
+		self._launcher = context.Process(target=_launch, args=(child, self._control, self.car, self.priority, self.cpu), name="GarageAcquire")
+		self._launcher.daemon = True
+		self._launcher.start()
+		child.close()
+		with self._lock:
+			self._startReader()
+
+	def _startReader(self):
+		car = self.car
+		pins = (car.GPIO_TRIGGER, car.GPIO_ECHO) if car is not None else (None, None)
+		try:
+			self._control.send(("reader",) + pins)
+			self._conn = Connection(recv_handle(self._control))
+			self.pid = self._control.recv()
+		except (EOFError, OSError) as e:
+			# it can't be forked again now there are threads, the daemon needs a restart
+			raise IOError("The acquisition launcher has gone ({0})".format(e or type(e).__name__))
+
+	def _stopReader(self):
+		if self._conn is None:
+			return
+		try:
+			os.kill(self.pid, signal.SIGKILL)
+		except OSError:
+			pass
+		self._conn.close()
+		(self._conn, self.pid) = (None, None)
+
+	def stop(self):
+		if self._launcher is None:
+			return
+		with self._lock:
+			if self._conn is not None:
+				try:
+					self._conn.send(("stop",))
+				except (IOError, OSError):
+					pass
+				self._conn.close()
+				(self._conn, self.pid) = (None, None)
+		try:
+			self._control.send(("stop",))
+		except (IOError, OSError):
+			pass
+		self._launcher.join(1)
+		if self._launcher.is_alive():
+			self._launcher.terminate()
+		self._control.close()
+		self._launcher = None
+
+	# a fresh reader, from the launcher, e.g. after the car's pins have changed
+	def restart(self):
+		with self._lock:
+			self._restart()
+
+	def _restart(self):
+		self._stopReader()
+		self.restarts += 1
+		if self._launcher is None:
+			raise IOError("The acquisition process hasn't been started")
+		self._startReader()
+
+	def _request(self, *request):
+		with self._lock:
+			if self._conn is None:
+				self._restart()
+
+			try:
+				self._conn.send(request)
+				replied = self._conn.poll(self.timeout)
+				if replied:
+					(status, value) = self._conn.recv()
+			except (EOFError, OSError) as e:
+				self._restart()
+				raise IOError("Acquisition process went away ({0}), restarted it".format(e))
+
+			if not replied:
+				self._restart()
+				raise IOError("No reply from the acquisition process in {0}s, restarted it".format(self.timeout))
+
+		if (status != "ok"):
+			raise IOError(value)
+		return value
+
+	# one DHT11 read, as a dht11.DHT11Result
+	def readDHT11(self, pin):
+		import dht11
+		(error_code, temperature, humidity) = self._request("dht11", pin)
+		return dht11.DHT11Result(error_code, temperature, humidity)
+
+	# averaged HC-SR04 distance in cm, like Car._measure_average()
+	def measureDistance(self):
+		return self._request("distance")
+
+	# a single HC-SR04 distance in cm, like Car.ping()
+	def ping(self):
+		return self._request("ping")
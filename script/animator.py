@@ -0,0 +1,209 @@
+#!/usr/bin/python3
+#
+# Background animator for the red/green LEDs.
+#
+# GarageLights used to flash the LEDs by toggling pins inside time.sleep() loops, so whoever asked for a
+# flash was stuck until it finished (15-20 seconds whilst the door moved). The animator plays a pattern on
+# its own thread and returns straight away. The thread sleeps until the next frame is due and exits as soon
+# as nothing is animating, so a solid colour costs nothing and a blink costs a couple of wakeups a second.
+#
+# Patterns are short strings:
+#   "off [colour]"              LED(s) off, colour defaults to both
+#   "solid <colour>"            red or green on (and the other off), or both on
+#   "blink <colour> <period>"   on for period, off for period, the other LED is left alone
+#   "alternate <period>"        red, then green, swapping every period
+#   "pulse <colour> <period>"   fade up and back down once per period, driven by GPIO.PWM
+# -----------------------
+
+from __future__ import print_function
+import threading
+import time
+from garagegpio import GPIO
+
+__author__ = "Ryan Hunt <ryan@ryanhunt.net>"
+__copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
+
+
+class LightAnimator():
+	# number of PWM duty cycle steps in one fade up and down
+	PULSE_STEPS = 20
+	PWM_FREQUENCY = 100
+
+	def __init__(self, red, green, daemon=True):
+		self.GPIO_RED = red
+		self.GPIO_GREEN = green
+
+		# the command line scripts want the process to stay alive until the lights finish, the daemon doesn't.
+		self.daemon = daemon
+
+		self._cond = threading.Condition()
+		self._thread = None
+		self._frames = None
+		self._deadline = None
+		self._then = None
+		self._generation = 0
+		self._pwm = {}
+
+	# Turn a pattern string into a list of (red duty, green duty, hold) frames.
+	# A duty of None leaves that LED alone, a hold of None means stay on this frame.
+	@staticmethod
+	def compile(pattern):
+		words = pattern.lower().split()
+
+		if not words:
+			raise ValueError("Empty light pattern")
+
+		kind = words[0]
+		colour = words[1] if len(words) > 1 else "both"
+
+		if (kind == "alternate"):
+			period = float(words[1]) if len(words) > 1 else 0.05
+			return [(100, 0, period), (0, 100, period)]
+
+		if colour not in ("red", "green", "both"):
+			raise ValueError("Unknown colour '{0}' in light pattern '{1}'".format(colour, pattern))
+
+		def frame(duty, other, hold):
+			if (colour == "red"):
+				return (duty, other, hold)
+			elif (colour == "green"):
+				return (other, duty, hold)
+			else:
+				return (duty, duty, hold)
+
+		if (kind == "off"):
+			return [frame(0, None, None)]
+		elif (kind == "solid"):
+			return [frame(100, 0, None)]
+
+		period = float(words[2]) if len(words) > 2 else 0.5
+
+		if (kind == "blink"):
+			return [frame(100, None, period), frame(0, None, period)]
+		elif (kind == "pulse"):
+			steps = LightAnimator.PULSE_STEPS
+			hold = period / steps
+			half = steps // 2
+			return [frame(int(100 * min(i, steps - i) / half), None, hold) for i in range(steps)]
+		else:
+			raise ValueError("Unknown light pattern '{0}'".format(pattern))
+
+	# Start playing a pattern and return immediately.
+	# duration = seconds to play for (None = until another pattern is played)
+	# then = pattern to switch to when the duration is up, or a function to call at that point. If the function returns a pattern, it is played.
+	def play(self, pattern, duration=None, then=None):
+		frames = self.compile(pattern)
+
+		with self._cond:
+			self._generation += 1
+			self._then = then
+
+			if (duration is None and len(frames) == 1):
+				# nothing to animate, set the LEDs and let any running thread wind down.
+				self._frames = None
+				self._deadline = None
+				self._apply(frames[0])
+				self._cond.notify_all()
+				return
+
+			self._frames = frames
+			self._deadline = None if duration is None else time.time() + duration
+
+			if self._thread is None:
+				self._thread = threading.Thread(target=self._run, name="LightAnimator")
+				self._thread.daemon = self.daemon
+				self._thread.start()
+			else:
+				self._cond.notify_all()
+
+	def stop(self):
+		self.play("off")
+
+	# Block until any timed pattern has finished (and its 'then' has run).
+	def wait(self):
+		with self._cond:
+			while self._thread is not None:
+				self._cond.wait()
+
+	def _run(self):
+		self._cond.acquire()
+		try:
+			generation = None
+			index = 0
+
+			while self._frames is not None:
+				if (generation != self._generation):
+					generation = self._generation
+					index = 0
+					self._releasePWM(self._frames)
+
+				now = time.time()
+
+				if (self._deadline is not None and now >= self._deadline):
+					then = self._then
+					self._frames = None
+					self._deadline = None
+					self._then = None
+
+					if callable(then):
+						# this may well read sensors, so don't hold up anyone wanting to play a new pattern.
+						self._cond.release()
+						try:
+							then = then()
+						finally:
+							self._cond.acquire()
+
+						if (generation != self._generation):
+							# someone played a new pattern whilst we were busy, it wins.
+							continue
+
+					if isinstance(then, str):
+						frames = self.compile(then)
+						self._generation += 1
+						if (len(frames) == 1):
+							self._releasePWM(frames)
+							self._apply(frames[0])
+						else:
+							self._frames = frames
+					continue
+
+				frame = self._frames[index % len(self._frames)]
+				self._apply(frame)
+				index += 1
+
+				hold = frame[2]
+				if self._deadline is not None:
+					remaining = self._deadline - now
+					hold = remaining if hold is None else min(hold, remaining)
+
+				self._cond.wait(hold)
+		finally:
+			self._thread = None
+			self._cond.notify_all()
+			self._cond.release()
+
+	# stop any PWM channels the new frames don't need, so plain GPIO.output works on those pins again.
+	def _releasePWM(self, frames):
+		if not self._pwm:
+			return
+
+		if any(duty not in (None, 0, 100) for frame in frames for duty in frame[:2]):
+			return
+
+		for pwm in self._pwm.values():
+			pwm.stop()
+		self._pwm = {}
+
+	def _apply(self, frame):
+		for (pin, duty) in ((self.GPIO_RED, frame[0]), (self.GPIO_GREEN, frame[1])):
+			if duty is None:
+				continue
+
+			if (pin in self._pwm or duty not in (0, 100)):
+				if pin not in self._pwm:
+					self._pwm[pin] = GPIO.PWM(pin, self.PWM_FREQUENCY)
+					self._pwm[pin].start(duty)
+				else:
+					self._pwm[pin].ChangeDutyCycle(duty)
+			else:
+				GPIO.output(pin, GPIO.HIGH if duty else GPIO.LOW)
@@ -0,0 +1,240 @@
+#!/usr/bin/python3
+#
+# Open the door ahead of someone driving home, so it's finished opening as they pull in.
+#
+# The geofence only opens the door once a position lands inside it, so the car waits in the driveway for the
+# door's whole 15-20 seconds of travel. Instead, every position the webhook gets for a member is followed here:
+# their distance from home goes through a small alpha-beta filter, which smooths it and gives how fast it's
+# closing. From that comes an ETA, and the open is timed to go at ETA minus the door's (learned, traveltime.py)
+# opening time.
+#
+# It's careful about it:
+#   - nothing's planned until a member has sent minReports positions, closing at minSpeed or better, from within
+#     maxDistance km. Walking home doesn't open the door.
+#   - nothing's planned more than maxLead seconds ahead of the arrival, where the ETA isn't worth much
+#   - when the open's due: the door has to be closed, the car mustn't be in the garage already (then whoever's
+#     coming isn't driving it), and the member's latest position has to be recent and still closing
+#   - turnAway positions in a row each further away than the last (turned off, or back) cancel a planned open.
+#     One isn't enough, a phone's GPS wanders more than that. If the door's already been opened for them it's
+#     closed again, as it is if they haven't got home grace seconds after they were due. But never onto the car:
+#     not if it's in the garage, or the parking assist is watching it come in.
+#
+# garagesecret.py turns it on, with any of the settings below:
+#
+# def getArrival():
+#    return {'fence': 'home', 'maxLead': 90, 'maxDistance': 3}
+# -----------------------
+
+from __future__ import print_function
+import logging
+import threading
+import time
+
+__author__ = "Ryan Hunt <ryan@ryanhunt.net>"
+__copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
+
+DEFAULTS = {
+	'fence': "home",
+	# seconds: furthest ahead of an arrival we'll act on, and how late it can be before we give up on it
+	'maxLead': 90,
+	'grace': 120,
+	# km: positions further out aren't followed
+	'maxDistance': 3.0,
+	# km/s (about 11 km/h): anything slower isn't a car coming home
+	'minSpeed': 0.003,
+	'minReports': 3,
+	# km: a position this much further away than the one before is moving away, not GPS noise
+	'noise': 0.03,
+	# positions in a row moving away before it counts as turning away
+	'turnAway': 2,
+	# seconds without a position before a member's track is forgotten
+	'staleAfter': 180,
+	# the filter's gains for distance and speed
+	'alpha': 0.6,
+	'beta': 0.3,
+}
+
+
+class Approach():
+	# One member's distance from home (km) and how fast it's changing (km/s, negative coming home), from an
+	# alpha-beta filter: predict where they should be now, then move the estimates part way towards what's reported.
+	def __init__(self, alpha, beta, turnAway=2):
+		self.alpha = alpha
+		self.beta = beta
+		self.turnAway = turnAway
+
+		self.t = None
+		self.distance = None
+		self.speed = 0.0
+		self.measured = None
+		self.reports = 0
+		# positions in a row that have been further away than the one before, with the filter agreeing
+		self.away = 0
+		self.receding = False
+
+	def update(self, t, distance, noise):
+		if self.t is None:
+			(self.t, self.distance, self.measured, self.reports) = (t, distance, distance, 1)
+			return
+
+		dt = t - self.t
+		if (dt <= 0):
+			# the same report again, or one that's arrived out of order
+			return
+
+		if (self.reports == 1):
+			# the first speed comes straight from two positions, rather than creeping up on it from standing still
+			self.speed = (distance - self.measured) / dt
+			self._moved(distance, noise)
+			(self.t, self.distance, self.measured, self.reports) = (t, distance, distance, 2)
+			return
+
+		predicted = self.distance + self.speed * dt
+		residual = distance - predicted
+		self.distance = predicted + self.alpha * residual
+		self.speed += self.beta * residual / dt
+
+		self._moved(distance, noise)
+		(self.t, self.measured) = (t, distance)
+		self.reports += 1
+
+	def _moved(self, distance, noise):
+		if (distance > self.measured + noise and self.speed > 0):
+			self.away += 1
+		else:
+			self.away = 0
+		self.receding = (self.away >= self.turnAway)
+
+	# seconds until they're home at the speed they're closing, or None if they aren't
+	def eta(self, minSpeed):
+		if (self.receding or self.speed > -minSpeed):
+			return None
+		return max(0.0, self.distance) / -self.speed
+
+
+class ArrivalPredictor():
+	# openDoor(reason) and closeDoor(reason) move the door (True if it's doing it), status() is the latest
+	# Garage.status() fields and timeOpen() how long the door takes to open. parking(), if given, is True while
+	# the parking assist is watching a car come in.
+	def __init__(self, home, openDoor, closeDoor, status, timeOpen, settings=None, parking=None):
+		self.home = home
+		self.openDoor = openDoor
+		self.closeDoor = closeDoor
+		self.status = status
+		self.timeOpen = timeOpen
+		self.parking = parking
+		self.settings = dict(DEFAULTS, **(settings or {}))
+
+		self._lock = threading.Lock()
+		# member -> Approach, and what's been planned or done for them: {'at', 'arrival'} / {'opened', 'arrival'}
+		self.tracks = {}
+		self.plans = {}
+		self.opened = {}
+
+	@classmethod
+	def fromSecret(cls, sekret, geofences, openDoor, closeDoor, status, timeOpen, parking=None):
+		if not hasattr(sekret, 'getArrival'):
+			return None
+		settings = dict(DEFAULTS, **sekret.getArrival())
+		home = geofences.get(settings['fence'])
+		if home is None:
+			raise ValueError("No geofence called {0} to predict arrivals at".format(settings['fence']))
+		return cls(home, openDoor, closeDoor, status, timeOpen, settings, parking)
+
+	# A position for member (a geofence.toVector()). Returns True if they've just got home to a door we opened for them.
+	def report(self, member, vector, now=None):
+		if now is None:
+			now = time.time()
+		s = self.settings
+
+		with self._lock:
+			if self.home.contains(vector):
+				self.tracks.pop(member, None)
+				self.plans.pop(member, None)
+				if (self.opened.pop(member, None) is not None):
+					logging.info("%s is home, the door was open in time", member)
+					return True
+				return False
+
+			distance = self.home.distance(vector)
+			track = self.tracks.get(member)
+			if (distance > s['maxDistance'] or (track is not None and now - track.t > s['staleAfter'])):
+				track = None
+				self.tracks.pop(member, None)
+				self._cancel(member, "too far away to tell")
+				if (distance > s['maxDistance']):
+					return False
+
+			if track is None:
+				track = self.tracks[member] = Approach(s['alpha'], s['beta'], s['turnAway'])
+			track.update(now, distance, s['noise'])
+
+			if (member in self.opened and track.receding):
+				self._closeAgain(member, "{0} turned away".format(member))
+				return False
+
+			eta = track.eta(s['minSpeed'])
+			if (eta is None or track.reports < s['minReports']):
+				self._cancel(member, "{0} turned away".format(member) if track.receding else None)
+				return False
+
+			if (member in self.opened):
+				self.opened[member]['arrival'] = now + eta
+				return False
+
+			if (eta > s['maxLead']):
+				self._cancel(member, None)
+				return False
+
+			at = now + max(0.0, eta - self.timeOpen())
+			if member not in self.plans:
+				logging.info("%s is %.2fkm away, closing at %.0fkm/h: home in %.0fs, opening the door at %s", member, track.distance, -track.speed * 3600, eta, time.strftime("%H:%M:%S", time.localtime(at)))
+			self.plans[member] = {'at': at, 'arrival': now + eta}
+			return False
+
+	def _cancel(self, member, reason):
+		if (self.plans.pop(member, None) is not None and reason):
+			logging.info("Not opening the door ahead of %s: %s", member, reason)
+
+	def _closeAgain(self, member, reason):
+		self.opened.pop(member, None)
+		status = self.status()
+		if (status.get('doorState') != "open"):
+			return
+		if (status.get('carPresent') == 1 or (self.parking is not None and self.parking())):
+			# whoever it is has got home after all, or someone's driving in
+			logging.info("Leaving the door we opened for %s open (%s): there's a car in the way", member, reason)
+			return
+		logging.warning("Closing the door we opened for %s: %s", member, reason)
+		self.closeDoor(reason)
+
+	# Called every second or so: opens the door for a plan that's due, closes it for someone who never came.
+	def tick(self, now=None):
+		if now is None:
+			now = time.time()
+		s = self.settings
+
+		with self._lock:
+			for (member, done) in list(self.opened.items()):
+				if (now > done['arrival'] + s['grace']):
+					self._closeAgain(member, "{0} didn't get home".format(member))
+
+			for (member, plan) in list(self.plans.items()):
+				if (now < plan['at']):
+					continue
+				del self.plans[member]
+
+				track = self.tracks.get(member)
+				status = self.status()
+				if (track is None or now - track.t > s['staleAfter'] or track.eta(s['minSpeed']) is None):
+					reason = "lost track of them"
+				elif (status.get('doorState') != "closed"):
+					reason = "the door's {0}".format(status.get('doorState'))
+				elif (status.get('carPresent') == 1):
+					reason = "the car's in the garage, so they're not driving it"
+				elif not self.openDoor("{0}, home in {1:.0f}s".format(member, plan['arrival'] - now)):
+					reason = "the door's busy"
+				else:
+					self.opened[member] = {'opened': now, 'arrival': plan['arrival']}
+					continue
+				logging.info("Not opening the door ahead of %s: %s", member, reason)
@@ -0,0 +1,694 @@
+#!/usr/bin/python3
+#
+# A local pub/sub bus for home automation, speaking MQTT 3.1.1, so Home Assistant, Node-RED, mosquitto_sub and
+# friends can follow the garage without each of them scraping main.py --json (and reading the sensors again).
+#
+# The daemon (garage-daemon.py --bus 1883) runs the broker itself, on localhost, and publishes each reading to a
+# topic when it changes, and only then, as a retained message, so a new subscriber gets the latest of everything
+# straight away:
+#
+#   garage/door                      closed, open, ventilate, operating, error
+#   garage/car                       1 or 0
+#   garage/climate/temperature       (and humidity, heatIndex) from the DHT11
+#   garage/weather/temperature       (and humidity, heatIndex, rainfall, location) from OWM
+#   garage/door/since                when the door got to the state it's in (seconds since the epoch)
+#   garage/health/dht11              {"state": "failing", "failures": 3, ...} for each sensor worker (supervisor.py)
+#
+# Publishing open, close, ventilate or ifttt to garage/door/set, at QoS 1, moves the door. The PUBACK goes back
+# once the command has been handed to the daemon's DoorCommander (so it has the same cooldown as the webhook),
+# and how that went is published to garage/door/result. A command sent again with the DUP flag (the client
+# didn't see the PUBACK) within DUPLICATE_WINDOW seconds is acknowledged but not run twice. Nothing else under
+# garage/ can be published by a client. Other topics are passed along like any broker would.
+#
+# If garagesecret.py has getBusPassword(), clients have to give it to connect. getBusReadPassword() is a second,
+# read-only one (for hub.py): a client that connects with it can subscribe, but is cut off if it publishes anything,
+# so it can't move the door. Sessions are always clean (no subscriptions or messages are kept for a client that's
+# gone), QoS 2 isn't supported, and anything sent at QoS 2 is delivered at 1.
+#
+# MQTT sends the password as it is, so off localhost the bus has to be behind TLS: getBusTLS() returns
+# {'cert': path, 'key': path} for the broker's certificate (a self-signed one will do, clients are given it to
+# trust). The daemon won't listen anywhere but localhost without a password and TLS. Otherwise, keep it on
+# localhost and reach it through a tunnel (ssh -L 1883:localhost:1883 site).
+#
+#   ./bus.py                               a broker on its own, for trying things out (commands are just logged)
+#   ./bus.py sub 'garage/#'                print what's published
+#   ./bus.py pub garage/door/set open      publish (at QoS 1)
+# -----------------------
+
+from __future__ import print_function
+import argparse
+import hmac
+import json
+import logging
+import queue
+import socket
+import socketserver
+import ssl
+import struct
+import sys
+import threading
+import time
+
+__author__ = "Ryan Hunt <ryan@ryanhunt.net>"
+__copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
+
+DEFAULT_PORT = 1883
+
+PREFIX = "garage/"
+
+# Garage.status() field -> topic, under PREFIX
+TOPICS = {
+	'doorState': "door",
+	'carPresent': "car",
+	'temperature': "climate/temperature",
+	'humidity': "climate/humidity",
+	'heatIndex': "climate/heatIndex",
+	'weatherLocation': "weather/location",
+	'oTemperature': "weather/temperature",
+	'oHumidity': "weather/humidity",
+	'oHeatIndex': "weather/heatIndex",
+	'rainfall': "weather/rainfall",
+}
+
+COMMAND = "door/set"
+RESULT = "door/result"
+DOOR_SINCE = "door/since"
+HEALTH = "health/"
+
+# seconds a command's (client, packet id) is remembered, to spot a redelivery
+DUPLICATE_WINDOW = 30
+
+# nobody sends us anything this big
+MAX_PACKET = 65536
+
+# messages waiting to go to one subscriber, beyond that it's too slow and is dropped
+MAX_QUEUED = 1000
+
+# seconds a client has to finish the TLS handshake
+HANDSHAKE_TIMEOUT = 10
+
+# packet types
+CONNECT = 1
+CONNACK = 2
+PUBLISH = 3
+PUBACK = 4
+SUBSCRIBE = 8
+SUBACK = 9
+UNSUBSCRIBE = 10
+UNSUBACK = 11
+PINGREQ = 12
+PINGRESP = 13
+DISCONNECT = 14
+
+# CONNACK return codes
+ACCEPTED = 0
+BAD_PROTOCOL = 1
+BAD_CLIENT_ID = 2
+BAD_PASSWORD = 4
+
+# what a password lets a client do
+FULL = "full"
+READ_ONLY = "read"
+
+
+class ProtocolError(Exception):
+	pass
+
+
+def _string(text):
+	data = text.encode('utf-8')
+	return struct.pack(">H", len(data)) + data
+
+
+def packet(kind, flags, body=b""):
+	length = len(body)
+	header = bytearray([kind << 4 | flags])
+	while True:
+		(length, digit) = divmod(length, 128)
+		header.append(digit | (0x80 if length else 0))
+		if not length:
+			return bytes(header) + body
+
+
+def publishPacket(topic, payload, qos=0, retain=False, packetId=None, dup=False):
+	body = _string(topic)
+	if qos:
+		body += struct.pack(">H", packetId)
+	return packet(PUBLISH, (dup << 3) | (qos << 1) | retain, body + payload)
+
+
+# a clean session CONNECT, as a client sends it. will: (topic, payload) published at QoS 1 if the client goes
+def connectPacket(clientId="", password=None, keepalive=60, will=None):
+	flags = 0x02
+	body = _string("MQTT") + bytes([4])
+	if will is not None:
+		flags |= 0x04 | (1 << 3)
+	if password is not None:
+		flags |= 0xc0
+	body += bytes([flags]) + struct.pack(">H", keepalive) + _string(clientId)
+	if will is not None:
+		body += _string(will[0]) + _string(will[1])
+	if password is not None:
+		body += _string("garage") + _string(password)
+	return packet(CONNECT, 0, body)
+
+
+def subscribePacket(packetId, filters, qos=1):
+	return packet(SUBSCRIBE, 0x02, struct.pack(">H", packetId) + b"".join(_string(f) + bytes([qos]) for f in filters))
+
+
+# (topic, payload, qos, packet id, retained) of a PUBLISH sent to a client
+def parsePublish(flags, body):
+	r = _Reader(body)
+	topic = r.string()
+	qos = (flags >> 1) & 0x03
+	packetId = r.short() if qos else None
+	return (topic, r.rest(), qos, packetId, bool(flags & 0x01))
+
+
+# (type, flags, body) of the next packet from a file-like f, EOFError at the end
+def readPacket(f):
+	first = f.read(1)
+	if not first:
+		raise EOFError()
+	(length, shift) = (0, 0)
+	for i in range(4):
+		byte = f.read(1)
+		if not byte:
+			raise EOFError()
+		length |= (byte[0] & 0x7f) << shift
+		shift += 7
+		if not (byte[0] & 0x80):
+			break
+	else:
+		raise ProtocolError("Bad remaining length")
+	if (length > MAX_PACKET):
+		raise ProtocolError("Packet too big ({0} bytes)".format(length))
+	body = f.read(length)
+	if (len(body) < length):
+		raise EOFError()
+	return (first[0] >> 4, first[0] & 0x0f, body)
+
+
+class _Reader():
+	def __init__(self, body):
+		self.body = body
+		self.at = 0
+
+	def short(self):
+		if (self.at + 2 > len(self.body)):
+			raise ProtocolError("Packet too short")
+		self.at += 2
+		return struct.unpack_from(">H", self.body, self.at - 2)[0]
+
+	def byte(self):
+		if (self.at >= len(self.body)):
+			raise ProtocolError("Packet too short")
+		self.at += 1
+		return self.body[self.at - 1]
+
+	def data(self):
+		length = self.short()
+		if (self.at + length > len(self.body)):
+			raise ProtocolError("Packet too short")
+		self.at += length
+		return self.body[self.at - length:self.at]
+
+	def string(self):
+		try:
+			return self.data().decode('utf-8')
+		except UnicodeDecodeError:
+			raise ProtocolError("Bad UTF-8")
+
+	def rest(self):
+		return self.body[self.at:]
+
+	def more(self):
+		return self.at < len(self.body)
+
+
+def validFilter(topicFilter):
+	levels = topicFilter.split("/")
+	for (i, level) in enumerate(levels):
+		if ("#" in level and (level != "#" or i != len(levels) - 1)):
+			return False
+		if ("+" in level and level != "+"):
+			return False
+	return bool(topicFilter)
+
+
+def matches(topicFilter, topic):
+	levels = topic.split("/")
+	# wildcards at the start don't match $SYS and the like
+	system = topic.startswith("$")
+	for (i, level) in enumerate(topicFilter.split("/")):
+		if (level == "#"):
+			return not (i == 0 and system)
+		if (i >= len(levels)):
+			return False
+		if (level == "+"):
+			if (i == 0 and system):
+				return False
+			continue
+		if (level != levels[i]):
+			return False
+	return len(topicFilter.split("/")) == len(levels)
+
+
+class BusHandler(socketserver.StreamRequestHandler):
+	# one per client connection, reading on the server's thread for it. What's sent to the client goes through
+	# a queue and its own writer thread, so a slow subscriber never holds up whoever's publishing.
+	def setup(self):
+		socketserver.StreamRequestHandler.setup(self)
+		self.clientId = None
+		self.readOnly = False
+		self.subscriptions = {}
+		self.will = None
+		self._nextId = 0
+		self._outbox = queue.Queue(MAX_QUEUED)
+		self._writer = threading.Thread(target=self._write, name="Bus writer")
+		self._writer.daemon = True
+		self._writer.start()
+
+	def handle(self):
+		try:
+			if isinstance(self.connection, ssl.SSLSocket):
+				self.connection.settimeout(HANDSHAKE_TIMEOUT)
+				self.connection.do_handshake()
+				self.connection.settimeout(None)
+			self._connect()
+			while True:
+				(kind, flags, body) = readPacket(self.rfile)
+				if not self._dispatch(kind, flags, body):
+					self.will = None
+					return
+		except (EOFError, OSError, ProtocolError) as e:
+			logging.debug("Bus client %s gone: %s", self.clientId, e or type(e).__name__)
+		finally:
+			self.server.drop(self)
+			# let whatever's queued (a refusing CONNACK, say) go out before the connection's closed
+			try:
+				self._outbox.put_nowait(None)
+			except queue.Full:
+				self._close()
+			self._writer.join(2)
+
+	def _connect(self):
+		(kind, flags, body) = readPacket(self.rfile)
+		if (kind != CONNECT):
+			raise ProtocolError("Expected CONNECT")
+		r = _Reader(body)
+		(name, level) = (r.string(), r.byte())
+		connectFlags = r.byte()
+		keepalive = r.short()
+		if not ((name, level) in (("MQTT", 4), ("MQIsdp", 3))):
+			self._send(packet(CONNACK, 0, bytes([0, BAD_PROTOCOL])))
+			raise ProtocolError("Unsupported protocol {0} {1}".format(name, level))
+
+		clientId = r.string()
+		will = None
+		if (connectFlags & 0x04):
+			willTopic = r.string()
+			will = (willTopic, r.data(), min(1, (connectFlags >> 3) & 0x03), bool(connectFlags & 0x20))
+		username = r.string() if (connectFlags & 0x80) else None
+		password = r.data().decode('utf-8', 'replace') if (connectFlags & 0x40) else None
+
+		if (not clientId and not (connectFlags & 0x02)):
+			self._send(packet(CONNACK, 0, bytes([0, BAD_CLIENT_ID])))
+			raise ProtocolError("Persistent session without a client id")
+		access = self.server.authenticate(password)
+		if access is None:
+			self._send(packet(CONNACK, 0, bytes([0, BAD_PASSWORD])))
+			raise ProtocolError("Bad password from {0}".format(self.client_address[0]))
+		self.readOnly = (access == READ_ONLY)
+		# only now: a refused client's will would otherwise be published when it's dropped
+		self.will = will
+
+		self.clientId = clientId or "anon-{0}".format(id(self))
+		if keepalive:
+			# the spec gives a client half as long again as its keepalive before it's given up on
+			self.connection.settimeout(keepalive * 1.5)
+		self._send(packet(CONNACK, 0, bytes([0, ACCEPTED])))
+		self.server.join(self)
+		logging.debug("Bus client %s (%s) connected", self.clientId, username)
+
+	# returns False when the client disconnects
+	def _dispatch(self, kind, flags, body):
+		r = _Reader(body)
+
+		if (kind == PUBLISH):
+			qos = (flags >> 1) & 0x03
+			if (qos == 3):
+				raise ProtocolError("Bad QoS")
+			topic = r.string()
+			if ("+" in topic or "#" in topic or not topic):
+				raise ProtocolError("Bad topic to publish to")
+			if self.readOnly:
+				logging.warning("Bus client %s tried to publish to %s with the read-only password", self.clientId, topic)
+				raise ProtocolError("Read-only client published")
+			packetId = r.short() if qos else None
+			self.server.receive(self, topic, r.rest(), min(qos, 1), bool(flags & 0x01), bool(flags & 0x08), packetId)
+			if qos:
+				# QoS 2 is acknowledged like 1, it's at least once rather than exactly once
+				self._send(packet(PUBACK, 0, struct.pack(">H", packetId)))
+
+		elif (kind == SUBSCRIBE):
+			packetId = r.short()
+			granted = []
+			filters = []
+			while r.more():
+				(topicFilter, qos) = (r.string(), r.byte() & 0x03)
+				if validFilter(topicFilter):
+					self.subscriptions[topicFilter] = min(qos, 1)
+					granted.append(min(qos, 1))
+					filters.append(topicFilter)
+				else:
+					granted.append(0x80)
+			self._send(packet(SUBACK, 0, struct.pack(">H", packetId) + bytes(granted)))
+			self.server.sendRetained(self, filters)
+
+		elif (kind == UNSUBSCRIBE):
+			packetId = r.short()
+			while r.more():
+				self.subscriptions.pop(r.string(), None)
+			self._send(packet(UNSUBACK, 0, struct.pack(">H", packetId)))
+
+		elif (kind == PINGREQ):
+			self._send(packet(PINGRESP, 0))
+
+		elif (kind == DISCONNECT):
+			return False
+
+		elif (kind != PUBACK):
+			raise ProtocolError("Unexpected packet type {0}".format(kind))
+
+		return True
+
+	# the QoS this client gets topic at, None if it's not subscribed
+	def wants(self, topic):
+		qos = None
+		for (topicFilter, granted) in list(self.subscriptions.items()):
+			if matches(topicFilter, topic):
+				qos = max(granted, qos if qos is not None else 0)
+		return qos
+
+	def deliver(self, topic, payload, qos, retain=False):
+		packetId = None
+		if qos:
+			self._nextId = self._nextId % 65535 + 1
+			packetId = self._nextId
+		self._send(publishPacket(topic, payload, qos, retain, packetId))
+
+	def _send(self, data):
+		try:
+			self._outbox.put_nowait(data)
+		except queue.Full:
+			logging.warning("Bus client %s isn't keeping up, dropping it", self.clientId)
+			self._close()
+
+	def _write(self):
+		while True:
+			data = self._outbox.get()
+			if data is None:
+				return
+			try:
+				self.connection.sendall(data)
+			except OSError:
+				self._close()
+				return
+
+	def _close(self):
+		try:
+			self.connection.shutdown(socket.SHUT_RDWR)
+		except OSError:
+			pass
+
+
+class Broker(socketserver.ThreadingMixIn, socketserver.TCPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+
+	# command(name) is called for what's published to garage/door/set, and returns True if the door's going to
+	# do it, False if it's busy, or None if it's not a command it knows.
+	# tls is an ssl.SSLContext (see serverContext()) to wrap every connection in, or None.
+	def __init__(self, address=("127.0.0.1", DEFAULT_PORT), command=None, password=None, prefix=PREFIX, readPassword=None, tls=None):
+		self.command = command
+		self.password = password
+		self.readPassword = readPassword
+		self.tls = tls
+		self.prefix = prefix
+
+		self.retained = {}
+		self.clients = set()
+		self._lock = threading.Lock()
+		# (client id, packet id) -> when, for commands
+		self._recent = {}
+
+		socketserver.TCPServer.__init__(self, address, BusHandler)
+
+	# FULL or READ_ONLY for the password a client gave, None to turn it away
+	def authenticate(self, password):
+		if not (self.password or self.readPassword):
+			return FULL
+		if password is None:
+			return None
+		given = password.encode('utf-8')
+		# both compared every time, so how long it takes doesn't say which one was nearly right
+		full = bool(self.password) and hmac.compare_digest(given, self.password.encode('utf-8'))
+		read = bool(self.readPassword) and hmac.compare_digest(given, self.readPassword.encode('utf-8'))
+		if full:
+			return FULL
+		return READ_ONLY if read else None
+
+	# the handshake's left to the client's own thread (BusHandler), so a slow one can't hold up accepting others
+	def get_request(self):
+		(connection, address) = self.socket.accept()
+		if self.tls is not None:
+			connection = self.tls.wrap_socket(connection, server_side=True, do_handshake_on_connect=False)
+		return (connection, address)
+
+	def join(self, client):
+		with self._lock:
+			self.clients.add(client)
+
+	def drop(self, client):
+		with self._lock:
+			self.clients.discard(client)
+		if client.will is not None:
+			(topic, payload, qos, retain) = client.will
+			client.will = None
+			self.receive(client, topic, payload, qos, retain)
+
+	def sendRetained(self, client, filters):
+		with self._lock:
+			retained = list(self.retained.items())
+		for (topic, payload) in retained:
+			qos = max([client.subscriptions[f] for f in filters if matches(f, topic)] or [None])
+			if qos is not None:
+				client.deliver(topic, payload, qos, retain=True)
+
+	# Publish to everyone subscribed. A retained topic is only published if its payload has changed.
+	def publish(self, topic, payload, retain=True, qos=1):
+		if not isinstance(payload, bytes):
+			payload = str(payload).encode('utf-8')
+
+		with self._lock:
+			if retain:
+				if (self.retained.get(topic) == payload):
+					return False
+				if payload:
+					self.retained[topic] = payload
+				else:
+					self.retained.pop(topic, None)
+			clients = list(self.clients)
+
+		for client in clients:
+			wanted = client.wants(topic)
+			if wanted is not None:
+				client.deliver(topic, payload, min(qos, wanted))
+		return True
+
+	# some Garage.status() fields, each published to its topic if it's changed
+	def update(self, fields):
+		for (name, value) in fields.items():
+			if (name in TOPICS and value is not None):
+				changed = self.publish(self.prefix + TOPICS[name], value)
+				if (changed and name == 'doorState'):
+					self.publish(self.prefix + DOOR_SINCE, "{0:.0f}".format(time.time()))
+
+	# the sensor workers' supervisor.py health, each published to its topic if it's changed
+	def health(self, workers):
+		for worker in workers:
+			summary = dict((key, worker.get(key)) for key in ('state', 'failures', 'restarts', 'lastError'))
+			self.publish(self.prefix + HEALTH + worker['name'], json.dumps(summary, sort_keys=True))
+
+	# a client published something
+	def receive(self, client, topic, payload, qos, retain, dup=False, packetId=None):
+		if client.readOnly:
+			# its will, the only way one gets here
+			return
+		if (topic == self.prefix + COMMAND):
+			self._command(client, payload.decode('utf-8', 'replace').strip().lower(), dup, packetId)
+		elif topic.startswith(self.prefix):
+			logging.warning("Bus client %s tried to publish to %s, only the daemon does that", client.clientId, topic)
+		else:
+			self.publish(topic, payload, retain, qos)
+
+	def _command(self, client, name, dup, packetId):
+		now = time.time()
+		key = (client.clientId, packetId)
+		with self._lock:
+			for (k, t) in list(self._recent.items()):
+				if (now - t > DUPLICATE_WINDOW):
+					del self._recent[k]
+			again = (packetId is not None and dup and key in self._recent)
+			if packetId is not None:
+				self._recent[key] = now
+		if again:
+			logging.info("Bus client %s sent %s again, already done", client.clientId, name)
+			return
+
+		accepted = self.command(name) if self.command is not None else None
+		result = {None: "unknown", True: "accepted", False: "busy"}[accepted]
+		logging.info("Bus command from %s: %s (%s)", client.clientId, name, result)
+		self.publish(self.prefix + RESULT, json.dumps({'command': name, 'result': result, 'client': client.clientId}), retain=False)
+
+
+# an SSLContext for a broker with the certificate (and its key) in these files
+def serverContext(cert, key=None):
+	context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+	context.load_cert_chain(cert, key)
+	return context
+
+
+# an SSLContext for a client, trusting the broker's certificate in cafile (the system's CAs without it).
+# A self-signed certificate is usually for the site's name rather than the address it's reached at, so
+# checking the name can be left off: trusting only that certificate is what matters.
+def clientContext(cafile=None, checkHostname=True):
+	context = ssl.create_default_context(cafile=cafile)
+	context.check_hostname = checkHostname
+	return context
+
+
+# Start the broker on a background thread.
+def start(port=DEFAULT_PORT, address="127.0.0.1", command=None, password=None, readPassword=None, tls=None):
+	broker = Broker((address, port), command=command, password=password, readPassword=readPassword, tls=tls)
+	thread = threading.Thread(target=broker.serve_forever, name="Bus")
+	thread.daemon = True
+	thread.start()
+	return broker
+
+
+class Client():
+	# Just enough of an MQTT client for the command line here (and trying the broker out)
+	# tls: an ssl.SSLContext for a broker behind TLS (see clientContext())
+	def __init__(self, host="127.0.0.1", port=DEFAULT_PORT, clientId="", password=None, keepalive=60, tls=None):
+		self._socket = socket.create_connection((host, port), timeout=10)
+		if tls is not None:
+			self._socket = tls.wrap_socket(self._socket, server_hostname=host)
+		self._file = self._socket.makefile("rb")
+		self._nextId = 0
+		self._pending = []
+
+		self._socket.sendall(connectPacket(clientId, password, keepalive))
+
+		(kind, flags, body) = readPacket(self._file)
+		if (kind != CONNACK or body[1] != ACCEPTED):
+			raise IOError("Connection refused ({0})".format(body[1] if len(body) > 1 else kind))
+		# ping if nothing's come in for half the keepalive, so the broker doesn't give up on us
+		self._socket.settimeout(keepalive / 2.0 if keepalive else None)
+
+	def _id(self):
+		self._nextId = self._nextId % 65535 + 1
+		return self._nextId
+
+	# the next packet of 'kind', keeping any messages that arrive first for messages()
+	def _expect(self, kind):
+		while True:
+			(got, flags, body) = readPacket(self._file)
+			if (got == kind):
+				return body
+			if (got == PUBLISH):
+				self._pending.append(self._received(flags, body))
+
+	def _received(self, flags, body):
+		(topic, payload, qos, packetId, retained) = parsePublish(flags, body)
+		if qos:
+			self._socket.sendall(packet(PUBACK, 0, struct.pack(">H", packetId)))
+		return (topic, payload, retained)
+
+	def subscribe(self, *filters, **kwargs):
+		qos = kwargs.get('qos', 1)
+		self._socket.sendall(subscribePacket(self._id(), filters, qos))
+		return list(self._expect(SUBACK)[2:])
+
+	def publish(self, topic, payload, qos=1, retain=False):
+		if not isinstance(payload, bytes):
+			payload = str(payload).encode('utf-8')
+		packetId = self._id() if qos else None
+		self._socket.sendall(publishPacket(topic, payload, qos, retain, packetId))
+		if qos:
+			self._expect(PUBACK)
+
+	# (topic, payload, retained) as they arrive
+	def messages(self):
+		while True:
+			while self._pending:
+				yield self._pending.pop(0)
+			try:
+				(kind, flags, body) = readPacket(self._file)
+			except socket.timeout:
+				self._socket.sendall(packet(PINGREQ, 0))
+				continue
+			if (kind == PUBLISH):
+				yield self._received(flags, body)
+
+	def close(self):
+		try:
+			self._socket.sendall(packet(DISCONNECT, 0))
+		finally:
+			self._file.close()
+			self._socket.close()
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='The garage\'s MQTT bus: run a broker, or publish/subscribe to one.')
+	parser.add_argument("action", nargs="?", choices=("broker", "sub", "pub"), default="broker", help="what to do (default: run a broker)")
+	parser.add_argument("topic", nargs="?", help="topic (filter) to subscribe or publish to")
+	parser.add_argument("message", nargs="?", default="", help="what to publish")
+	parser.add_argument("-H", "--host", default="127.0.0.1", help="broker to connect to, or address to listen on (default 127.0.0.1)")
+	parser.add_argument("-p", "--port", type=int, default=DEFAULT_PORT, help="port (default {0})".format(DEFAULT_PORT))
+	parser.add_argument("-P", "--password", help="password, if the broker wants one")
+	parser.add_argument("-R", "--read-password", dest="readPassword", help="a read-only password for the broker to take as well")
+	parser.add_argument("--cert", help="broker: serve TLS with this certificate (and key, --key). Client: trust it and connect with TLS")
+	parser.add_argument("--key", help="the broker's private key, if it isn't in --cert")
+	parser.add_argument("-r", "--retain", help="publish as a retained message", action='store_true')
+	args = parser.parse_args()
+
+	logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+	if (args.action == "broker"):
+		commands = ("open", "close", "ventilate", "ifttt")
+		tls = serverContext(args.cert, args.key) if args.cert else None
+		broker = Broker((args.host, args.port), command=lambda name: True if name in commands else None, password=args.password, readPassword=args.readPassword, tls=tls)
+		logging.info("Broker listening on %s:%d", args.host, args.port)
+		try:
+			broker.serve_forever()
+		except KeyboardInterrupt:
+			pass
+	elif not args.topic:
+		parser.error("{0} needs a topic".format(args.action))
+	else:
+		client = Client(args.host, args.port, password=args.password, tls=clientContext(args.cert, checkHostname=False) if args.cert else None)
+		try:
+			if (args.action == "pub"):
+				client.publish(args.topic, args.message, retain=args.retain)
+			else:
+				client.subscribe(args.topic)
+				for (topic, payload, retained) in client.messages():
+					print("{0} {1}{2}".format(topic, payload.decode('utf-8', 'replace'), " (retained)" if retained else ""))
+					sys.stdout.flush()
+		except KeyboardInterrupt:
+			pass
+		finally:
+			client.close()
@@ -0,0 +1,132 @@
+#!/usr/bin/python3
+#
+# Daemon settings, from an optional JSON file, that can be changed without a restart.
+#
+# Start the daemon with --config /etc/garage.json, edit the file, then send it SIGHUP (or run
+# garage-daemon.py --reload). The file is read again, compared with what's running, and only what changed is
+# applied: a new warning time doesn't touch the GPIO, a new reed pin doesn't restart the weather worker. The door
+# monitoring carries on throughout. Any setting left out keeps its default:
+#
+#   {
+#       "warningTime": 30,
+#       "safeOpenTime": 30, "safeVentilateTime": 1800,
+#       "ventilationPercent": 10,
+#       "pollInterval": 0.5, "carInterval": 60, "carClosedInterval": 900, "climateInterval": 60, "weatherInterval": 600,
+#       "parkingStop": 40,
+#       "pins": {"relay": 4, "reedBottom": 17, "reedTop": 18, "trigger": 24, "echo": 25, "dht11": 21}
+#   }
+#
+# A file that can't be read, or has a bad value in it, is ignored as a whole and the running settings stay.
+# -----------------------
+
+from __future__ import print_function
+import copy
+import json
+
+__author__ = "Ryan Hunt <ryan@ryanhunt.net>"
+__copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
+
+DEFAULTS = {
+	'warningTime': 30,
+	'safeOpenTime': 30.0,
+	'safeVentilateTime': 1800.0,
+	'ventilationPercent': 10,
+	'pollInterval': 0.5,
+	'carInterval': 60,
+	'carClosedInterval': 900,
+	'climateInterval': 60,
+	'weatherInterval': 600,
+	'parkingStop': 40,
+	'pins': {
+		'relay': 4,
+		'reedBottom': 17,
+		'reedTop': 18,
+		'trigger': 24,
+		'echo': 25,
+		'dht11': 21,
+	},
+}
+
+# (smallest, largest) allowed for each number
+LIMITS = {
+	'warningTime': (1, 86400),
+	'safeOpenTime': (1, 86400),
+	'safeVentilateTime': (1, 86400),
+	'ventilationPercent': (1, 99),
+	'pollInterval': (0.05, 10),
+	'carInterval': (1, 86400),
+	'carClosedInterval': (1, 86400),
+	'climateInterval': (1, 86400),
+	'weatherInterval': (60, 86400),
+	'parkingStop': (5, 400),
+}
+
+# BCM numbers on the 40 pin header
+PINS = range(2, 28)
+
+
+class ConfigError(ValueError):
+	pass
+
+
+def validate(config):
+	for (key, value) in config.items():
+		if (key == 'pins'):
+			if not isinstance(value, dict):
+				raise ConfigError("pins should be an object")
+			for (name, pin) in value.items():
+				if name not in DEFAULTS['pins']:
+					raise ConfigError("Unknown pin {0}".format(name))
+				if (not isinstance(pin, int) or pin not in PINS):
+					raise ConfigError("Pin {0} should be a BCM GPIO number, not {1}".format(name, pin))
+			used = list(value.values())
+			if (len(set(used)) != len(used)):
+				raise ConfigError("Two pins share a GPIO")
+			continue
+
+		if key not in DEFAULTS:
+			raise ConfigError("Unknown setting {0}".format(key))
+		if (isinstance(value, bool) or not isinstance(value, (int, float))):
+			raise ConfigError("{0} should be a number, not {1}".format(key, value))
+		(low, high) = LIMITS[key]
+		if not (low <= value <= high):
+			raise ConfigError("{0} should be between {1} and {2}, not {3}".format(key, low, high, value))
+
+
+def defaults():
+	return copy.deepcopy(DEFAULTS)
+
+
+# The settings in path, on top of the defaults. Raises ConfigError (or IOError) if it can't be used.
+def load(path):
+	with open(path) as f:
+		try:
+			given = json.load(f)
+		except ValueError as e:
+			raise ConfigError("{0} isn't valid JSON: {1}".format(path, e))
+
+	if not isinstance(given, dict):
+		raise ConfigError("{0} should hold a JSON object".format(path))
+
+	pins = given.pop('pins', {})
+	if not isinstance(pins, dict):
+		raise ConfigError("pins should be an object")
+
+	config = defaults()
+	config['pins'].update(pins)
+	config.update(given)
+	validate(config)
+	return config
+
+
+# names of the settings that differ, with pins as 'pins.relay' etc.
+def diff(old, new):
+	changed = set()
+	for key in set(old) | set(new):
+		if (key == 'pins'):
+			for pin in set(old.get('pins', {})) | set(new.get('pins', {})):
+				if (old.get('pins', {}).get(pin) != new.get('pins', {}).get(pin)):
+					changed.add("pins." + pin)
+		elif (old.get(key) != new.get(key)):
+			changed.add(key)
+	return changed
@@ -1,5 +1,4 @@
-import time
-import RPi
+from garagegpio import GPIO, clock
 
 
 # Source/Credits: 
@@ -12,9 +11,8 @@ class DHT11Result:
     ERR_MISSING_DATA = 1
     ERR_CRC = 2
 
-    error_code = ERR_NO_ERROR
-    temperature = -1
-    humidity = -1
+    # one of these per reading, keep them small
+    __slots__ = ('error_code', 'temperature', 'humidity')
 
     def __init__(self, error_code, temperature, humidity):
         self.error_code = error_code
@@ -28,22 +26,22 @@ class DHT11Result:
 class DHT11:
     'DHT11 sensor reader class for Raspberry'
 
-    __pin = 0
+    __slots__ = ('__pin',)
 
     def __init__(self, pin):
         self.__pin = pin
 
     def read(self):
-        RPi.GPIO.setup(self.__pin, RPi.GPIO.OUT)
+        GPIO.setup(self.__pin, GPIO.OUT)
 
         # send initial high
-        self.__send_and_sleep(RPi.GPIO.HIGH, 0.05)
+        self.__send_and_sleep(GPIO.HIGH, 0.05)
 
         # pull down to low
-        self.__send_and_sleep(RPi.GPIO.LOW, 0.02)
+        self.__send_and_sleep(GPIO.LOW, 0.02)
 
         # change to input using pull up
-        RPi.GPIO.setup(self.__pin, RPi.GPIO.IN, RPi.GPIO.PUD_UP)
+        GPIO.setup(self.__pin, GPIO.IN, GPIO.PUD_UP)
 
         # collect data into an array
         data = self.__collect_input()
@@ -70,8 +68,8 @@ class DHT11:
         return DHT11Result(DHT11Result.ERR_NO_ERROR, the_bytes[2], the_bytes[0])
 
     def __send_and_sleep(self, output, sleep):
-        RPi.GPIO.output(self.__pin, output)
-        time.sleep(sleep)
+        GPIO.output(self.__pin, output)
+        clock.sleep(sleep)
 
     def __collect_input(self):
         # collect the data while unchanged found
@@ -80,11 +78,14 @@ class DHT11:
         # this is used to determine where is the end of the data
         max_unchanged_count = 100
 
+        # a byte per sample rather than a list of ints, it's a few thousand samples a read
         last = -1
-        data = []
+        data = bytearray()
+        # looked up once rather than every sample, the loop's speed is the sampling rate
+        (read, pin, append) = (GPIO.input, self.__pin, data.append)
         while True:
-            current = RPi.GPIO.input(self.__pin)
-            data.append(current)
+            current = read(pin)
+            append(current)
             if last != current:
                 unchanged_count = 0
                 last = current
@@ -113,28 +114,28 @@ class DHT11:
             current_length += 1
 
             if state == STATE_INIT_PULL_DOWN:
-                if current == RPi.GPIO.LOW:
+                if current == GPIO.LOW:
                     # ok, we got the initial pull down
                     state = STATE_INIT_PULL_UP
                     continue
                 else:
                     continue
             if state == STATE_INIT_PULL_UP:
-                if current == RPi.GPIO.HIGH:
+                if current == GPIO.HIGH:
                     # ok, we got the initial pull up
                     state = STATE_DATA_FIRST_PULL_DOWN
                     continue
                 else:
                     continue
             if state == STATE_DATA_FIRST_PULL_DOWN:
-                if current == RPi.GPIO.LOW:
+                if current == GPIO.LOW:
                     # we have the initial pull down, the next will be the data pull up
                     state = STATE_DATA_PULL_UP
                     continue
                 else:
                     continue
             if state == STATE_DATA_PULL_UP:
-                if current == RPi.GPIO.HIGH:
+                if current == GPIO.HIGH:
                     # data pulled up, the length of this pull up will determine whether it is 0 or 1
                     current_length = 0
                     state = STATE_DATA_PULL_DOWN
@@ -142,7 +143,7 @@ class DHT11:
                 else:
                     continue
             if state == STATE_DATA_PULL_DOWN:
-                if current == RPi.GPIO.LOW:
+                if current == GPIO.LOW:
                     # pulled down, we store the length of the previous pull up period
                     lengths.append(current_length)
                     state = STATE_DATA_PULL_UP
@@ -0,0 +1,207 @@
+#!/usr/bin/python3
+#
+# The door state that isn't on a pin, shared by every script and process.
+#
+# Ventilate mode used to be the existence of /tmp/GarageDoor.air, and openDoor.py kept /tmp/GarageDoor.opening
+# while the door moved. Every status() check was a stat(), a crash left the markers behind, and there was no
+# way to say what was in flight or until when.
+#
+# This is a small memory-mapped file (/var/tmp/garage.state) holding one record: what was last commanded, whether
+# we're ventilating (and how far open), and the operation in flight with its deadline. Reading it is a couple of
+# struct unpacks from the mapping, with no system calls and no locks:
+#
+#   header  magic (4s), version (B), seq (Q at offset 8)
+#   slot 0  record with its own seq and CRC32
+#   slot 1  record with its own seq and CRC32
+#
+# A write goes under an flock (writers are rare), into the slot the current record isn't in, and only then is the
+# header's seq bumped to point at it (record seq N lives in slot N % 2). A reader takes the seq, reads that slot
+# and checks the seq didn't move and the CRC matches, otherwise tries again, so it never sees half a write. If a
+# process dies mid write the old record is still whole in the other slot, and opening the file picks whichever
+# slot has the newest valid record.
+#
+# An operation that's been in flight past its deadline (its process died, say) is treated as finished.
+# -----------------------
+
+from __future__ import print_function
+import collections
+import contextlib
+import fcntl
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+__author__ = "Ryan Hunt <ryan@ryanhunt.net>"
+__copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
+
+DEFAULT_PATH = "/var/tmp/garage.state"
+
+MAGIC = b"GDST"
+VERSION = 1
+
+HEADER = struct.Struct("<4sB3xQ")
+SEQ = struct.Struct("<Q")
+SEQ_OFFSET = 8
+
+# seq, ventilating, commanded, target %, operation, operation id, operation pid, started, deadline, updated
+RECORD = struct.Struct("<QBBBBIIddd")
+CRC = struct.Struct("<I")
+SLOT_SIZE = RECORD.size + CRC.size
+SIZE = HEADER.size + 2 * SLOT_SIZE
+
+# "trigger" is a plain relay pulse (openDoor.py), which way the door goes is up to the opener. Append only.
+ACTIONS = (None, "open", "close", "ventilate", "trigger")
+
+State = collections.namedtuple("State", "seq ventilating commanded target operation operationId pid started deadline updated")
+
+
+def _slotOffset(seq):
+	return HEADER.size + (seq % 2) * SLOT_SIZE
+
+
+def _pack(state):
+	body = RECORD.pack(state.seq, 1 if state.ventilating else 0, ACTIONS.index(state.commanded), int(state.target),
+		ACTIONS.index(state.operation), state.operationId, state.pid, state.started, state.deadline, state.updated)
+	return body + CRC.pack(zlib.crc32(body) & 0xffffffff)
+
+
+def _unpack(raw):
+	body = raw[:RECORD.size]
+	(crc,) = CRC.unpack_from(raw, RECORD.size)
+	if (zlib.crc32(body) & 0xffffffff != crc):
+		return None
+	(seq, ventilating, commanded, target, operation, operationId, pid, started, deadline, updated) = RECORD.unpack(body)
+	if (commanded >= len(ACTIONS) or operation >= len(ACTIONS)):
+		return None
+	return State(seq, bool(ventilating), ACTIONS[commanded], target, ACTIONS[operation], operationId, pid, started, deadline, updated)
+
+
+EMPTY = State(0, False, None, 0, None, 0, 0, 0.0, 0.0, 0.0)
+
+
+class DoorState():
+	# path=None keeps the state in this process only (e.g. when replaying a trace)
+	def __init__(self, path=DEFAULT_PATH):
+		self.path = path
+		self._lock = threading.Lock()
+		self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o666) if path else None
+
+		with self._locked():
+			if self._fd is None:
+				self._map = mmap.mmap(-1, SIZE)
+			else:
+				if (os.fstat(self._fd).st_size != SIZE):
+					os.ftruncate(self._fd, SIZE)
+				self._map = mmap.mmap(self._fd, SIZE)
+			self._recover()
+
+	def close(self):
+		self._map.close()
+		if self._fd is not None:
+			os.close(self._fd)
+
+	# flock keeps other processes out, but not other threads sharing our descriptor
+	@contextlib.contextmanager
+	def _locked(self):
+		with self._lock:
+			if self._fd is None:
+				yield
+				return
+			fcntl.flock(self._fd, fcntl.LOCK_EX)
+			try:
+				yield
+			finally:
+				fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+	# make sure the header points at the newest whole record (after a crash, or a new file)
+	def _recover(self):
+		(magic, version, seq) = HEADER.unpack_from(self._map, 0)
+		slots = [_unpack(self._map[_slotOffset(i):_slotOffset(i) + SLOT_SIZE]) for i in (0, 1)]
+		valid = [s for (i, s) in enumerate(slots) if s is not None and s.seq % 2 == i]
+
+		if (magic != MAGIC or version != VERSION or not valid):
+			self._map[:] = b"\0" * SIZE
+			self._write(EMPTY)
+			HEADER.pack_into(self._map, 0, MAGIC, VERSION, 0)
+			self._map.flush()
+			return
+
+		newest = max(valid, key=lambda s: s.seq)
+		if (newest.seq != seq):
+			SEQ.pack_into(self._map, SEQ_OFFSET, newest.seq)
+			self._map.flush()
+
+	def _write(self, state):
+		offset = _slotOffset(state.seq)
+		self._map[offset:offset + SLOT_SIZE] = _pack(state)
+
+	# Lock free. Microseconds, unless a write is happening at that very moment.
+	def read(self):
+		m = self._map
+		tries = 0
+		while True:
+			(seq,) = SEQ.unpack_from(m, SEQ_OFFSET)
+			offset = _slotOffset(seq)
+			state = _unpack(m[offset:offset + SLOT_SIZE])
+			(after,) = SEQ.unpack_from(m, SEQ_OFFSET)
+			if (state is not None and after == seq and state.seq == seq):
+				return state
+
+			tries += 1
+			if (tries % 1000 == 0):
+				# not a write in progress, the record itself is damaged. Go back to the last good one.
+				with self._locked():
+					self._recover()
+
+	def isVentilating(self):
+		return self.read().ventilating
+
+	# the operation in flight, or None (including one whose deadline has passed)
+	def operation(self, now=None):
+		state = self.read()
+		if state.operation is None:
+			return None
+		if ((time.time() if now is None else now) > state.deadline):
+			return None
+		return state
+
+	# read, change and write back the record, as one step
+	def update(self, **changes):
+		with self._locked():
+			return self._commit(self.read(), **changes)
+
+	# Claim the door for an action that should be done by 'deadline'. Returns the operation id, or None if
+	# another operation is still in flight (unless force, or it's the operation id 'replaces', being taken over).
+	# Other fields can be changed at the same time.
+	def begin(self, action, deadline, force=False, replaces=None, **changes):
+		with self._locked():
+			current = self.read()
+			if (not force and current.operation is not None and time.time() <= current.deadline and current.operationId != replaces):
+				return None
+			operationId = current.operationId + 1
+			self._commit(current, commanded=action, operation=action, operationId=operationId, pid=os.getpid(), started=time.time(), deadline=deadline, **changes)
+			return operationId
+
+	# The operation's done (or the door's been seen to arrive). Other fields, e.g. ventilating, can be set at the same time.
+	def finish(self, operationId=None, **changes):
+		with self._locked():
+			current = self.read()
+			if (operationId is not None and current.operationId != operationId):
+				# someone else's operation has started since
+				if changes:
+					self._commit(current, **changes)
+				return
+			if (current.operation is None and all(getattr(current, k) == v for (k, v) in changes.items())):
+				return
+			self._commit(current, operation=None, **changes)
+
+	# write the new record into the spare slot, then point the header at it
+	def _commit(self, current, **changes):
+		state = current._replace(seq=current.seq + 1, updated=time.time(), **changes)
+		self._write(state)
+		SEQ.pack_into(self._map, SEQ_OFFSET, state.seq)
+		self._map.flush()
+		return state
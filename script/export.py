@@ -0,0 +1,173 @@
+#!/usr/bin/python3
+#
+# Export the daemon's history (history.py) for analysis elsewhere, rather than picking through /tmp/garage.log.
+#
+#   ./export.py -f npz -o garage.npz                      every field, all the history there is
+#   ./export.py -f npy --from 2026-01-01 --to 2026-02-01 --fields humidity,oHumidity -o january.npy
+#   ./export.py -f csv --from 1767225600 > garage.csv
+#   ./export.py -f arrow -o garage.arrow                  needs pyarrow
+#
+# npz is a column per field (numpy.load(...)['humidity']), npy is one structured array (a['humidity']), and
+# arrow an Arrow IPC file of record batches. The time (seconds since the epoch) is always included. None of
+# them need NumPy to write: the .npy header is written by hand, and the data is the history's own little
+# endian bytes, a chunk at a time, so memory use stays flat however much is exported.
+#
+# The door state is a number, an index into wireformat.DOOR_STATES (255 = not known yet), except in CSV where
+# it's spelled out. Missing climate readings are NaN (empty in CSV).
+# -----------------------
+
+from __future__ import print_function
+import argparse
+import csv
+import datetime
+import io
+import struct
+import sys
+import zipfile
+from history import HistoryStore, DEFAULT_PATH, NAMES, TYPES, isMissing
+from wireformat import DOOR_STATES
+
+__author__ = "Ryan Hunt <ryan@ryanhunt.net>"
+__copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
+
+# array type code -> NumPy dtype
+DTYPES = {'d': '<f8', 'f': '<f4', 'b': '|i1', 'B': '|u1'}
+
+FORMATS = ('npz', 'npy', 'csv', 'arrow')
+
+
+def npyHeader(descr, count):
+	header = "{{'descr': {0}, 'fortran_order': False, 'shape': ({1},), }}".format(descr, count)
+	# magic, version 1.0, header length, then the header padded with spaces to a multiple of 64 and a newline
+	header += " " * (63 - (10 + len(header)) % 64) + "\n"
+	return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(header)) + header.encode('latin1')
+
+
+# rows() for exactly the 'count' records the header promised, even if the daemon adds some meanwhile
+def _rows(store, start, end, fields, count):
+	for (n, rows) in store.rows(start, end, fields):
+		if (n >= count):
+			yield rows[:count * len(rows) // n]
+			return
+		count -= n
+		yield rows
+
+
+# one structured array, a record per row
+def writeNpy(store, out, start=None, end=None, fields=NAMES):
+	descr = "[{0}]".format(", ".join("('{0}', '{1}')".format(name, DTYPES[TYPES[name]]) for name in fields))
+	count = store.count(start, end)
+	out.write(npyHeader(descr, count))
+	for rows in _rows(store, start, end, fields, count):
+		out.write(rows)
+	return count
+
+
+# a .npy per field, in a zip, as numpy.savez would
+def writeNpz(store, out, start=None, end=None, fields=NAMES, compress=False):
+	count = store.count(start, end)
+	with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED, allowZip64=True) as z:
+		for name in fields:
+			with z.open(name + ".npy", "w", force_zip64=True) as f:
+				f.write(npyHeader("'{0}'".format(DTYPES[TYPES[name]]), count))
+				for values in _rows(store, start, end, [name], count):
+					f.write(values)
+	return count
+
+
+def writeCsv(store, out, start=None, end=None, fields=NAMES):
+	text = io.TextIOWrapper(out, encoding='utf-8', newline='')
+	writer = csv.writer(text)
+	writer.writerow(fields)
+
+	count = 0
+	for chunk in store.chunks(start, end, fields):
+		columns = []
+		for name in fields:
+			if (name == 'time'):
+				columns.append(["{0:.3f}".format(v) for v in chunk[name]])
+			elif (name == 'doorState'):
+				columns.append([DOOR_STATES[v] if v < len(DOOR_STATES) else "" for v in chunk[name]])
+			elif (TYPES[name] == 'f'):
+				columns.append(["" if isMissing(name, v) else "{0:.6g}".format(v) for v in chunk[name]])
+			else:
+				columns.append(["" if isMissing(name, v) else v for v in chunk[name]])
+		rows = list(zip(*columns))
+		writer.writerows(rows)
+		count += len(rows)
+
+	text.flush()
+	text.detach()
+	return count
+
+
+# Arrow IPC file, a record batch per chunk. The columns are handed to pyarrow as they are, without copying.
+def writeArrow(store, out, start=None, end=None, fields=NAMES):
+	import pyarrow as pa
+
+	types = {'d': pa.float64(), 'f': pa.float32(), 'b': pa.int8(), 'B': pa.uint8()}
+	schema = pa.schema([(name, types[TYPES[name]]) for name in fields])
+
+	count = 0
+	with pa.ipc.new_file(out, schema) as writer:
+		for chunk in store.chunks(start, end, fields):
+			n = len(chunk[fields[0]])
+			arrays = [pa.Array.from_buffers(types[TYPES[name]], n, [None, pa.py_buffer(chunk[name])]) for name in fields]
+			writer.write_batch(pa.RecordBatch.from_arrays(arrays, schema=schema))
+			count += n
+	return count
+
+
+def export(store, out, format="npz", start=None, end=None, fields=NAMES, compress=False):
+	fields = list(fields)
+	for name in fields:
+		if name not in NAMES:
+			raise ValueError("Unknown field {0}, pick from {1}".format(name, ", ".join(NAMES)))
+	if 'time' not in fields:
+		fields.insert(0, 'time')
+
+	if (format == 'npz'):
+		return writeNpz(store, out, start, end, fields, compress)
+	if (format == 'npy'):
+		return writeNpy(store, out, start, end, fields)
+	if (format == 'csv'):
+		return writeCsv(store, out, start, end, fields)
+	if (format == 'arrow'):
+		return writeArrow(store, out, start, end, fields)
+	raise ValueError("Unknown format {0}, pick from {1}".format(format, ", ".join(FORMATS)))
+
+
+# seconds since the epoch, or an ISO date/time (local time)
+def parseTime(value):
+	try:
+		return float(value)
+	except ValueError:
+		return datetime.datetime.fromisoformat(value).timestamp()
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Export the garage daemon\'s history.')
+	parser.add_argument("-f", "--format", choices=FORMATS, default='npz', help="what to write (default npz)")
+	parser.add_argument("-o", "--output", metavar="FILE", help="write to FILE rather than standard output")
+	parser.add_argument("--from", dest="start", type=parseTime, metavar="TIME", help="from TIME (epoch seconds or ISO date/time)")
+	parser.add_argument("--to", dest="end", type=parseTime, metavar="TIME", help="up to (not including) TIME")
+	parser.add_argument("--fields", help="comma separated fields to export (default all: {0})".format(",".join(NAMES)))
+	parser.add_argument("-z", "--compress", help="deflate the arrays in an npz", action='store_true')
+	parser.add_argument("-d", "--dir", default=DEFAULT_PATH, help="the history directory (default {0})".format(DEFAULT_PATH))
+	args = parser.parse_args()
+
+	fields = args.fields.split(",") if args.fields else NAMES
+	store = HistoryStore(args.dir)
+
+	try:
+		if args.output:
+			with open(args.output, "wb") as out:
+				count = export(store, out, args.format, args.start, args.end, fields, args.compress)
+		else:
+			count = export(store, sys.stdout.buffer, args.format, args.start, args.end, fields, args.compress)
+	except ValueError as e:
+		parser.error(str(e))
+	except ImportError:
+		parser.error("The arrow format needs pyarrow")
+
+	sys.stderr.write("Exported {0} records\n".format(count))
@@ -0,0 +1,372 @@
+#!/usr/bin/python3
+#
+# A pretend garage on a pretend Pi: a GPIO backend (see garagegpio.py) with a simulated door behind it.
+#
+# Pulsing the relay pin does what the real opener does: a closed door opens, an open door closes, a moving door
+# stops, and a door stopped part way goes back the way it came. The reed switches follow the door, taking the
+# measured 15.59/19.77 seconds to travel (divided by 'speed'). The HC-SR04 echoes back 'carDistance' cm.
+#
+# It's for trying the daemon and webhook out on a laptop, and for loadtest.py, which counts relay pulses:
+#
+#   fake = FakeGPIO(speed=100)
+#   garagegpio.setBackend(fake)
+#   garage = Garage(weather=False)
+#   ...
+#   fake.pulses          -> times the relay was pulsed
+#   fake.door.position() -> 0.0 (closed) to 1.0 (open)
+#
+# FakeGpiod stands in for the gpiod module over a FakeGPIO, so gpiodgpio.py can be tried without a gpio-sim chip:
+#
+#   garagegpio.setBackend(GpiodGPIO(gpiod=FakeGpiod(FakeGPIO(speed=100))))
+# -----------------------
+
+from __future__ import print_function
+import threading
+import time
+
+__author__ = "Ryan Hunt <ryan@ryanhunt.net>"
+__copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
+
+# the pins garage.py uses
+RELAY = 4
+REED_BOTTOM = 17
+REED_TOP = 18
+TRIGGER = 24
+ECHO = 25
+
+SPEED_OF_SOUND = 34308.0
+
+
+class FakeDoor():
+	def __init__(self, timeOpen=15.59, timeClose=19.77, speed=1.0, position=0.0):
+		self.timeOpen = timeOpen / speed
+		self.timeClose = timeClose / speed
+
+		# where it was at 'since', and which way it's going from there (+1 up, -1 down, 0 stopped)
+		self._position = position
+		self._since = time.time()
+		self._direction = 0
+		self._lastDirection = -1 if position > 0 else 1
+		self._lock = threading.Lock()
+
+	def _at(self, t):
+		if (self._direction == 0):
+			return self._position
+		travel = self.timeOpen if self._direction > 0 else self.timeClose
+		return max(0.0, min(1.0, self._position + self._direction * (t - self._since) / travel))
+
+	def position(self, t=None):
+		with self._lock:
+			return self._at(time.time() if t is None else t)
+
+	def pulse(self, t=None):
+		if t is None:
+			t = time.time()
+
+		with self._lock:
+			position = self._at(t)
+			moving = (self._direction != 0 and 0.0 < position < 1.0)
+
+			self._position = position
+			self._since = t
+
+			if moving:
+				self._lastDirection = self._direction
+				self._direction = 0
+			elif (position <= 0.0):
+				self._direction = 1
+			elif (position >= 1.0):
+				self._direction = -1
+			else:
+				self._direction = -self._lastDirection
+			if self._direction:
+				self._lastDirection = self._direction
+
+	def reeds(self, t=None):
+		position = self.position(t)
+		return (1 if position <= 0.0 else 0, 1 if position >= 1.0 else 0)
+
+
+class _PWM():
+	def __init__(self, pin, frequency):
+		pass
+
+	def start(self, duty):
+		pass
+
+	def ChangeDutyCycle(self, duty):
+		pass
+
+	def ChangeFrequency(self, frequency):
+		pass
+
+	def stop(self):
+		pass
+
+
+class FakeGPIO():
+	# same values as RPi.GPIO
+	BOARD = 10
+	BCM = 11
+	OUT = 0
+	IN = 1
+	LOW = 0
+	HIGH = 1
+	PUD_OFF = 20
+	PUD_DOWN = 21
+	PUD_UP = 22
+	RISING = 31
+	FALLING = 32
+	BOTH = 33
+
+	PWM = _PWM
+
+	def __init__(self, speed=1.0, position=0.0, carDistance=200.0):
+		self.door = FakeDoor(speed=speed, position=position)
+		self.carDistance = carDistance
+
+		self.levels = {}
+		self.pulses = []
+		self._echoStart = None
+		self._lock = threading.Lock()
+
+		self._callbacks = {}
+		self._detected = set()
+		self._watcher = None
+
+	def setmode(self, mode):
+		pass
+
+	def setwarnings(self, flag):
+		pass
+
+	def setup(self, pin, mode, *args, **kwargs):
+		pass
+
+	def cleanup(self, *args):
+		pass
+
+	def input(self, pin):
+		if pin in (REED_BOTTOM, REED_TOP):
+			(bottom, top) = self.door.reeds()
+			return bottom if pin == REED_BOTTOM else top
+
+		if (pin == ECHO):
+			if self._echoStart is None:
+				return 0
+			elapsed = time.time() - self._echoStart
+			if (elapsed < 0):
+				return 0
+			if (elapsed < 2 * self.carDistance / SPEED_OF_SOUND):
+				return 1
+			self._echoStart = None
+			return 0
+
+		return self.levels.get(pin, 1)
+
+	# both reeds from the one look at the door
+	def inputs(self, pins):
+		reeds = dict(zip((REED_BOTTOM, REED_TOP), self.door.reeds()))
+		return tuple(reeds[pin] if pin in reeds else self.input(pin) for pin in pins)
+
+	def output(self, pin, value):
+		value = 1 if value else 0
+		with self._lock:
+			previous = self.levels.get(pin, 0)
+			self.levels[pin] = value
+
+		if (pin == RELAY and value and not previous):
+			now = time.time()
+			self.pulses.append(now)
+			self.door.pulse(now)
+		elif (pin == TRIGGER and previous and not value):
+			# the echo goes high a moment after the trigger drops
+			self._echoStart = time.time() + 0.0002
+
+	# Edge events on the reeds, by watching the simulated door from a thread
+	def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+		self._callbacks[pin] = (edge, [callback] if callback else [])
+		if self._watcher is None:
+			self._watcher = threading.Thread(target=self._watch, name="FakeGPIO")
+			self._watcher.daemon = True
+			self._watcher.start()
+
+	def add_event_callback(self, pin, callback):
+		self._callbacks[pin][1].append(callback)
+
+	def remove_event_detect(self, pin):
+		self._callbacks.pop(pin, None)
+
+	def event_detected(self, pin):
+		if pin in self._detected:
+			self._detected.discard(pin)
+			return True
+		return False
+
+	def _watch(self):
+		last = dict(zip((REED_BOTTOM, REED_TOP), self.door.reeds()))
+		while True:
+			time.sleep(0.01)
+			now = dict(zip((REED_BOTTOM, REED_TOP), self.door.reeds()))
+			for (pin, value) in now.items():
+				if (value == last[pin] or pin not in self._callbacks):
+					continue
+				(edge, callbacks) = self._callbacks[pin]
+				if (edge == self.BOTH or (edge == self.RISING and value) or (edge == self.FALLING and not value)):
+					self._detected.add(pin)
+					for callback in list(callbacks):
+						callback(pin)
+			last = now
+
+
+class _Namespace():
+	def __init__(self, *names):
+		for name in names:
+			setattr(self, name, name)
+
+
+class _LineSettings():
+	def __init__(self, direction="AS_IS", edge_detection="NONE", bias="AS_IS", drive=None, active_low=False, debounce_period=None, event_clock="MONOTONIC", output_value="INACTIVE"):
+		self.direction = direction
+		self.edge_detection = edge_detection
+		self.bias = bias
+		self.debounce_period = debounce_period
+		self.event_clock = event_clock
+		self.output_value = output_value
+
+
+class _EdgeEvent():
+	Type = _Namespace("RISING_EDGE", "FALLING_EDGE")
+
+	def __init__(self, offset, rising, timestampNs):
+		self.line_offset = offset
+		self.event_type = self.Type.RISING_EDGE if rising else self.Type.FALLING_EDGE
+		self.timestamp_ns = timestampNs
+
+
+class _LineRequest():
+	# what gpiod.request_lines() hands back, with the FakeGPIO's pins as its lines
+	def __init__(self, gpiod, config):
+		self._gpiod = gpiod
+		self._gpio = gpiod.gpio
+		self._settings = {}
+		self._pending = []
+		self._released = False
+		self._lock = threading.Lock()
+		self.reconfigure_lines(config)
+
+	def _check(self):
+		if self._released:
+			raise RuntimeError("request released")
+
+	def reconfigure_lines(self, config):
+		self._check()
+		settings = {}
+		for (lines, line) in config.items():
+			for offset in (lines if isinstance(lines, tuple) else (lines,)):
+				settings[offset] = line
+		with self._lock:
+			self._settings = settings
+			self._last = dict((offset, self._gpio.input(offset)) for offset in settings)
+		for (offset, line) in settings.items():
+			if (line.direction == "OUTPUT"):
+				self.set_value(offset, line.output_value)
+
+	def get_value(self, offset):
+		self._check()
+		if (self._settings[offset].direction == "OUTPUT"):
+			level = self._gpio.levels.get(offset, 0)
+		else:
+			level = self._gpio.input(offset)
+		return "ACTIVE" if level else "INACTIVE"
+
+	def get_values(self, lines=None):
+		lines = list(self._settings) if lines is None else lines
+		reeds = [offset for offset in lines if offset in (REED_BOTTOM, REED_TOP)]
+		if (len(reeds) == 2):
+			# both from the same moment, like the real ioctl
+			self._check()
+			levels = dict(zip((REED_BOTTOM, REED_TOP), self._gpio.door.reeds()))
+			return [("ACTIVE" if levels[offset] else "INACTIVE") if offset in levels else self.get_value(offset) for offset in lines]
+		return [self.get_value(offset) for offset in lines]
+
+	def set_value(self, offset, value):
+		self._check()
+		falling = (offset == TRIGGER and self._gpio.levels.get(TRIGGER, 0) and value != "ACTIVE")
+		self._gpio.output(offset, value == "ACTIVE")
+		if (falling and self._watching(ECHO)):
+			# the kernel timestamps the echo's edges when they happen, however late we read them
+			start = self._gpio._echoStart
+			end = start + 2 * self._gpio.carDistance / SPEED_OF_SOUND
+			with self._lock:
+				self._pending += [_EdgeEvent(ECHO, True, int(start * 1e9)), _EdgeEvent(ECHO, False, int(end * 1e9))]
+
+	def _watching(self, offset):
+		line = self._settings.get(offset)
+		return line is not None and line.direction == "INPUT" and line.edge_detection != "NONE"
+
+	def _wanted(self, offset, rising):
+		edge = self._settings[offset].edge_detection
+		return edge == "BOTH" or edge == ("RISING" if rising else "FALLING")
+
+	def _ready(self):
+		now = time.time()
+		with self._lock:
+			for offset in (REED_BOTTOM, REED_TOP):
+				if not self._watching(offset):
+					continue
+				value = self._gpio.input(offset)
+				if (value != self._last.get(offset)):
+					self._last[offset] = value
+					if self._wanted(offset, value):
+						self._pending.append(_EdgeEvent(offset, value, int(now * 1e9)))
+			return [event for event in self._pending if event.timestamp_ns <= now * 1e9]
+
+	def wait_edge_events(self, timeout=None):
+		deadline = None if timeout is None else time.time() + timeout
+		while True:
+			self._check()
+			if self._ready():
+				return True
+			if (deadline is not None and time.time() >= deadline):
+				return False
+			time.sleep(0.0005)
+
+	def read_edge_events(self, max_events=None):
+		self._check()
+		ready = self._ready()
+		if max_events is not None:
+			ready = ready[:max_events]
+		with self._lock:
+			for event in ready:
+				self._pending.remove(event)
+		return ready
+
+	def release(self):
+		self._released = True
+		self._gpiod.requests.remove(self)
+
+
+class FakeGpiod():
+	# the parts of the gpiod module (libgpiod v2) gpiodgpio.py uses, over a FakeGPIO
+	LineSettings = _LineSettings
+	EdgeEvent = _EdgeEvent
+
+	class line():
+		Direction = _Namespace("AS_IS", "INPUT", "OUTPUT")
+		Value = _Namespace("ACTIVE", "INACTIVE")
+		Bias = _Namespace("AS_IS", "UNKNOWN", "DISABLED", "PULL_UP", "PULL_DOWN")
+		Edge = _Namespace("NONE", "RISING", "FALLING", "BOTH")
+		Clock = _Namespace("MONOTONIC", "REALTIME", "HTE")
+
+	def __init__(self, gpio):
+		self.gpio = gpio
+		self.requests = []
+
+	def request_lines(self, path, consumer=None, config=None):
+		for request in self.requests:
+			if set(request._settings) & set(config or {}):
+				raise OSError(16, "Device or resource busy")
+		request = _LineRequest(self, config or {})
+		self.requests.append(request)
+		return request
@@ -24,13 +24,17 @@ import json
 import time
 import datetime
 import argparse
-import pyrebase
-import secret
 import sys
 import os
 import logging
+import signal
+import threading
+import config
 from garage import *
-import RPi.GPIO as GPIO
+from garagegpio import GPIO, clock, note, lastEdge
+from wireformat import SnapshotEncoder
+from rollup import ClimateRollups, INSIDE
+from supervisor import Supervisor, Worker, Stable, memoryUsage
 from pathlib import Path
 from daemon import runner
 
@@ -48,6 +52,7 @@ class MyDaemonRunner(runner.DaemonRunner):
 
 		# this is where we define the 'action' to be function 'self._garbage'
 		self.action_funcs['open'] = self._open
+		self.action_funcs['reload'] = self._reload
 		#self.action_funcs['close'] = self._close
 		#self.action_funcs['ventilate'] = self._ventilate
 		runner.DaemonRunner.__init__(self, app)
@@ -56,6 +61,14 @@ class MyDaemonRunner(runner.DaemonRunner):
 		# for some reason, I needed this to accept two arguments, but we don't need to pass any. 
 		# run the function 'garbage' inside the app.
 		self.app_save.open()
+	
+	def _reload(self, app):
+		# ask the running daemon to re-read its config file
+		pid = self.pidfile.read_pid()
+		if pid is None:
+			sys.stderr.write("The daemon isn't running.\n")
+			sys.exit(1)
+		os.kill(pid, signal.SIGHUP)
 		
 	def parse_args(self):
 		import argparse
@@ -65,8 +78,18 @@ class MyDaemonRunner(runner.DaemonRunner):
 		parser.add_argument("-o", "--open", help="Open door.", action='store_true')
 		parser.add_argument("-k", "--stop", help="Stop process", action='store_true')
 		parser.add_argument("-r", "--restart", help="Restart process", action='store_true')
+		parser.add_argument("--reload", help="Re-read the config file without restarting (same as sending SIGHUP)", action='store_true')
+		parser.add_argument("-c", "--config", dest="configname", help="read settings from FILE, see config.py", metavar="FILE")
 		parser.add_argument("-l", "--log_file", dest="filename", help="write log to FILE", metavar="FILE")
 		parser.add_argument("-p", "--pid_file", dest="pidname", help="write pid to FILE", metavar="FILE")
+		parser.add_argument("-w", "--webhook", dest="webhookport", type=int, help="serve the IFTTT webhook on PORT", metavar="PORT")
+		parser.add_argument("-b", "--bus", dest="busport", type=int, help="publish readings and take door commands over MQTT on localhost PORT (see bus.py)", metavar="PORT")
+		parser.add_argument("--bus-address", dest="busaddress", help="address for the MQTT bus to listen on (default 127.0.0.1), e.g. 0.0.0.0 for a hub.py elsewhere (needs getBusPassword() and getBusTLS())", metavar="ADDRESS")
+		parser.add_argument("-t", "--trace", dest="tracename", help="record GPIO activity to FILE, for replaying with gpiotrace.py", metavar="FILE")
+		parser.add_argument("-g", "--gpiod", dest="gpiochip", nargs='?', const="/dev/gpiochip0", help="drive the pins through the GPIO character device CHIP with libgpiod (see gpiodgpio.py)", metavar="CHIP")
+		parser.add_argument("-R", "--realtime", help="take the DHT11 and HC-SR04 readings in a separate real-time process", action='store_true')
+		parser.add_argument("-P", "--parking", help="show the car's distance on the LEDs while the door's open (see parking.py)", action='store_true')
+		parser.add_argument("-L", "--lean", help="use as little memory as possible: no outside weather, and less history kept", action='store_true')
 		parser.add_argument("-f", "--foreground", help="Run in the foreground", action='store_true')
 		parser.add_argument("-v", "--verbose", help="Verbose", action='store_true')
 		
@@ -80,6 +103,8 @@ class MyDaemonRunner(runner.DaemonRunner):
 			self.action = 'stop'
 		elif args.restart:
 			self.action = 'restart'
+		elif args.reload:
+			self.action = 'reload'
 		elif args.foreground:
 			self.detach_process = False
 			self.app_save.stdout_path = '/dev/tty'
@@ -100,13 +125,40 @@ class MyDaemonRunner(runner.DaemonRunner):
 			
 		if args.pidname:
 			self.app_save.pidfile_path = args.pidname
+		
+		if args.tracename:
+			self.app_save.trace_file = args.tracename
+		
+		if args.gpiochip:
+			self.app_save.gpioChip = args.gpiochip
+		
+		if args.configname:
+			self.app_save.config_file = args.configname
+		
+		if args.webhookport:
+			self.app_save.webhookPort = args.webhookport
+		
+		if args.busport:
+			self.app_save.busPort = args.busport
+		
+		if args.busaddress:
+			self.app_save.busAddress = args.busaddress
+		
+		if args.realtime:
+			self.app_save.realtime = True
+		
+		if args.lean:
+			self.app_save.lean = True
+		
+		if args.parking:
+			self.app_save.parkingAssist = True
 
 		if args.verbose:			
 			self.verbose = True
 #class GarageTemperature(Garage):
 
 class App:
-	def __init__(self):
+	def __init__(self, garage=None):
 		# python-daemon DaemonRunner requires the below.
 		self.stdin_path = '/dev/null'
 		self.stdout_path = '/dev/null'
@@ -120,10 +172,110 @@ class App:
 		#
 		# The below are this App specific. (conf file is not implemented now)
 		self.log_file = '/tmp/garage.log'
+		self.trace_file = None
+		
+		# a /dev/gpiochipN to drive the pins through with libgpiod, rather than RPi.GPIO (see gpiodgpio.py)
+		self.gpioChip = None
+		
+		# settings that can be changed with SIGHUP, see config.py
+		self.config_file = None
+		self.config = config.defaults()
+		self.reloadRequested = False
+		
+		# port to serve the IFTTT webhook on (None = leave it to garagedoor.php)
+		self.webhookPort = None
+		
+		# the latest status in shared memory, where any local process can read it (see sharedstatus.py)
+		self.sharedStatus = None
+		
+		# port for the MQTT bus home automation can subscribe to (see bus.py)
+		self.busPort = None
+		# where it listens: somewhere other than localhost for a hub.py to follow it from another machine
+		self.busAddress = "127.0.0.1"
+		self.bus = None
+		
+		# read the DHT11 and HC-SR04 from a separate real-time process (see acquire.py)
+		self.realtime = False
+		self.acquirer = None
+		
+		# the LEDs as a distance gauge while the door's open (see parking.py)
+		self.parkingAssist = False
+		self.parking = None
+		
+		# for a 256MB Pi: leave out OWM (and pyowm), keep less history. Memory use is logged every memoryLogInterval
+		# seconds, and is in /health.json.
+		self.lean = False
+		self.memoryLogInterval = 3600
+		self.lastMemoryLog = None
+		
+		# sends the warnings on by SMS/email/webhook, if garagesecret.py has getNotifiers() (see notify.py)
+		self.notifier = None
+		self.notifyFile = '/var/tmp/garage.notify'
+		
+		# automatic ventilate/close, if garagesecret.py has getRules() (see rules.py). Their door commands, and the
+		# webhook's, go one at a time through the commander.
+		self.rules = None
+		self.rulesFile = '/var/tmp/garage.rules'
+		self.commander = None
+		
+		# opens the door ahead of someone driving home, from the webhook's positions (see arrival.py)
+		self.arrivals = None
+		
+		# a trace of each door command, with how long every stage took up to the reeds confirming it (see tracing.py)
+		self.tracer = None
+		self.tracesFile = '/var/tmp/garage.traces'
 		self.foreground = False
 		
-		# creates a new Garage instance, with a  warning alert interval of 30 seconds (default is 300 secs/5 mins)
-		self.garage = Garage(30)
+		# how often the door is checked. With edge events on the reeds (reedEdges), a change is seen straight
+		# away and they're only polled every reedFallbackInterval, in case an edge goes missing.
+		self.pollInterval = 0.5
+		self.reedEdges = False
+		self.reedPins = ()
+		self.reedFallbackInterval = 5
+		
+		# how often each of the other sensors is read, in seconds, by its own worker (see supervisor.py). The car
+		# only every carClosedInterval while the door's shut, the DHT11 backs off while the climate's steady
+		# (climateSchedule), and OWM is asked when its observation goes stale.
+		self.carInterval = 60
+		self.carClosedInterval = 900
+		self.climateInterval = 60
+		self.climateSchedule = None
+		self.weatherInterval = 600
+		self.supervisor = None
+		
+		# latest status, kept up to date for the webhook's /status. Workers publish() into it from their own threads.
+		self.snapshots = SnapshotEncoder()
+		self.publishLock = threading.Lock()
+		
+		# minute/hour/day climate summaries, with what's changed appended every rollupSaveInterval seconds so they
+		# survive a restart (see rollup.py), and saved whole on the way out
+		self.rollups = ClimateRollups()
+		self.rollupFile = '/var/tmp/garage.rollup'
+		self.rollupSaveInterval = 600
+		self.lastRollupSave = None
+		
+		# every change in the readings, on disk for export.py (see history.py)
+		self.history = None
+		self.historyPath = '/var/tmp/garage.history'
+		
+		# the Garage, made by makeGarage() once the arguments are known (unless one's given)
+		self.garage = garage
+	
+	# creates a new Garage instance, with the configured warning alert interval (30 seconds by default, the Garage's own default is 300 secs/5 mins)
+	def makeGarage(self):
+		if (self.garage is None and self.gpioChip):
+			# the GPIO character device rather than RPi.GPIO (see gpiodgpio.py)
+			import garagegpio
+			from gpiodgpio import GpiodGPIO
+			garagegpio.setBackend(GpiodGPIO(self.gpioChip))
+		
+		if self.garage is None:
+			self.garage = Garage(self.config['warningTime'], outside=not self.lean)
+		
+		if self.lean:
+			# fewer old snapshots for /status deltas, and no rollups for outside weather we won't have
+			self.snapshots = SnapshotEncoder(history=16)
+			self.rollups = ClimateRollups(INSIDE)
 
 	def open(self):
 		logging.basicConfig(level=logging.DEBUG,
@@ -131,6 +283,10 @@ class App:
 						filename=self.log_file,
 						filemode='a')
 		
+		import tracing
+		tracing.scriptTrace("open", path=self.tracesFile)
+		with tracing.span("garage"):
+			self.makeGarage()
 		logging.info('door opened.')
 		
 		self.garage.door.open()
@@ -144,9 +300,112 @@ class App:
 							filename=self.log_file,
 							filemode='a')
 		
-		lastStatus = self.garage.door.status()
-		lastTime = datetime.datetime.now()
-		numWarnings = 0
+		self.makeGarage()
+		
+		if self.trace_file:
+			# record every GPIO read/write from here on, so this run can be replayed later with gpiotrace.py
+			import gpiotrace
+			gpiotrace.record(self.trace_file)
+		
+		if self.config_file:
+			self.reload()
+		
+		if self.realtime:
+			# fork the acquisition process's launcher first, while this is the only thread: the notifier, rules,
+			# bus, webhook and workers below all start their own (see acquire.py)
+			from acquire import Acquirer
+			self.acquirer = Acquirer(self.garage.car)
+			self.acquirer.start()
+			self.garage.car.acquirer = self.acquirer
+			if self.garage.weather is not None:
+				self.garage.weather.acquirer = self.acquirer
+			logging.info("Reading the DHT11 and HC-SR04 from a real-time process")
+		
+		self.startSharedStatus()
+		self.start()
+		
+		if self.tracesFile:
+			from tracing import TraceStore
+			self.tracer = TraceStore(self.tracesFile)
+		
+		try:
+			import garagesecret as sekret
+		except ImportError:
+			sekret = None
+		
+		if sekret is not None:
+			self.startNotifier(sekret)
+			self.startRules(sekret)
+			if self.webhookPort:
+				self.startArrivals(sekret)
+		
+		if self.busPort:
+			self.startBus(sekret)
+		
+		# every sensor is read on its own thread, so a failing or hung one can't hold up the others (or the door)
+		self.supervisor = Supervisor()
+		self.supervisor.add(Worker("reeds", self.step, self.pollInterval, deadline=5, schedule=self.reedSchedule))
+		self.supervisor.add(Worker("ultrasonic", self.readCar, self.carInterval, deadline=10, schedule=self.carSchedule))
+		if self.garage.weather is not None:
+			self.climateSchedule = Stable(self.climateInterval, self.climateInterval * 8, sameClimate)
+			self.supervisor.add(Worker("dht11", self.readClimate, self.climateInterval, deadline=30, schedule=self.climateSchedule))
+			if self.garage.weather.outside is not None:
+				self.garage.weather.outside.ttl = self.weatherInterval
+				self.supervisor.add(Worker("owm", self.readWeather, self.weatherInterval, deadline=60, backoff=30, schedule=self.weatherSchedule))
+		self.supervisor.start()
+		self.watchReeds()
+		
+		if self.parkingAssist:
+			self.startParking()
+		
+		# reloading happens here on the main loop, the handler just asks for it
+		signal.signal(signal.SIGHUP, self.requestReload)
+		
+		if self.webhookPort:
+			import webhook
+			self.webhook = webhook.start(self.garage, self.webhookPort, snapshots=self.snapshots, rollups=self.rollups, health=self.health, commander=self.commander, tracer=self.tracer, arrivals=self.arrivals)
+			logging.info("Serving the IFTTT webhook on port {0}".format(self.webhookPort))
+		
+		while True:
+			# the main loop code, now just the watchdog. Sensor faults are the workers' problem.
+			try:
+				if self.reloadRequested:
+					self.reloadRequested = False
+					self.reload()
+				self.supervisor.check()
+				self.logMemory()
+				self.recoverDoor()
+				if self.tracer is not None:
+					self.tracer.settle()
+				if self.bus is not None:
+					self.bus.health(self.supervisor.health())
+				if self.rules is not None:
+					self.rules.tick(clock.time())
+				if self.arrivals is not None:
+					self.arrivals.tick()
+				clock.sleep(1)
+			except (KeyboardInterrupt, SystemExit):
+				logging.info('Terminating.')
+				if self.rollupFile:
+					with self.publishLock:
+						self.rollups.save(self.rollupFile)
+				raise
+			except:
+				logging.exception("Watchdog failed, carrying on")
+	
+	def start(self):
+		if self.rollupFile:
+			self.rollups.load(self.rollupFile)
+		
+		if self.historyPath:
+			from history import HistoryStore
+			self.history = HistoryStore(self.historyPath)
+		
+		self.recoverDoor()
+		
+		self.lastStatus = self.garage.door.status()
+		self.lastTime = clock.now()
+		self.numWarnings = 0
 		
 		if self.foreground:
 			print ("Daemon started at {0}".format( time.ctime() ) )
@@ -159,51 +418,349 @@ class App:
 			print (self.garage.door.display())
 		else:
 			logging.info("Daemon started at {0}".format( time.ctime() ) )
-			logging.info('DEBUG: %s', self.garage.door.status())
+			logging.info('DEBUG: %s', self.lastStatus)
+	
+	# a ventilate cut short, here (before a restart) or in another script, is put right (see journal.py)
+	def recoverDoor(self):
+		for (operationId, outcome) in self.garage.door.recover():
+			logging.warning("Door operation {0} was cut short, {1}: the door is {2}".format(operationId, outcome, self.garage.door.status()))
+	
+	# one pass of the main loop, run every pollInterval seconds.
+	def step(self):
+		nowTime = clock.now()
+		status = self.garage.door.status()
 		
-		while True:
-			# the main loop code.
-			try:
-				#str = time.asctime(time.localtime(time.time()))
-
-				nowTime = datetime.datetime.now()
-				
-				# this checks to see if there is a change in state, and if so - log it. 
-				if ( lastStatus != self.garage.door.status() ):
-					if self.foreground:
-						#print ("Door status: ", self.door.status(), "Car status: " , self.car.status())
-						
-						print ("{0}: {1} -> {2} ({3})".format(lastStatus, lastTime, nowTime, (nowTime - lastTime)))
-						#print ("{0} -> {1} ({2})".format(lastStatus, self.garage.door.status(), (datetime.datetime.now() - lastTime)))
-					else:
-						#logging.info('DEBUG: Door status: %s Car status %d', self.door.status(), self.car.status())
-						#logging.info('DEBUG: %s', self.garage.door.status())
-						logging.info("DEBUG: {0}: {1} -> {2} ({3})".format(lastStatus, lastTime, nowTime, (nowTime - lastTime)))
-					
-					lastTime = nowTime
-				
-				#else:
-					# this means that there is no change, so print/log nothing. We only want to capture changes.
+		# this checks to see if there is a change in state, and if so - log it. 
+		if ( self.lastStatus != status ):
+			self.transition(self.lastStatus, status, self.lastTime, nowTime)
+			self.lastTime = nowTime
+			
+			if self.tracer is not None:
+				# the door's doing what it was told (or something is): time it against the last command
+				self.tracer.observe(self.lastStatus, status)
+			
+			# timed from the reed's edge, if the GPIO backend timestamps them (gpiodgpio.py), not from when we read it
+			changed = clock.time()
+			edge = lastEdge(self.garage.door.REED_BOTTOM, self.garage.door.REED_TOP)
+			if (edge is not None and changed - self.reedSchedule() <= edge <= changed):
+				changed = edge
+			
+			travelled = self.garage.door.travel.observe(self.lastStatus, status, changed)
+			if travelled:
+				self.travelled(*travelled)
+			
+			if status in ("open", "closed"):
+				# whatever was moving the door is done, and it's certainly not ventilating
+				self.garage.door.state.finish(ventilating=False)
+			
+			if self.parking is not None:
+				self.parking.doorChanged(status)
+			
+			if (self.supervisor is not None and "closed" in (self.lastStatus, status)):
+				# the car's read more often with the door open, start on the new rate now
+				self.supervisor.worker("ultrasonic").wake()
+		
+		#else:
+			# this means that there is no change, so print/log nothing. We only want to capture changes.
+		
+		self.publish({'doorState': status})
+		
+		# this part here then does warnings, but only once every 300 second (5 minutes) 
+		self.lastStatus = status
+		count = nowTime - ( datetime.timedelta(seconds=(self.garage.warningTime * self.numWarnings)) ) - self.lastTime
+		countFloat = float(count.total_seconds())
+		
+		if (self.garage.door.isTimeToWorry(countFloat) == True):
+			self.warning(countFloat)
+			self.numWarnings  = self.numWarnings + 1
+	
+	# the other sensors, each run by its worker
+	def readCar(self):
+		if (self.parking is not None and self.parking.active):
+			# it's pinging many times a second already, and publishes any change itself
+			return
+		self.publish({'carPresent': self.garage.car.status()})
+	
+	def readClimate(self):
+		g = {}
+		(g['temperature'], g['humidity'], g['heatIndex']) = self.garage.weather.status(attempts=5)
+		self.climateSchedule.observe((g['temperature'], g['humidity']))
+		self.publish(g)
+	
+	def readWeather(self):
+		outside = self.garage.weather.outside
+		outside.refresh()
+		g = {}
+		(g['weatherLocation'], g['oTemperature'], g['oHumidity'], g['oHeatIndex'], g['rainfall']) = outside.status()
+		self.publish(g)
+	
+	# seconds until each worker's next read
+	def reedSchedule(self):
+		return max(self.pollInterval, self.reedFallbackInterval) if self.reedEdges else self.pollInterval
+	
+	def carSchedule(self):
+		return self.carClosedInterval if (self.lastStatus == "closed") else self.carInterval
+	
+	def weatherSchedule(self):
+		return max(1, self.garage.weather.outside.expires() - time.time())
+	
+	# have any edge on either reed wake the reeds worker, rather than polling them twice a second
+	def watchReeds(self):
+		door = self.garage.door
+		reeds = self.supervisor.worker("reeds")
+		
+		for pin in self.reedPins:
+			GPIO.remove_event_detect(pin)
+		self.reedPins = ()
+		
+		try:
+			for pin in (door.REED_BOTTOM, door.REED_TOP):
+				GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+				GPIO.add_event_detect(pin, GPIO.BOTH, callback=lambda channel: reeds.wake(), bouncetime=50)
+				self.reedPins += (pin,)
+			self.reedEdges = True
+		except (RuntimeError, AttributeError) as e:
+			logging.warning("No edge events from the reed switches ({0}), polling them every {1}s".format(e, self.pollInterval))
+			self.reedEdges = False
+		reeds.wake()
+	
+	# merge some Garage.status() fields into the snapshot, the climate rollups and the history
+	def publish(self, fields):
+		with self.publishLock:
+			now = clock.time()
+			self.snapshots.update(fields)
+			if self.sharedStatus is not None:
+				# stamped with every publish, even when nothing's changed, so readers can tell we're still here
+				self.sharedStatus.update(self.snapshots.seq, self.snapshots.values, time.time())
+			self.rollups.add(fields, now)
+			if self.history is not None:
+				self.history.add(fields, now)
+			if self.bus is not None:
+				self.bus.update(fields)
+			if self.rules is not None:
+				self.rules.update(fields, now)
+			
+			if (self.rollupFile and (self.lastRollupSave is None or now - self.lastRollupSave >= self.rollupSaveInterval)):
+				self.lastRollupSave = now
+				self.rollups.flush(self.rollupFile)
+	
+	# the snapshot in shared memory, for main.py --json and anything else local (see sharedstatus.py)
+	def startSharedStatus(self):
+		try:
+			from sharedstatus import StatusWriter
+			self.sharedStatus = StatusWriter()
+		except (ImportError, OSError) as e:
+			logging.warning("Not sharing the status in shared memory: {0}".format(e))
+	
+	def startNotifier(self, sekret):
+		import notify
+		channels = notify.channelsFromSecret(sekret)
+		if channels:
+			self.notifier = notify.Notifier(channels, self.notifyFile).start()
+			logging.info("Sending alerts via {0}".format(", ".join(self.notifier.channels)))
+	
+	def startParking(self):
+		import parking
+		lights = GarageLights(daemon=True)
+		self.parking = parking.ParkingAssist(self.garage.car, lights, self.config['parkingStop'], publish=lambda present: self.publish({'carPresent': present}))
+		self.parking.start()
+		self.parking.doorChanged(self.lastStatus)
+		logging.info("Parking assist stops the car at {0}cm".format(self.config['parkingStop']))
+	
+	# before the workers start, so the bus sees every reading
+	def startBus(self, sekret):
+		import bus
+		import webhook
+		if self.commander is None:
+			self.commander = webhook.DoorCommander(self.garage, tracer=self.tracer)
+		password = sekret.getBusPassword() if hasattr(sekret, 'getBusPassword') else None
+		readPassword = sekret.getBusReadPassword() if hasattr(sekret, 'getBusReadPassword') else None
+		tls = bus.serverContext(**sekret.getBusTLS()) if hasattr(sekret, 'getBusTLS') else None
+		if self.busAddress not in ("127.0.0.1", "localhost", "::1"):
+			# anyone who can reach it could publish to garage/door/set, or read the password going past
+			if not password:
+				raise ValueError("Refusing to run the MQTT bus on {0} without a password, add getBusPassword() to garagesecret.py".format(self.busAddress))
+			if tls is None:
+				raise ValueError("Refusing to run the MQTT bus on {0} without TLS, add getBusTLS() to garagesecret.py or keep it on localhost and tunnel to it".format(self.busAddress))
+		self.bus = bus.start(self.busPort, address=self.busAddress, command=self.busCommand, password=password, readPassword=readPassword, tls=tls)
+		logging.info("MQTT bus on {0} port {1}{2}".format(self.busAddress, self.busPort, " (TLS)" if tls is not None else ""))
+	
+	# something published a command to the bus: True if the door's doing it, False if busy, None if unknown
+	def busCommand(self, name):
+		door = self.garage.door
+		actions = {'open': door.open, 'close': door.close, 'ventilate': door.ventilate, 'ifttt': door.ifttt}
+		if name not in actions:
+			return None
+		return self.commander.submit("bus: {0}".format(name), actions[name])
+	
+	def startRules(self, sekret):
+		import rules
+		import webhook
+		engine = rules.RuleEngine.fromSecret(sekret, self.act, self.rulesFile)
+		if engine.rules:
+			engine.load()
+			self.commander = webhook.DoorCommander(self.garage, tracer=self.tracer)
+			self.rules = engine
+			logging.info("Automation rules: {0}".format(", ".join(r.name for r in engine.rules)))
+	
+	def startArrivals(self, sekret):
+		import webhook
+		from arrival import ArrivalPredictor
+		from geofence import Geofences
+		door = self.garage.door
+		if self.commander is None:
+			self.commander = webhook.DoorCommander(self.garage, tracer=self.tracer)
+		openDoor = lambda reason: self.commander.submit("arrival: {0}".format(reason), door.open)
+		closeDoor = lambda reason: self.commander.submit("arrival: {0}".format(reason), door.close)
+		parking = lambda: self.parking is not None and self.parking.active
+		self.arrivals = ArrivalPredictor.fromSecret(sekret, Geofences.fromSecret(sekret), openDoor, closeDoor, self.snapshots.status, door.getTimeToOpen, parking)
+		if self.arrivals is not None:
+			logging.info("Opening the door ahead of arrivals at {0}, up to {1}s early".format(self.arrivals.home.name, self.arrivals.settings['maxLead']))
+	
+	# a rule has fired
+	def act(self, rule):
+		door = self.garage.door
+		actions = {'open': door.open, 'close': door.close, 'ventilate': door.ventilate}
+		
+		if (rule.do == 'notify'):
+			if self.notifier is not None:
+				self.notifier.notify("rule-" + rule.name, "Rule {0}: {1}".format(rule.name, rule.when))
+			return
+		
+		if rule.do not in actions:
+			logging.warning("Rule {0} wants to {1}, which isn't something the door does".format(rule.name, rule.do))
+		elif not self.commander.submit("rule {0}: {1}".format(rule.name, rule.do), actions[rule.do]):
+			logging.info("Rule {0} wanted to {1}, but the door is busy".format(rule.name, rule.do))
+	
+	def requestReload(self, signum, frame):
+		self.reloadRequested = True
+	
+	# re-read the config file and apply whatever changed. A bad file is logged and ignored.
+	def reload(self):
+		if not self.config_file:
+			logging.info("No config file to reload")
+			return
+		
+		try:
+			new = config.load(self.config_file)
+		except (IOError, config.ConfigError) as e:
+			logging.error("Not reloading {0}: {1}".format(self.config_file, e))
+			return
+		
+		changed = self.reconfigure(new)
+		logging.info("Reloaded {0}: {1}".format(self.config_file, ", ".join(sorted(changed)) if changed else "nothing changed"))
+	
+	def reconfigure(self, new):
+		changed = config.diff(self.config, new)
+		for key in sorted(changed):
+			self.applySetting(key, new)
+		self.config = new
+		return changed
+	
+	# apply one changed setting, touching only what uses it
+	def applySetting(self, key, new):
+		door = self.garage.door
+		car = self.garage.car
+		pins = new['pins']
+		workers = {'pollInterval': "reeds", 'carInterval': "ultrasonic", 'climateInterval': "dht11", 'weatherInterval': "owm"}
+		
+		if (key == 'warningTime'):
+			self.garage.warningTime = new[key]
+		elif key in ('safeOpenTime', 'safeVentilateTime'):
+			door.setSafeOpenTime(new['safeOpenTime'], new['safeVentilateTime'])
+		elif (key == 'ventilationPercent'):
+			door.VENTILATIONPERC = new[key]
+		elif (key == 'parkingStop'):
+			if self.parking is not None:
+				self.parking.stopDistance = new[key]
+		elif (key == 'carClosedInterval'):
+			self.carClosedInterval = new[key]
+		elif key in workers:
+			setattr(self, key, new[key])
+			if (key == 'climateInterval' and self.climateSchedule is not None):
+				(self.climateSchedule.interval, self.climateSchedule.maxInterval) = (new[key], new[key] * 8)
+			if (key == 'weatherInterval' and self.garage.weather is not None and self.garage.weather.outside is not None):
+				self.garage.weather.outside.ttl = new[key]
+			worker = self.supervisor.worker(workers[key]) if self.supervisor is not None else None
+			if worker is not None:
+				worker.interval = new[key]
+				worker.wake()
+		elif (key == 'pins.relay'):
+			GPIO.setup(pins['relay'], GPIO.OUT)
+			GPIO.output(pins['relay'], GPIO.LOW)
+			door.GPIO_RELAY = pins['relay']
+		elif key in ('pins.reedBottom', 'pins.reedTop'):
+			(door.REED_BOTTOM, door.REED_TOP) = (pins['reedBottom'], pins['reedTop'])
+			if self.supervisor is not None:
+				self.watchReeds()
+		elif key in ('pins.trigger', 'pins.echo'):
+			GPIO.setup(pins['trigger'], GPIO.OUT)
+			GPIO.output(pins['trigger'], False)
+			GPIO.setup(pins['echo'], GPIO.IN)
+			(car.GPIO_TRIGGER, car.GPIO_ECHO) = (pins['trigger'], pins['echo'])
+			if self.acquirer is not None:
+				# it has its own copy of the car
+				self.acquirer.restart()
+		elif (key == 'pins.dht11'):
+			if self.garage.weather is not None:
+				self.garage.weather.DHT11_PIN = pins['dht11']
+	
+	def health(self):
+		return {
+			'workers': self.supervisor.health() if self.supervisor is not None else [],
+			'memory': memoryUsage(),
+			'notifier': self.notifier.backlog() if self.notifier is not None else None,
+		}
+	
+	# now and then, so a slow leak shows up in the log long before it matters
+	def logMemory(self):
+		now = time.time()
+		if (self.lastMemoryLog is not None and now - self.lastMemoryLog < self.memoryLogInterval):
+			return
+		self.lastMemoryLog = now
+		
+		usage = memoryUsage()
+		if usage:
+			logging.info("Memory: {0} kB resident (peak {1} kB, heap {2} kB), {3} threads".format(usage.get('rss'), usage.get('peakRss'), usage.get('heap'), usage.get('threads')))
+	
+	def transition(self, lastStatus, status, lastTime, nowTime):
+		if self.foreground:
+			print ("{0}: {1} -> {2} ({3})".format(lastStatus, lastTime, nowTime, (nowTime - lastTime)))
+		else:
+			logging.info("DEBUG: {0}: {1} -> {2} ({3})".format(lastStatus, lastTime, nowTime, (nowTime - lastTime)))
+	
+	def travelled(self, direction, duration, anomaly):
+		expected = self.garage.door.travel.expected(direction)
+		
+		if anomaly:
+			message = "Door took {0:.1f}s to {1}, it usually takes {2:.1f}s. Is the opener OK?".format(duration, direction, expected)
+			if self.foreground:
+				print (message)
+			else:
+				logging.warning(message)
+			
+			if self.notifier is not None:
+				self.notifier.notify("slow-" + direction, message)
+		else:
+			logging.info("DEBUG: Door took {0:.1f}s to {1} (now expecting {2:.1f}s)".format(duration, direction, expected))
+	
+	def warning(self, duration):
+		# a trace recording keeps the warnings as the ground truth for replays.
+		note("warning", self.numWarnings)
+		
+		if self.foreground:
+			print ("It's time to worry now!")
+		else:
+			logging.info("DEBUG: It's time to worry now!")
+		
+		if self.notifier is not None:
+			# how long it's really been, not just since the last warning
+			m = int((clock.now() - self.lastTime).total_seconds() // 60)
+			self.notifier.notify("door-" + self.lastStatus, "Garage door has been {0} for {1} minutes".format(self.lastStatus, m))
 
-				
-				# this part here then does warnings, but only once every 300 second (5 minutes) 
-				lastStatus = self.garage.door.status()
-				#count = nowTime - ( self.garage.warningTime * numWarnings) - lastTime
-				count = nowTime - ( datetime.timedelta(seconds=(self.garage.warningTime * numWarnings)) ) - lastTime
-				countFloat = float(count.total_seconds())
-				
-				if (self.garage.door.isTimeToWorry(countFloat) == True):
-					if self.foreground:
-						print ("It's time to worry now!")
-					else:
-						logging.info("DEBUG: It's time to worry now!")
-					numWarnings  = numWarnings + 1
-					
-				time.sleep(0.5)
-			except:
-				logging.info(sys.exc_info())
-				logging.info('Terminating.')
-				sys.exit(1)
+# the DHT11 reads whole degrees and percent, so anything within a step is noise
+def sameClimate(old, new):
+	return (abs(old[0] - new[0]) <= 1 and abs(old[1] - new[1]) <= 2)
 
 def checkPerms():
 		# check for GPIO permissions. 
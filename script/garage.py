@@ -43,18 +43,24 @@ import time
 import argparse
 import sys
 import os
-import RPi.GPIO as GPIO
-import meteocalc as mc
+import threading
+from garagegpio import GPIO, clock, note, readPins, echoPulse
 from pathlib import Path
+from traveltime import TravelTimes, DEFAULTS
+from doorstate import DoorState
+import journal
+import tracing
 
 __author__ = "Ryan Hunt <ryan@ryanhunt.net>"
 __copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
 
 
 class Garage():
-	def __init__(self, warningTime=300):
+	def __init__(self, warningTime=300, weather=True, outside=True):
 		
 		# warningTime defines the amount of time we should wait before alerting users that the door is in an warning state (i.e. left open for a period of time - then SMS someone after 300 seconds (5 minutes))
+		# weather=False skips the DHT11 and OWM (which hits the network), e.g. when replaying a GPIO trace.
+		# outside=False keeps the DHT11 but skips OWM, and with it pyowm and its dependencies.
 		
 		# Use BCM GPIO references
 		# instead of physical pin numbers
@@ -66,7 +72,9 @@ class Garage():
 		
 		self.car = Car()
 		self.door = GarageDoor()
-		self.weather = GarageWeather()
+		# a span of its own in a traced command (see tracing.py), OWM goes out to the network
+		with tracing.span("weather"):
+			self.weather = GarageWeather(outside=outside) if weather else None
 		
 		# see above
 		self.warningTime = warningTime
@@ -78,12 +86,16 @@ class Garage():
 		g = {}
 		g['carPresent'] = self.car.status()
 		g['doorState'] = self.door.status()
-		(g['temperature'], g['humidity'], g['heatIndex']) = self.weather.status()
-		(g['weatherLocation'], g['oTemperature'], g['oHumidity'], g['oHeatIndex'], g['rainfall']) = self.weather.outside.status()
+		if self.weather is not None:
+			(g['temperature'], g['humidity'], g['heatIndex']) = self.weather.status()
+		if (self.weather is not None and self.weather.outside is not None):
+			(g['weatherLocation'], g['oTemperature'], g['oHumidity'], g['oHeatIndex'], g['rainfall']) = self.weather.outside.status()
 		return g
 		
 	def display(self):
 		#str = "Door status: ", door.status(), "Car status: " , car.status(), "Temperature: ", t, "Humidity: ", h
+		if self.weather is None:
+			return "{0}\n{1}".format(self.door.display(), self.car.display())
 		str = "{0}\n{1}\n{2}".format(self.door.display(), self.car.display(), self.weather.display())
 		return str
 
@@ -101,14 +113,20 @@ class GarageDoor(Garage):
 		# Set relay as output
 		GPIO.setup(self.GPIO_RELAY,GPIO.OUT)
 		
-		self.TEMPFILE = Path("/tmp/GarageDoor.air")
+		# ventilate mode and the operation in flight, shared with the other scripts (see doorstate.py)
+		self.state = DoorState()
 		self.VENTILATIONPERC = 10
 		
+		# the steps of a ventilate, so one cut short can be put right (see journal.py)
+		self.journal = journal.Journal()
+		
 		# Time to open fully (from closed) = 15.59 seconds
 		# time to close fully (from open) = 19.77 seconds
+		# These are only the starting point, the daemon times every traversal and keeps them up to date (see traveltime.py).
 		
-		self.defaultTimeToOpen = 15.59
-		self.defaultTimeToClose = 19.77
+		self.travel = TravelTimes.load()
+		self.defaultTimeToOpen = DEFAULTS['open']
+		self.defaultTimeToClose = DEFAULTS['close']
 		
 		# this is the default time before we should worry the door has been open too long, default is 5 minutes (300 seconds) for wide open/operating and 30 minutes for ventilate mode.
 		self.setSafeOpenTime	()
@@ -119,21 +137,30 @@ class GarageDoor(Garage):
 		GPIO.setup(self.REED_BOTTOM,GPIO.IN, pull_up_down=GPIO.PUD_UP)
 		GPIO.setup(self.REED_TOP,GPIO.IN,pull_up_down=GPIO.PUD_UP)
 		
-		bottom = GPIO.input(self.REED_BOTTOM)
-		top = GPIO.input(self.REED_TOP)
+		(bottom, top) = readPins(self.REED_BOTTOM, self.REED_TOP)
 		
+		return self.stateFor(bottom, top, self._isVentilating)
+	
+	# door state from the two reeds. ventilating is only called (to check the marker) when the door is somewhere in between.
+	@staticmethod
+	def stateFor(bottom, top, ventilating):
 		if (bottom == 1 and top == 0):
 			return "closed"
 		elif (bottom == 0 and top == 1):
 			return "open"
 		elif (bottom == 0 and top == 0):
-			if self.TEMPFILE.is_file():
+			if ventilating():
 				return "ventilate"
 			else:
 				return "operating"
 		else:
 			return "error"	
-			
+	
+
+	# the ventilate flag is the one piece of door state that isn't on a pin, so let a recording/replaying GPIO backend see it.
+	def _isVentilating(self):
+		return note("ventilate", self.state.isVentilating())
+	
 	def display(self):
 		#print("Door is", self.status())
 		str = "Door is {0}".format(self.status())
@@ -142,9 +169,15 @@ class GarageDoor(Garage):
 	def getSafeOperatingTime(self):
 		# this returns a time in which we should start worrying that's it been in an 'operating' state for too long. 
 		# as a rule of thumb, I've set the time to time to open + time to close to give it a buffer. 
-		duration = self.defaultTimeToOpen + self.defaultTimeToClose
+		duration = self.travel.worstCase("open") + self.travel.worstCase("close")
 		return duration
 	
+	def getTimeToOpen(self):
+		return self.travel.expected("open")
+	
+	def getTimeToClose(self):
+		return self.travel.expected("close")
+	
 	def setSafeOpenTime(self, durationOpen=30.0, durationVentilate=1800.00):
 		self.SafeOpenTime = durationOpen
 		self.SafeVentilateTime = durationVentilate
@@ -164,10 +197,11 @@ class GarageDoor(Garage):
 			return False
 	
 	def _trigger(self):
-		GPIO.output(self.GPIO_RELAY,GPIO.HIGH)
-		# Allow wires to short for long enough.
-		time.sleep(0.5)
-		GPIO.output(self.GPIO_RELAY,GPIO.LOW)
+		with tracing.relay():
+			GPIO.output(self.GPIO_RELAY,GPIO.HIGH)
+			# Allow wires to short for long enough.
+			clock.sleep(0.5)
+			GPIO.output(self.GPIO_RELAY,GPIO.LOW)
 		
 	def forceClose(self):
 		self._operate(0,100,1)
@@ -184,39 +218,115 @@ class GarageDoor(Garage):
 	def ventilate(self):
 		self._operate(1, self.VENTILATIONPERC,0)
 	
+	# Put right any ventilate that was cut short (its process died between the pulses), going by the journal and
+	# where the reeds say the door is now. Returns [(operation id, what was done)].
+	def recover(self):
+		done = []
+		for (operationId, operation) in sorted(self.journal.orphans().items()):
+			position = self.status()
+			if position in ("operating", "ventilate"):
+				position = "between"
+			outcome = journal.reconcile(operation, position, time.time(), self.getTimeToOpen())
+			
+			if (outcome == journal.RESUME):
+				if not self._resume(operationId, operation):
+					# someone's sent the door another command since: it's theirs now, leave the relay alone
+					outcome = journal.COMPENSATE
+			elif (outcome == journal.COMPENSATE):
+				# where it is is where it is: ventilating if it stopped part way, not if it went all the way up
+				self.state.finish(operationId, ventilating=(position == "between"))
+			elif (outcome == journal.ROLLBACK):
+				self.state.finish(operationId, ventilating=False)
+			elif (outcome == journal.FINISH):
+				self.state.finish(operationId)
+			
+			self.journal.end(operationId, outcome)
+			done.append((operationId, outcome))
+		return done
+	
+	# Take over a ventilate that's still going up, and stop it where it was meant to stop (or as soon as we can,
+	# if that's passed). The door's claimed from the operation that was cut short, like any other command, and the
+	# second pulse goes from a timer so whoever called recover() isn't held up. Returns False if the claim's gone.
+	def _resume(self, operationId, operation):
+		target = operation['target']
+		due = operation['due'] if operation['due'] is not None else operation['moved'] + (target / 100.0) * self.getTimeToOpen()
+		deadline = clock.time() + self.getSafeOperatingTime()
+		resumed = self.state.begin("ventilate", deadline, replaces=operationId, ventilating=True, target=target)
+		if resumed is None:
+			return False
+		
+		# journalled as a ventilate of our own whose first pulse has gone, so if we die too it's recovered again
+		wait = max(0.0, due - time.time())
+		self.journal.begin(resumed, "ventilate", deadline, target=target)
+		self.journal.pulsed(resumed, 1, wait=wait)
+		
+		timer = threading.Timer(wait, self._stopVentilate, (resumed,))
+		timer.daemon = True
+		timer.start()
+		return True
+	
+	def _stopVentilate(self, operationId):
+		current = self.state.read()
+		if (current.operationId != operationId or current.operation is None):
+			# forced out by another command
+			self.journal.end(operationId, journal.COMPENSATE)
+			return
+		self.journal.intend(operationId, 2)
+		self._trigger()
+		self.journal.pulsed(operationId, 2)
+		self.state.finish(operationId)
+		self.journal.end(operationId)
+	
 	# this is a dump door trigger, with some basic logic to set flashing lights based on previous door state.
 	def ifttt(self):
-		state = self.status()
+		with tracing.span("status") as attrs:
+			state = attrs['state'] = self.status()
 		
 		if (state == "operating"):
 			return
+		
+		# claimed like any other command, or it could pulse on top of one and cancel it out
+		if self._begin(1 if state == "closed" else 0, 100, 0) is None:
+			return
 			
 		self._trigger()
 		
 		if (state == "ventilate"):
 			return
 		
-		timeOpen = 15.59
-		timeClose = 19.77
-		timeout_start = time.time()
+		timeOpen = self.getTimeToOpen()
+		timeClose = self.getTimeToClose()
+		timeout_start = clock.time()
 		
 		if (state == "closed"):
 			duration = timeOpen
 		elif(state == "open"):
 			duration = timeClose
 				
+	# Claim the door before pulsing the relay, so two scripts (or a script and the daemon) can't both trigger it
+	# and cancel each other out. Returns the operation id, None if something else has the door moving.
+	def _begin(self, action, amount, force, **changes):
+		if (action == 1 and 0 < amount < 100):
+			name = "ventilate"
+		else:
+			name = "open" if action == 1 else "close"
+		tracing.annotate(operation=name)
+		with tracing.span("claim") as attrs:
+			operation = attrs['operation'] = self.state.begin(name, clock.time() + self.getSafeOperatingTime(), force=bool(force), **changes)
+		return operation
+	
 	# action = open/close where close is 0, open is 1
 	# amount = % of door openness based upon a guess of time.
-	# Time to open fully (from closed) = 15.59 seconds
-	# time to close fully (from open) = 19.77 seconds
+	# Time to open/close fully comes from the measured travel times, see traveltime.py
 	
 	def _operate(self, action, amount, force):
 	
-		timeout_start = time.time()
-		timeOpen = 15.59
-		timeClose = 19.77
+		timeout_start = clock.time()
+		timeOpen = self.getTimeToOpen()
+		timeClose = self.getTimeToClose()
 		
-		state = self.status()
+		with tracing.span("status") as attrs:
+			state = attrs['state'] = self.status()
 		
 		if (state == "operating" and force == 0):
 			# if door currently operating, do nothing.
@@ -227,6 +337,7 @@ class GarageDoor(Garage):
 				#	self.operation = "closing"
 				#elif (action == 1):
 				#	self.operation = "opening"
+				self._begin(action, amount, force)
 				self._trigger()
 			else:
 				sys.stderr.write("Error, invalid action. Must be 1 (to open) or 0 (to close)")
@@ -238,10 +349,9 @@ class GarageDoor(Garage):
 				#print("Closing door...")
 				#self.operation = "closing"
 				
-				# just to be sure, remove the marker that the door is in ventilation mode.
-				if self.TEMPFILE.is_file():
-					self.TEMPFILE.unlink()	
-				
+				# just to be sure, clear ventilation mode.
+				if self._begin(action, amount, force, ventilating=False) is None:
+					return
 				
 				self._trigger()
 			else:
@@ -255,19 +365,33 @@ class GarageDoor(Garage):
 				
 				#self.operation = "opening"
 				
-				# just to be sure, remove the marker that the door is in ventilation mode.
-				if self.TEMPFILE.is_file():
-					self.TEMPFILE.unlink()	
+				# just to be sure, clear ventilation mode.
+				operation = self._begin(action, amount, force, ventilating=False)
+				if operation is None:
+					return
 
 				duration = (amount/100) * timeOpen
+				ventilating = (amount > 0 and amount < 100)
+				
+				if ventilating:
+					# two pulses, each written to the journal before and after, see recover()
+					self.journal.begin(operation, "ventilate", self.state.read().deadline, target=int(amount))
+					self.journal.intend(operation, 1)
+				
 				self._trigger()
 				
-				if (amount > 0 and amount < 100):
-					# create a file on the system to denote I'm opening the door to air.
-					self.TEMPFILE.touch()
+				if ventilating:
+					self.journal.pulsed(operation, 1, wait=duration)
+					# denote I'm opening the door to air.
+					self.state.update(ventilating=True, target=int(amount))
 					# sleep for the time it takes until door is in ventilate mode. 
-					time.sleep(duration)
+					with tracing.span("ventilate wait"):
+						clock.sleep(duration)
+					self.journal.intend(operation, 2)
 					self._trigger()
+					self.journal.pulsed(operation, 2)
+					self.state.finish(operation)
+					self.journal.end(operation)
 			else:
 				sys.stderr.write("Error, invalid action. Must be 1 (to open) or 0 (to close)")
 		elif state == "ventilate":
@@ -286,10 +410,11 @@ class GarageDoor(Garage):
 				# this is only needed if I wanted to flash lights whilst opening
 				#duration = timeOpen - ((self.VENTILATIONPERC/100) * timeOpen)
 				
-				self._trigger()
+				# and we're out of ventilation mode.
+				if self._begin(action, amount, force, ventilating=False) is None:
+					return
 				
-				# remove the marker that the door is in ventilation mode.
-				self.TEMPFILE.unlink()	
+				self._trigger()
 			else:
 				sys.stderr.write("Error, invalid action. Must be 1 (to open) or 0 (to close)")
 		else: 
@@ -309,6 +434,18 @@ class Car(Garage):
 		self.temperature = 25
 		self.speedSound = 34308 + (0.6*self.temperature)
 		
+		# longest we'll wait for an echo, in seconds. The HC-SR04 gives up itself at about 4m (~25ms).
+		self.echoTimeout = 0.1
+		
+		# an acquire.Acquirer to take the readings in its own real-time process (None = read them here)
+		self.acquirer = None
+		
+		# Rough car height at lowest point is ~ 110cm from sensor, any nearer and the car's there
+		self.presentDistance = 110
+		
+		# one ping at a time, the parking assist (parking.py) pings from its own thread
+		self._lock = threading.Lock()
+		
 		#print("Ultrasonic Measurement")
 		#print("Speed of sound is",speedSound/100,"m/s at ",temperature,"deg")
 		
@@ -320,36 +457,69 @@ class Car(Garage):
 		GPIO.output(self.GPIO_TRIGGER, False)
 		
 	def _measure(self):
+		with self._lock:
+			return self._ping()
+	
+	def _ping(self):
 		# This function measures a distance
+		# a backend that timestamps the echo's edges in the kernel (gpiodgpio.py) times it itself
+		pulse = echoPulse(self.GPIO_TRIGGER, self.GPIO_ECHO, self.echoTimeout)
+		if pulse is None:
+			pulse = self._timeEcho()
+		(start, stop) = pulse
+		
+		elapsed = stop-start
+		distance = (elapsed * self.speedSound)/2
+		
+		return distance
+	
+	# ping, then watch the echo pin for when the echo starts and stops
+	def _timeEcho(self):
 		GPIO.output(self.GPIO_TRIGGER, True)
 		# Wait 10us
-		time.sleep(0.00001)
+		clock.sleep(0.00001)
 		GPIO.output(self.GPIO_TRIGGER, False)
-		start = time.time()
+		# looked up once, so each time round the loops below is just the read and the clock
+		(read, now, pin) = (GPIO.input, clock.timer(), self.GPIO_ECHO)
+		start = now()
+		stop = start
 		
-		while GPIO.input(self.GPIO_ECHO)==0:
-			start = time.time()
+		# a missing or unplugged sensor never raises the echo (or never drops it), so don't wait forever
+		timeout = start + self.echoTimeout
 		
-		while GPIO.input(self.GPIO_ECHO)==1:
-			stop = time.time()
+		while read(pin)==0:
+			start = now()
+			if (start > timeout):
+				raise IOError("No echo from the HC-SR04 on GPIO {0}".format(self.GPIO_ECHO))
 		
-		elapsed = stop-start
-		distance = (elapsed * self.speedSound)/2
+		while read(pin)==1:
+			stop = now()
+			if (stop > timeout):
+				raise IOError("HC-SR04 echo on GPIO {0} stuck high".format(self.GPIO_ECHO))
 		
-		return distance
+		return (start, stop)
 		
 	def _measure_average(self):
 		# This function takes 3 measurements and
 		# returns the average.
 		
+		if self.acquirer is not None:
+			return self.acquirer.measureDistance()
+		
 		distance1=self._measure()
-		time.sleep(0.1)
+		clock.sleep(0.1)
 		distance2=self._measure()
-		time.sleep(0.1)
+		clock.sleep(0.1)
 		distance3=self._measure()
 		distance = distance1 + distance2 + distance3
 		distance = distance / 3
 		return distance
+	
+	# a single distance in cm, no settling or averaging, for when they're wanted many times a second
+	def ping(self):
+		if self.acquirer is not None:
+			return self.acquirer.ping()
+		return self._measure()
 	  
 	# Check if car is present
 	# Rough car height at lowest point is ~ 110cm from sensor.
@@ -357,10 +527,10 @@ class Car(Garage):
 	  
 	def status(self):
 		# Allow the HC-SR04 module to settle
-		time.sleep(0.5)
+		clock.sleep(0.5)
 		
 		distance = self._measure_average()
-		if distance < 110:
+		if distance < self.presentDistance:
 			presence = 1
 		else: 
 			presence = 0
@@ -377,11 +547,10 @@ class Car(Garage):
 
 
 class GarageWeather(Garage):
-	def __init__(self, unit="c"):
+	def __init__(self, unit="c", outside=True):
 		#super(GarageWeather, self).__init__()
 		
 		import dht11
-		import meteocalc as mc
 		
 		# DHT11 module, dht11 module handles pin management. 
 		self.DHT11_PIN = 21
@@ -389,8 +558,15 @@ class GarageWeather(Garage):
 		# ensure we declare an instance of the dht11 interface. 
 		self.dht11 = dht11
 		
-		# get outside weather too
-		self.outside = OutsideWeather(unit)
+		# an acquire.Acquirer to take the readings in its own real-time process (None = read them here)
+		self.acquirer = None
+		
+		# the DHT11 can't be read more than once a second, retries included
+		self.minReadInterval = 1.0
+		self.lastRead = None
+		
+		# get outside weather too (None = don't)
+		self.outside = OutsideWeather(unit) if outside else None
 		
 		DEGC = u"\u2103"
 		DEGF = u"\u2109"
@@ -406,14 +582,27 @@ class GarageWeather(Garage):
 		
 		#self.status()
 		
-	def status(self):
+	# attempts = how many reads to try before giving up with an IOError (None = keep trying)
+	def status(self, attempts=None):
+		import meteocalc as mc
 	
-		instance = self.dht11.DHT11(pin=self.DHT11_PIN)
+		if self.acquirer is not None:
+			read = lambda: self.acquirer.readDHT11(self.DHT11_PIN)
+		else:
+			read = self.dht11.DHT11(pin=self.DHT11_PIN).read
 		
-		self.outside.status()
+		if self.outside is not None:
+			self.outside.status()
 		
+		tries = 0
 		while True:
-			result = instance.read()
+			if (attempts is not None and tries >= attempts):
+				raise IOError("No valid reading from the DHT11 after {0} attempts".format(tries))
+			tries += 1
+			if self.lastRead is not None:
+				clock.sleep(max(0, self.lastRead + self.minReadInterval - clock.time()))
+			self.lastRead = clock.time()
+			result = read()
 			if result.is_valid():
 				if (self.unit == "f"):
 				    temperature = 9.0/5.0 * result.temperature + 32
@@ -441,13 +630,14 @@ class GarageWeather(Garage):
 				
 				return (temperature, humidity, heatIndex)
 				break	
-			time.sleep(0.1)	
 	
 	def display(self):
 		#print("Temperature: %d%s, Humidity: %d%%" % (self.temperature, self.DEGC, self.humidity))
 		
 		(temp, humidity, heatIndex) = self.status()
 		insideWeather = "Temperature inside: {0}{3} (Feels like: {1}{3}), Humidity: {2}%".format(temp, heatIndex, humidity, self.DEG)
+		if self.outside is None:
+			return insideWeather
 		outsideWeather = self.outside.display()
 		
 		str = "{0}\n{1}".format(insideWeather, outsideWeather)
@@ -463,6 +653,11 @@ class OutsideWeather():
         (lat,long) = sekret.getCoords()
         owmKey = sekret.getOWMKey()
         owm = pyowm.OWM(owmKey)
+        self.owm = owm
+        self.coords = (lat, long)
+        
+        # OWM only updates every 10 minutes or so, no point asking more often than this
+        self.ttl = 600
         
         DEGC = u"\u2103"
         DEGF = u"\u2109"
@@ -477,15 +672,31 @@ class OutsideWeather():
             self.DEG = DEGK
         
         try:
-                self.obs = owm.weather_at_coords(lat, long)
+                with tracing.span("owm"):
+                    self.obs = owm.weather_at_coords(lat, long)
+                self.fetched = time.time()
         except:
                 print("I reckon you've got the wrong API key, or you haven't waited 10 minutes for the API Key to be registered.")
                 sys.exit()
         
         #self.status()
         
+    # fetch a new observation if the one we have is older than ttl (or force), status() only reports the one we have
+    def refresh(self, force=False):
+        if (not force and self.expires() > time.time()):
+            return False
+        (lat, long) = self.coords
+        self.obs = self.owm.weather_at_coords(lat, long)
+        self.fetched = time.time()
+        return True
+    
+    # when the observation we have goes stale
+    def expires(self):
+        return self.fetched + self.ttl
     
     def status(self):
+        import meteocalc as mc
+        
         w = self.obs.get_weather()
         l = self.obs.get_location()
         
@@ -526,9 +737,11 @@ class OutsideWeather():
         
 
 class GarageLights(Garage):
-	def __init__(self):
+	def __init__(self, daemon=True):
 		#super(GarageLights, self).__init__()
 		
+		from animator import LightAnimator
+		
 		# Lights:
 		self.GPIO_RED	= 22
 		self.GPIO_GREEN = 23
@@ -539,38 +752,33 @@ class GarageLights(Garage):
 		# Set LEDs as output
 		GPIO.setup(self.GPIO_RED,GPIO.OUT)
 		GPIO.setup(self.GPIO_GREEN,GPIO.OUT)
+		
+		# all flashing happens on the animator's thread, so none of the below block the caller.
+		self.animator = LightAnimator(self.GPIO_RED, self.GPIO_GREEN, daemon)
 	
 	# set LEDs as per car presence 
 	def set(self, status):
 		# 1 = car present, 0 = no car
 		if status == 1:
 			# red = on, green = off
-			GPIO.output(self.GPIO_RED,GPIO.HIGH)
-			GPIO.output(self.GPIO_GREEN,GPIO.LOW)
+			self.animator.play("solid red")
 		else: 
 			# red = off, green = on
-			GPIO.output(self.GPIO_RED,GPIO.LOW)
-			GPIO.output(self.GPIO_GREEN,GPIO.HIGH)
+			self.animator.play("solid green")
+	
+	# play any pattern understood by LightAnimator, e.g. "pulse red 2", see animator.py
+	def animate(self, pattern, duration=None, then=None):
+		self.animator.play(pattern, duration, then)
 			
 	def flashRED(self, duration):
-		GPIO.output(self.GPIO_RED,GPIO.HIGH)
-		time.sleep(duration)
-		GPIO.output(self.GPIO_RED,GPIO.LOW)
-		time.sleep(duration)
+		self.animator.play("blink red {0}".format(duration), duration * 2, "off red")
 	
 	def flashGREEN(self, duration):
-		GPIO.output(self.GPIO_GREEN,GPIO.HIGH)
-		time.sleep(duration)
-		GPIO.output(self.GPIO_GREEN,GPIO.LOW)
-		time.sleep(duration)
-		
-	def flash(self, duration):
-		timeout_start = time.time()
-		
-		while (time.time() < timeout_start + duration):
-			GPIO.output(self.GPIO_RED,GPIO.HIGH)
-			GPIO.output(self.GPIO_GREEN,GPIO.LOW)
-			time.sleep(self.flashPeriod)
-			GPIO.output(self.GPIO_RED,GPIO.LOW)
-			GPIO.output(self.GPIO_GREEN,GPIO.HIGH)
-			time.sleep(self.flashPeriod)	
\ No newline at end of file
+		self.animator.play("blink green {0}".format(duration), duration * 2, "off green")
+		
+	def flash(self, duration, then=None):
+		self.animator.play("alternate {0}".format(self.flashPeriod), duration, then)
+	
+	# block until any timed flashing has finished
+	def wait(self):
+		self.animator.wait()
@@ -27,6 +27,9 @@ import sys
 import os
 import RPi.GPIO as GPIO
 import dht11
+from animator import LightAnimator
+from traveltime import TravelTimes
+from doorstate import DoorState
 from pathlib import Path
 
 __author__ = "Ryan Hunt <ryan@ryanhunt.net>"
@@ -98,7 +101,7 @@ def getDoorState():
 	elif (bottom == 0 and top == 1):
 		return "open"
 	elif (bottom == 0 and top == 0):
-		if TEMPFILE.is_file():
+		if doorState.isVentilating():
 			return "ventilate"
 		else:
 			return "opening"
@@ -110,24 +113,16 @@ def setLights(status):
 	# 1 = car present, 0 = no car
 	if status == 1:
 		# red = on, green = off
-		GPIO.output(GPIO_RED,GPIO.HIGH)
-		GPIO.output(GPIO_GREEN,GPIO.LOW)
+		animator.play("solid red")
 	else: 
 		# red = off, green = on
-		GPIO.output(GPIO_RED,GPIO.LOW)
-		GPIO.output(GPIO_GREEN,GPIO.HIGH)
+		animator.play("solid green")
 		
 def flashRED(duration):
-	GPIO.output(GPIO_RED,GPIO.HIGH)
-	time.sleep(duration)
-	GPIO.output(GPIO_RED,GPIO.LOW)
-	time.sleep(duration)
+	animator.play("blink red {0}".format(duration), duration * 2, "off red")
 
 def flashGREEN(duration):
-	GPIO.output(GPIO_GREEN,GPIO.HIGH)
-	time.sleep(duration)
-	GPIO.output(GPIO_GREEN,GPIO.LOW)
-	time.sleep(duration)
+	animator.play("blink green {0}".format(duration), duration * 2, "off green")
 
 
 def forceCloseDoor():
@@ -174,8 +169,8 @@ def ifttt():
 	if (state == "ventilate"):
 		return
 	
-	timeOpen = 15.59
-	timeClose = 19.77
+	timeOpen = travel.expected("open")
+	timeClose = travel.expected("close")
 	timeout_start = time.time()
 	
 	if (state == "closed"):
@@ -183,24 +178,19 @@ def ifttt():
 	elif(state == "open"):
 		duration = timeClose
 	
-	while (time.time() < timeout_start + duration):
-		flashRED(0.05)
-		flashGREEN(0.05)
-	
-	# this will reset the lights
-	isCarPresent()
+	# whilst the door moves, flash lights for cool effect. This returns straight away, isCarPresent() will reset the lights once the door is done.
+	animator.play("alternate 0.05", duration - (time.time() - timeout_start), then=isCarPresent)
 	
 
 # action = open/close where close is 0, open is 1
 # amount = % of door openness based upon a guess of time.
-# Time to open fully (from closed) = 15.59 seconds
-# time to close fully (from open) = 19.77 seconds
+# Time to open/close fully comes from the measured travel times, see traveltime.py
 
 def operateDoor(action, amount, force):
 
 	timeout_start = time.time()
-	timeOpen = 15.59
-	timeClose = 19.77
+	timeOpen = travel.expected("open")
+	timeClose = travel.expected("close")
 	
 	state = getDoorState()
 	
@@ -225,13 +215,8 @@ def operateDoor(action, amount, force):
 			print("Closing door...")
 			triggerDoor()
 			
-			# whilst closing, flash lights for cool effect.
-			while (time.time() < timeout_start + timeClose):
-				flashRED(0.05)
-				flashGREEN(0.05)
-			
-			# this will reset the lights
-			isCarPresent()
+			# whilst closing, flash lights for cool effect, isCarPresent() will reset the lights once it's done.
+			animator.play("alternate 0.05", timeClose - (time.time() - timeout_start), then=isCarPresent)
 				
 		else:
 			sys.stderr.write("Error, invalid action. Must be 1 (to open) or 0 (to close)")
@@ -246,17 +231,14 @@ def operateDoor(action, amount, force):
 			
 			triggerDoor()
 			
-			# whilst opening, flash lights for cool effect.
-			while (time.time() < timeout_start + duration):
-				flashRED(0.05)
-				flashGREEN(0.05)
-			
-			# this will reset the lights
-			isCarPresent()
+			# whilst opening, flash lights for cool effect, isCarPresent() will reset the lights once it's done.
+			animator.play("alternate 0.05", duration - (time.time() - timeout_start), then=isCarPresent)
 			
 			if (amount > 0 and amount < 100):
-				# create a file on the system to denote I'm opening the door to air.
-				TEMPFILE.touch()
+				# the lights no longer hold us up, so wait here until the door has opened far enough.
+				time.sleep(max(0, timeout_start + duration - time.time()))
+				# denote I'm opening the door to air.
+				doorState.update(ventilating=True, target=VENTILATIONPERC)
 				triggerDoor()
 		else:
 			sys.stderr.write("Error, invalid action. Must be 1 (to open) or 0 (to close)")
@@ -272,23 +254,18 @@ def operateDoor(action, amount, force):
 			
 			triggerDoor()
 			
-			# whilst opening, flash lights for cool effect.
-			while (time.time() < timeout_start + duration):
-				flashRED(0.05)
-				flashGREEN(0.05)
+			# whilst opening, flash lights for cool effect, isCarPresent() will reset the lights once it's done.
+			animator.play("alternate 0.05", duration - (time.time() - timeout_start), then=isCarPresent)
 			
-			# this will reset the lights
-			isCarPresent()
-			
-			# remove the marker that the door is in ventilation mode.
-			TEMPFILE.unlink()
+			# out of ventilation mode.
+			doorState.update(ventilating=False)
 			
 		elif action == 0:
 			print("Closing door...")
 			triggerDoor()
 			
 			# since we can't determine the time to close, we'll skip flashing lights for closing after ventilation. 
-			TEMPFILE.unlink()
+			doorState.update(ventilating=False)
 				
 		else:
 			sys.stderr.write("Error, invalid action. Must be 1 (to open) or 0 (to close)")
@@ -360,9 +337,13 @@ GPIO_RELAY = 4
 # DHT11 temp/humidity sensor
 DHT11_PIN = 21
 
-TEMPFILE = Path("/tmp/GarageDoor.air")
+# ventilate mode, shared with the daemon and other scripts (see doorstate.py)
+doorState = DoorState()
 VENTILATIONPERC = 10
 
+# door travel times, as measured by the daemon (defaults to 15.59 to open, 19.77 to close)
+travel = TravelTimes.load()
+
 # Found these figures 'more' correct, based upon http://www.engineeringtoolbox.com/air-speed-sound-d_603.html
 # Speed of sound in cm/s at temperature
 temperature = 25
@@ -379,6 +360,9 @@ GPIO.setup(GPIO_ECHO,GPIO.IN)      # Echo
 GPIO.setup(GPIO_RED,GPIO.OUT)
 GPIO.setup(GPIO_GREEN,GPIO.OUT)
 
+# LED flashing runs in the background. It isn't a daemon thread, so the script sticks around until the lights are done.
+animator = LightAnimator(GPIO_RED, GPIO_GREEN, daemon=False)
+
 # Set relay as output
 GPIO.setup(GPIO_RELAY,GPIO.OUT)
 
@@ -0,0 +1,122 @@
+#!/usr/bin/python3
+#
+# The GPIO library and clock the garage classes talk to.
+#
+# Everything in garage.py, dht11.py and the daemon goes through GPIO and clock below rather than RPi.GPIO and
+# time directly. Normally they are just RPi.GPIO (imported the first time it's needed) and the system clock,
+# but another backend can be swapped in with setBackend(), e.g. gpiotrace.py records a live Pi to a file and
+# replays it later on a virtual clock.
+#
+# A backend needs the same functions and constants as RPi.GPIO. It can also provide:
+#   time(), sleep(seconds), now()   to take over the clock
+#   note(tag, value)                to see (or substitute) state that doesn't live on a pin, like the ventilate marker
+#   inputs(pins)                    to read several pins at the same instant (see readPins())
+#   echo(trigger, echo, timeout)    to time an HC-SR04 ping itself (see echoPulse())
+#   lastEdge(pin)                   for when the latest edge on a pin being watched happened (see lastEdge())
+# gpiodgpio.py has the last three.
+# -----------------------
+
+import datetime
+import time
+
+__author__ = "Ryan Hunt <ryan@ryanhunt.net>"
+__copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
+
+_backend = None
+
+
+def getBackend():
+	global _backend
+
+	if _backend is None:
+		import RPi.GPIO
+		_backend = RPi.GPIO
+
+	return _backend
+
+
+def setBackend(backend):
+	global _backend
+
+	previous = _backend
+	_backend = backend
+	return previous
+
+
+# Let the backend know about (and optionally override) a value that isn't read from a pin.
+def note(tag, value):
+	hook = getattr(getBackend(), 'note', None)
+
+	if hook is None:
+		return value
+
+	return hook(tag, value)
+
+
+# The pins' values, read together when the backend can (so the two reeds can't be caught either side of the door
+# moving off one), otherwise one after the other.
+def readPins(*pins):
+	backend = getBackend()
+	bulk = getattr(backend, 'inputs', None)
+
+	if bulk is None:
+		return tuple(backend.input(pin) for pin in pins)
+
+	return tuple(bulk(pins))
+
+
+# (start, end) of the echo to a ping on trigger, if the backend times it, else None (and it's up to the caller).
+# A backend's echo() can also return None to leave it to the caller.
+def echoPulse(trigger, echo, timeout):
+	hook = getattr(getBackend(), 'echo', None)
+
+	if hook is None:
+		return None
+
+	return hook(trigger, echo, timeout)
+
+
+# When the latest edge on any of pins happened, from the backend's own timestamps, or None if it doesn't keep any.
+def lastEdge(*pins):
+	hook = getattr(getBackend(), 'lastEdge', None)
+
+	if hook is None:
+		return None
+
+	times = [t for t in (hook(pin) for pin in pins) if t is not None]
+	return max(times) if times else None
+
+
+class _GPIO():
+	# looked up on every call, so swapping the backend takes effect everywhere straight away. That costs a lookup
+	# each time, so a bit-banging loop takes GPIO.input once before it starts (read = GPIO.input) and calls that.
+	def __getattr__(self, name):
+		return getattr(getBackend(), name)
+
+
+class _Clock():
+	# the backend's time() if it has one, else time.time: like GPIO.input, for a tight loop to take once beforehand
+	def timer(self):
+		return getattr(getBackend(), 'time', time.time)
+
+	def time(self):
+		backend = getBackend()
+		if hasattr(backend, 'time'):
+			return backend.time()
+		return time.time()
+
+	def sleep(self, seconds):
+		backend = getBackend()
+		if hasattr(backend, 'sleep'):
+			return backend.sleep(seconds)
+		return time.sleep(seconds)
+
+	def now(self):
+		backend = getBackend()
+		if hasattr(backend, 'now'):
+			return backend.now()
+		return datetime.datetime.now()
+
+
+GPIO = _GPIO()
+clock = _Clock()
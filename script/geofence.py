@@ -0,0 +1,113 @@
+#!/usr/bin/python3
+#
+# Geofences for the webhook.
+#
+# garagedoor.php worked out the distance home with the spherical law of cosines, doing all the deg2rad trig
+# for both points on every request. Here each fence centre is turned into a unit vector (ECEF on a unit
+# sphere) once, and its radius into the cosine of the angle it covers. A position is then inside a fence when
+# the dot product of the two unit vectors is at least that cosine: three multiplies and a compare, and checking
+# every household member against every fence is a single matrix product.
+#
+# NumPy is used for that product when it's installed and there are enough fences to make it worth importing (it
+# costs several MB of memory), otherwise it's done in plain Python.
+# -----------------------
+
+from __future__ import print_function
+import math
+
+__author__ = "Ryan Hunt <ryan@ryanhunt.net>"
+__copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
+
+# mean earth radius
+EARTH_RADIUS_KM = 6371.0088
+
+# what garagedoor.php used, 200m
+DEFAULT_RADIUS_KM = 0.2
+
+# with fewer fences than this, plain Python is as quick as NumPy
+NUMPY_FENCES = 8
+
+
+def toVector(lat, long):
+	lat = math.radians(float(lat))
+	long = math.radians(float(long))
+	cosLat = math.cos(lat)
+	return (cosLat * math.cos(long), cosLat * math.sin(long), math.sin(lat))
+
+
+# great circle distance in km between two unit vectors
+def distance(a, b):
+	dot = a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+	return EARTH_RADIUS_KM * math.acos(max(-1.0, min(1.0, dot)))
+
+
+class Geofence():
+	def __init__(self, name, lat, long, radius=DEFAULT_RADIUS_KM):
+		self.name = name
+		self.lat = float(lat)
+		self.long = float(long)
+		self.radius = float(radius)
+
+		# all the trig happens here, once.
+		self.vector = toVector(lat, long)
+		self.cosRadius = math.cos(self.radius / EARTH_RADIUS_KM)
+
+	def contains(self, vector):
+		v = self.vector
+		return (v[0] * vector[0] + v[1] * vector[1] + v[2] * vector[2]) >= self.cosRadius
+
+	def distance(self, vector):
+		return distance(self.vector, vector)
+
+
+class Geofences():
+	def __init__(self, fences):
+		self.fences = list(fences)
+		self.names = [f.name for f in self.fences]
+
+		numpy = None
+		if (len(self.fences) >= NUMPY_FENCES):
+			try:
+				import numpy
+			except ImportError:
+				numpy = None
+
+		self._numpy = numpy
+		if numpy is not None:
+			# 3 x F matrix of fence centres, and the threshold for each column
+			self._centres = numpy.array([f.vector for f in self.fences]).reshape(-1, 3).T
+			self._cosRadius = numpy.array([f.cosRadius for f in self.fences])
+
+	# fences from garagesecret: getGeofences() -> {name: (lat, long[, radius km])} if it's there,
+	# otherwise a single 'home' fence at getCoords().
+	@classmethod
+	def fromSecret(cls, sekret):
+		if hasattr(sekret, 'getGeofences'):
+			fences = [Geofence(name, *spec) for (name, spec) in sorted(sekret.getGeofences().items())]
+		else:
+			(lat, long) = sekret.getCoords()
+			fences = [Geofence("home", lat, long)]
+		return cls(fences)
+
+	def get(self, name):
+		for fence in self.fences:
+			if fence.name == name:
+				return fence
+		return None
+
+	# positions = {member: (lat, long)}. Returns {member: [names of fences they're in]} for every member,
+	# checking all (member, fence) pairs in one go.
+	def check(self, positions):
+		members = list(positions)
+		vectors = [toVector(*positions[m]) for m in members]
+		return self.checkVectors(members, vectors)
+
+	def checkVectors(self, members, vectors):
+		if not members or not self.fences:
+			return dict((m, []) for m in members)
+
+		if self._numpy is not None:
+			inside = self._numpy.array(vectors).dot(self._centres) >= self._cosRadius
+			return dict((m, [self.names[j] for j in self._numpy.flatnonzero(inside[i])]) for (i, m) in enumerate(members))
+
+		return dict((m, [f.name for f in self.fences if f.contains(v)]) for (m, v) in zip(members, vectors))
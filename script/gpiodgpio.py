@@ -0,0 +1,376 @@
+#!/usr/bin/python3
+#
+# A GPIO backend (see garagegpio.py) on the kernel's GPIO character device, through the libgpiod v2 Python
+# bindings ('pip install gpiod'), instead of RPi.GPIO poking at /dev/gpiomem.
+#
+# What that gets us:
+#   - every line is in one request, so inputs() reads both reeds in one ioctl. status() can no longer see the
+#     bottom reed from before the door moved and the top one from after it (see garagegpio.readPins()).
+#   - edges are queued by the kernel with a timestamp taken in the interrupt handler, so none are lost while
+#     the daemon's busy, and the door's travel is timed from when the reed actually changed (lastEdge()).
+#   - the HC-SR04 echo is timed from the kernel's timestamps of its two edges (echo()), rather than by spinning
+#     on input() in Python, which anything else running on the Pi stretches.
+#
+#   ./garage-daemon.py --gpiod /dev/gpiochip0 --start
+#
+# The request is made again whenever another pin is set up, and reconfigured in place when only a setting
+# changes (dht11.py flips its pin between in and out for every reading). Pins are BCM numbers, which are the line
+# offsets on the Pi's gpiochip0. PWM (the LED animations) is done in software, like RPi.GPIO's.
+#
+# To try it without a Pi, the kernel's gpio-sim module makes a chip whose inputs are driven by writing the
+# pull of each line (as root):
+#
+#   modprobe gpio-sim
+#   mkdir -p /sys/kernel/config/gpio-sim/garage/bank0
+#   echo 28 > /sys/kernel/config/gpio-sim/garage/bank0/num_lines
+#   echo 1 > /sys/kernel/config/gpio-sim/garage/live
+#   cat /sys/kernel/config/gpio-sim/garage/bank0/chip_name               -> gpiochip4
+#   cat /sys/kernel/config/gpio-sim/garage/dev_name                      -> gpio-sim.0
+#   echo pull-down > /sys/devices/platform/gpio-sim.0/gpiochip4/sim_gpio17/pull      (bottom reed: door's moved)
+#
+# or, with no chip at all, hand it fakegpio.FakeGpiod in place of the gpiod module:
+#
+#   GpiodGPIO(gpiod=FakeGpiod(FakeGPIO(speed=100)))
+# -----------------------
+
+from __future__ import print_function
+import datetime
+import logging
+import os
+import threading
+import time
+
+__author__ = "Ryan Hunt <ryan@ryanhunt.net>"
+__copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
+
+DEFAULT_CHIP = "/dev/gpiochip0"
+CONSUMER = "garage"
+
+# how long the event thread waits on the kernel at a time, so it notices a new request or cleanup()
+EVENT_WAIT = 0.2
+
+
+class _SoftPWM():
+	# RPi.GPIO's PWM is software too: this is the same thing on a thread, plenty for fading an LED at 100Hz
+	def __init__(self, gpio, pin, frequency):
+		self._gpio = gpio
+		self._pin = pin
+		self._frequency = float(frequency)
+		self._duty = 0.0
+		self._thread = None
+		self._running = False
+
+	def start(self, duty):
+		self._duty = float(duty)
+		if self._thread is None:
+			self._running = True
+			self._thread = threading.Thread(target=self._run, name="PWM {0}".format(self._pin))
+			self._thread.daemon = True
+			self._thread.start()
+
+	def ChangeDutyCycle(self, duty):
+		self._duty = float(duty)
+
+	def ChangeFrequency(self, frequency):
+		self._frequency = float(frequency)
+
+	def stop(self):
+		self._running = False
+		if self._thread is not None:
+			self._thread.join()
+			self._thread = None
+		self._gpio.output(self._pin, self._gpio.LOW)
+
+	def _run(self):
+		while self._running:
+			period = 1.0 / self._frequency
+			high = period * max(0.0, min(100.0, self._duty)) / 100.0
+			if (high > 0):
+				self._gpio.output(self._pin, self._gpio.HIGH)
+				time.sleep(high)
+			if (high < period):
+				self._gpio.output(self._pin, self._gpio.LOW)
+				time.sleep(period - high)
+
+
+class GpiodGPIO():
+	# same values as RPi.GPIO
+	BOARD = 10
+	BCM = 11
+	OUT = 0
+	IN = 1
+	LOW = 0
+	HIGH = 1
+	PUD_OFF = 20
+	PUD_DOWN = 21
+	PUD_UP = 22
+	RISING = 31
+	FALLING = 32
+	BOTH = 33
+
+	def __init__(self, chip=DEFAULT_CHIP, gpiod=None):
+		if gpiod is None:
+			import gpiod
+		self._gpiod = gpiod
+		self.chip = chip
+
+		# pin -> {'mode', 'pull', 'value', 'edge', 'bouncetime'}, and the request holding them all
+		self._pins = {}
+		self._request = None
+		self._requested = ()
+		self._lock = threading.RLock()
+
+		# edge detection, as add_event_detect() set it up
+		self._callbacks = {}
+		self._detected = set()
+
+		# pin -> (nanoseconds, rising) of its latest edge, and the edges of any pin echo() is waiting on
+		self._edges = {}
+		self._listening = {}
+
+		self._resetEvents()
+		if hasattr(os, 'register_at_fork'):
+			# acquire.py forks, and its copy pings the HC-SR04 itself without our event thread
+			os.register_at_fork(after_in_child=self._resetEvents)
+
+	def _resetEvents(self):
+		# one thread reads the kernel's event queue at a time, and tells echo() when its edges turn up
+		self._eventLock = threading.Lock()
+		self._arrived = threading.Condition()
+		self._watcher = None
+		self._stopping = False
+
+	def setmode(self, mode):
+		if (mode != self.BCM):
+			raise ValueError("Pins are line offsets on {0}, which only BCM numbering matches".format(self.chip))
+
+	def setwarnings(self, flag):
+		pass
+
+	def setup(self, pin, mode, pull_up_down=PUD_OFF, initial=None):
+		with self._lock:
+			old = self._pins.get(pin, {})
+			settings = dict(old, mode=mode)
+			if (mode == self.OUT):
+				settings.update(pull=self.PUD_OFF, edge=None, bouncetime=None)
+				if initial is not None:
+					settings['value'] = self.HIGH if initial else self.LOW
+				settings.setdefault('value', self.LOW)
+			else:
+				settings['pull'] = pull_up_down
+				settings.setdefault('edge', None)
+
+			# status() sets the reeds up on every read, which costs nothing when nothing's changed
+			if (settings != old):
+				self._pins[pin] = settings
+				self._apply()
+
+	def _lineSettings(self, settings):
+		line = self._gpiod.line
+		# realtime, so the edges' timestamps compare with time.time()
+		kwargs = {'event_clock': line.Clock.REALTIME}
+
+		if (settings['mode'] == self.OUT):
+			kwargs['direction'] = line.Direction.OUTPUT
+			kwargs['output_value'] = line.Value.ACTIVE if settings['value'] else line.Value.INACTIVE
+		else:
+			kwargs['direction'] = line.Direction.INPUT
+			kwargs['bias'] = {self.PUD_UP: line.Bias.PULL_UP, self.PUD_DOWN: line.Bias.PULL_DOWN}.get(settings['pull'], line.Bias.DISABLED)
+			kwargs['edge_detection'] = {self.RISING: line.Edge.RISING, self.FALLING: line.Edge.FALLING, self.BOTH: line.Edge.BOTH}.get(settings['edge'], line.Edge.NONE)
+			if settings.get('bouncetime'):
+				kwargs['debounce_period'] = datetime.timedelta(milliseconds=settings['bouncetime'])
+
+		return self._gpiod.LineSettings(**kwargs)
+
+	def _apply(self):
+		config = dict((pin, self._lineSettings(settings)) for (pin, settings) in self._pins.items())
+		pins = tuple(sorted(config))
+
+		if (self._request is not None and pins == self._requested):
+			self._request.reconfigure_lines(config)
+			return
+
+		# a new pin: the lines are let go and requested again with it, outputs keep their values through
+		# output_value. Any edges still queued on the old request go with it.
+		previous = self._request
+		self._request = None
+		if previous is not None:
+			previous.release()
+		if config:
+			self._request = self._gpiod.request_lines(self.chip, consumer=CONSUMER, config=config)
+		self._requested = pins
+
+	def _requestFor(self, pins):
+		for pin in pins:
+			if pin not in self._pins:
+				raise RuntimeError("GPIO {0} hasn't been set up".format(pin))
+		return self._request
+
+	def _level(self, value):
+		return self.HIGH if (value == self._gpiod.line.Value.ACTIVE) else self.LOW
+
+	def input(self, pin):
+		return self._level(self._requestFor((pin,)).get_value(pin))
+
+	# the pins read together, in one ioctl
+	def inputs(self, pins):
+		pins = list(pins)
+		return tuple(self._level(value) for value in self._requestFor(pins).get_values(pins))
+
+	def output(self, pin, value):
+		value = self.HIGH if value else self.LOW
+		request = self._requestFor((pin,))
+		# remembered for when the lines are requested again
+		self._pins[pin]['value'] = value
+		request.set_value(pin, self._gpiod.line.Value.ACTIVE if value else self._gpiod.line.Value.INACTIVE)
+
+	def PWM(self, pin, frequency):
+		return _SoftPWM(self, pin, frequency)
+
+	def cleanup(self, *args):
+		with self._lock:
+			if args:
+				pins = args[0] if isinstance(args[0], (list, tuple)) else args
+				for pin in pins:
+					self.remove_event_detect(pin)
+					self._pins.pop(pin, None)
+				self._apply()
+				return
+
+			self._stopping = True
+			self._callbacks.clear()
+			self._pins.clear()
+			self._apply()
+
+		if self._watcher is not None:
+			self._watcher.join()
+			self._watcher = None
+		self._stopping = False
+
+	# Edge events, from the kernel's queue
+	def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+		with self._lock:
+			if pin in self._callbacks:
+				raise RuntimeError("Conflicting edge detection already enabled for GPIO {0}".format(pin))
+			settings = self._pins.get(pin)
+			if (settings is None or settings['mode'] != self.IN):
+				raise RuntimeError("GPIO {0} has to be set up as an input first".format(pin))
+
+			self._callbacks[pin] = [callback] if callback else []
+			self._pins[pin] = dict(settings, edge=edge, bouncetime=bouncetime)
+			self._apply()
+
+		self._watch()
+
+	def add_event_callback(self, pin, callback):
+		if pin not in self._callbacks:
+			raise RuntimeError("Add edge detection on GPIO {0} first".format(pin))
+		self._callbacks[pin].append(callback)
+
+	def remove_event_detect(self, pin):
+		with self._lock:
+			self._callbacks.pop(pin, None)
+			self._detected.discard(pin)
+			settings = self._pins.get(pin)
+			if (settings is not None and settings.get('edge') is not None):
+				self._pins[pin] = dict(settings, edge=None, bouncetime=None)
+				self._apply()
+
+	def event_detected(self, pin):
+		if pin in self._detected:
+			self._detected.discard(pin)
+			return True
+		return False
+
+	# when (time.time() seconds) the kernel saw the latest edge on pin, if it's watching it
+	def lastEdge(self, pin):
+		edge = self._edges.get(pin)
+		return None if edge is None else edge[0] / 1e9
+
+	def _watch(self):
+		if (self._watcher is None or not self._watcher.is_alive()):
+			self._watcher = threading.Thread(target=self._events, name="gpiod events")
+			self._watcher.daemon = True
+			self._watcher.start()
+
+	def _events(self):
+		while not self._stopping:
+			self._pump(EVENT_WAIT)
+
+	# Wait up to timeout for the kernel to have edges queued, and hand out whatever's there.
+	def _pump(self, timeout):
+		with self._eventLock:
+			request = self._request
+			if request is None:
+				time.sleep(timeout)
+				return
+			try:
+				if not request.wait_edge_events(timeout):
+					return
+				events = request.read_edge_events()
+			except Exception as e:
+				if request is self._request:
+					logging.warning("Couldn't read GPIO edge events from {0}: {1}".format(self.chip, e))
+					time.sleep(timeout)
+				# otherwise it was let go for a new request, which the next pass waits on
+				return
+
+		rising = self._gpiod.EdgeEvent.Type.RISING_EDGE
+		for event in events:
+			pin = event.line_offset
+			edge = (event.timestamp_ns, event.event_type == rising)
+
+			with self._arrived:
+				self._edges[pin] = edge
+				if pin in self._listening:
+					self._listening[pin].append(edge)
+					self._arrived.notify_all()
+
+			if pin in self._callbacks:
+				self._detected.add(pin)
+				for callback in list(self._callbacks.get(pin, ())):
+					callback(pin)
+
+	# Ping the HC-SR04 on trigger, and return when its echo went up and when it came down again (time.time()
+	# seconds), as the kernel timestamped the two edges.
+	def echo(self, trigger, echo, timeout):
+		with self._lock:
+			self._requestFor((trigger, echo))
+			settings = self._pins[echo]
+			if (settings['edge'] != self.BOTH or settings.get('bouncetime')):
+				self._pins[echo] = dict(settings, edge=self.BOTH, bouncetime=None)
+				self._apply()
+
+		with self._arrived:
+			self._listening[echo] = []
+
+		try:
+			self.output(trigger, self.HIGH)
+			time.sleep(0.00001)
+			self.output(trigger, self.LOW)
+
+			deadline = time.time() + timeout
+			while True:
+				with self._arrived:
+					edges = list(self._listening[echo])
+				rises = [t for (t, rising) in edges if rising]
+				if rises:
+					falls = [t for (t, rising) in edges if not rising and t > rises[0]]
+					if falls:
+						return (rises[0] / 1e9, falls[0] / 1e9)
+
+				remaining = deadline - time.time()
+				if (remaining <= 0):
+					if not rises:
+						raise IOError("No echo from the HC-SR04 on GPIO {0}".format(echo))
+					raise IOError("HC-SR04 echo on GPIO {0} stuck high".format(echo))
+
+				if (self._watcher is not None and self._watcher.is_alive()):
+					with self._arrived:
+						self._arrived.wait(min(remaining, 0.05))
+				else:
+					# nobody else is reading the events (no edge detection yet, or we're acquire.py's process)
+					self._pump(min(remaining, 0.05))
+		finally:
+			with self._arrived:
+				self._listening.pop(echo, None)
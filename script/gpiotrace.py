@@ -0,0 +1,560 @@
+#!/usr/bin/python3
+#
+# Record and replay GPIO activity.
+#
+# Chasing a daemon bug usually means waiting around for the real door to move. Instead, run the daemon with
+# '--trace FILE' on the Pi and it will record every pin read, write and edge (plus the ventilate marker and
+# the warnings it raised) to a compact file. That file can then be replayed on any machine:
+#
+#   ./gpiotrace.py replay garage.trace            (as fast as possible)
+#   ./gpiotrace.py replay garage.trace --speed 100
+#   ./gpiotrace.py dump garage.trace
+#
+# Replaying runs the real Garage/App.run code against a virtual clock, so a day of activity takes seconds.
+# The door transitions and warnings it comes up with are then checked against what was recorded.
+#
+# File format: a header, then 7 byte records of (microseconds since previous record, op, pin, value).
+# Reads are only stored when the value differs from the last read of that pin, so polling the reeds every
+# half second costs nothing until the door actually moves.
+# -----------------------
+
+from __future__ import print_function
+import argparse
+import atexit
+import bisect
+import datetime
+import importlib.util
+import os
+import struct
+import sys
+import threading
+import time
+import garagegpio
+
+__author__ = "Ryan Hunt <ryan@ryanhunt.net>"
+__copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
+
+MAGIC = b"GTRC"
+VERSION = 1
+
+# magic, version, start time, average seconds per input() in a busy loop, number of input() calls
+HEADER = struct.Struct("<4sBdfI")
+RECORD = struct.Struct("<IBBB")
+
+OP_NOP = 0
+OP_READ = 1
+OP_WRITE = 2
+OP_SETUP = 3
+OP_EDGE = 4
+OP_NOTE = 5
+
+OPS = {OP_NOP: "nop", OP_READ: "read", OP_WRITE: "write", OP_SETUP: "setup", OP_EDGE: "edge", OP_NOTE: "note"}
+
+# note() tags we keep, stored in the pin field. Order matters, append only.
+TAGS = ("ventilate", "warning")
+
+MAX_DELTA = 0xFFFFFFFF
+
+# a pin polled faster than this is a bit-banged read, used to work out how much time each input() takes.
+BUSY_LOOP = 0.001
+
+DEFAULT_READ_COST = 0.00001
+
+
+class TraceFinished(Exception):
+	pass
+
+
+class TraceRecorder():
+	# Wraps another GPIO backend (normally RPi.GPIO) and writes everything that goes through it to a file.
+	def __init__(self, backend, path):
+		self._backend = backend
+		self._file = open(path, "wb")
+		self._lock = threading.Lock()
+
+		self._start = time.time()
+		self._last = 0
+		self._lastFlush = self._start
+
+		self._levels = {}
+		self._modes = {}
+		self._notes = {}
+
+		self._reads = 0
+		self._lastInput = 0
+		self._busyReads = 0
+		self._busyTime = 0.0
+
+		self._file.write(HEADER.pack(MAGIC, VERSION, self._start, DEFAULT_READ_COST, 0))
+
+	# the backend being recorded
+	@property
+	def backend(self):
+		return self._backend
+
+	# constants, PWM and anything else we don't care about come straight from the real backend
+	def __getattr__(self, name):
+		return getattr(self._backend, name)
+
+	def setup(self, pin, mode, *args, **kwargs):
+		self._backend.setup(pin, mode, *args, **kwargs)
+
+		if (self._modes.get(pin) != mode):
+			self._modes[pin] = mode
+			self._write(OP_SETUP, pin, mode)
+
+	# This sits in the DHT11's and HC-SR04's bit-banging loops, so it's kept to the least it can be: no lock (the
+	# counts only work out the average cost of a read, losing the odd one to another thread doesn't matter) and
+	# nothing written unless the level has changed.
+	def input(self, pin):
+		value = self._backend.input(pin)
+		now = time.time()
+
+		self._reads += 1
+		gap = now - self._lastInput
+		if (gap < BUSY_LOOP):
+			self._busyReads += 1
+			self._busyTime += gap
+		self._lastInput = now
+
+		if (self._levels.get(pin) != value):
+			self._levels[pin] = value
+			self._write(OP_READ, pin, value, now)
+		return value
+
+	def _read(self, pin, value, now):
+		if (self._levels.get(pin) != value):
+			self._levels[pin] = value
+			self._write(OP_READ, pin, value, now)
+
+	# a bulk read goes down as a read of each pin, at the same moment
+	def inputs(self, pins):
+		bulk = getattr(self._backend, 'inputs', None)
+		if bulk is None:
+			return tuple(self.input(pin) for pin in pins)
+
+		values = tuple(bulk(pins))
+		now = time.time()
+		for (pin, value) in zip(pins, values):
+			self._read(pin, value, now)
+		return values
+
+	# A ping the backend timed itself goes down as the trigger's writes and the echo's two edges, so replaying it
+	# through Car._timeEcho() comes up with the same distance.
+	def echo(self, trigger, echo, timeout):
+		hook = getattr(self._backend, 'echo', None)
+		if hook is None:
+			return None
+
+		self._write(OP_WRITE, trigger, 1)
+		self._write(OP_WRITE, trigger, 0)
+		(start, stop) = hook(trigger, echo, timeout)
+		self._read(echo, 1, start)
+		self._read(echo, 0, stop)
+		return (start, stop)
+
+	def output(self, pin, value):
+		self._backend.output(pin, value)
+		self._write(OP_WRITE, pin, 1 if value else 0)
+
+	def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+		kwargs = {}
+		if callback is not None:
+			kwargs['callback'] = self._edgeCallback(callback)
+		if bouncetime is not None:
+			kwargs['bouncetime'] = bouncetime
+		self._backend.add_event_detect(pin, edge, **kwargs)
+
+	def add_event_callback(self, pin, callback):
+		self._backend.add_event_callback(pin, self._edgeCallback(callback))
+
+	def _edgeCallback(self, callback):
+		def edge(pin):
+			value = self._backend.input(pin)
+			self._levels[pin] = value
+			self._write(OP_EDGE, pin, value)
+			callback(pin)
+		return edge
+
+	def note(self, tag, value):
+		if tag in TAGS:
+			# warnings are events, everything else is a level that we only store when it changes.
+			if (tag == "warning" or self._notes.get(tag) != value):
+				self._notes[tag] = value
+				self._write(OP_NOTE, TAGS.index(tag), int(value) & 0xFF)
+		return value
+
+	def _write(self, op, pin, value, now=None):
+		if now is None:
+			now = time.time()
+
+		with self._lock:
+			offset = max(self._last, int((now - self._start) * 1000000))
+			delta = offset - self._last
+			self._last = offset
+
+			while delta > MAX_DELTA:
+				self._file.write(RECORD.pack(MAX_DELTA, OP_NOP, 0, 0))
+				delta -= MAX_DELTA
+
+			self._file.write(RECORD.pack(delta, op, pin & 0xFF, value & 0xFF))
+
+			if (now - self._lastFlush > 1.0):
+				self._file.flush()
+				self._lastFlush = now
+
+	def close(self):
+		if self._file.closed:
+			return
+
+		# marks the end of the recording, even if nothing changed for a while before it
+		self._write(OP_NOP, 0, 0)
+
+		with self._lock:
+			readCost = self._busyTime / self._busyReads if self._busyReads else DEFAULT_READ_COST
+			self._file.seek(0)
+			self._file.write(HEADER.pack(MAGIC, VERSION, self._start, readCost, self._reads & 0xFFFFFFFF))
+			self._file.close()
+
+
+# Start recording everything that goes through garagegpio to path.
+def record(path):
+	recorder = TraceRecorder(garagegpio.getBackend(), path)
+	garagegpio.setBackend(recorder)
+	# fills in the header (read timing) when the daemon exits
+	atexit.register(recorder.close)
+	return recorder
+
+
+class Trace():
+	# A trace file loaded into per-pin timelines.
+	def __init__(self, path):
+		with open(path, "rb") as f:
+			data = f.read()
+
+		(magic, version, self.start, self.readCost, self.reads) = HEADER.unpack_from(data, 0)
+
+		if (magic != MAGIC or version != VERSION):
+			raise ValueError("{0} is not a GPIO trace (or is from a newer version)".format(path))
+
+		self.records = []
+		self.levels = {}
+		self.writes = []
+		self.notes = {}
+
+		offset = 0
+		usable = len(data) - (len(data) - HEADER.size) % RECORD.size
+		for (delta, op, pin, value) in RECORD.iter_unpack(data[HEADER.size:usable]):
+			offset += delta
+			t = self.start + offset / 1000000.0
+
+			if (op == OP_NOP):
+				continue
+
+			self.records.append((t, op, pin, value))
+
+			if (op == OP_READ or op == OP_EDGE):
+				self._append(self.levels, pin, t, value)
+			elif (op == OP_WRITE):
+				self.writes.append((t, pin, value))
+			elif (op == OP_NOTE and pin < len(TAGS)):
+				self._append(self.notes, TAGS[pin], t, value)
+
+		self.end = self.start + offset / 1000000.0
+
+	@staticmethod
+	def _append(timelines, key, t, value):
+		(times, values) = timelines.setdefault(key, ([], []))
+		if values and values[-1] == value:
+			return
+		times.append(t)
+		values.append(value)
+
+	# value of a pin (or note) at time t, or default if nothing was recorded before then.
+	@staticmethod
+	def valueAt(timeline, t, default=None):
+		if timeline is None:
+			return default
+		(times, values) = timeline
+		i = bisect.bisect_right(times, t) - 1
+		if (i < 0):
+			return values[0] if values else default
+		return values[i]
+
+	def noteTimes(self, tag):
+		return [t for (t, op, pin, value) in self.records if op == OP_NOTE and pin == TAGS.index(tag)]
+
+
+class _PWM():
+	def __init__(self, pin, frequency):
+		pass
+
+	def start(self, duty):
+		pass
+
+	def ChangeDutyCycle(self, duty):
+		pass
+
+	def ChangeFrequency(self, frequency):
+		pass
+
+	def stop(self):
+		pass
+
+
+class TraceReplay():
+	# A GPIO backend (and clock) that plays a Trace back. Time only moves when the code sleeps or reads a pin,
+	# so nothing ever actually waits unless a speed is given.
+
+	# same values as RPi.GPIO
+	BOARD = 10
+	BCM = 11
+	OUT = 0
+	IN = 1
+	LOW = 0
+	HIGH = 1
+	PUD_OFF = 20
+	PUD_DOWN = 21
+	PUD_UP = 22
+	RISING = 31
+	FALLING = 32
+	BOTH = 33
+
+	PWM = _PWM
+
+	def __init__(self, trace, speed=None):
+		self.trace = trace
+		self.speed = speed
+		self._now = trace.start
+		self._callbacks = {}
+		self._detected = set()
+
+		# what the code under replay did
+		self.writes = []
+		self.warnings = []
+
+	def setmode(self, mode):
+		pass
+
+	def setwarnings(self, flag):
+		pass
+
+	def setup(self, pin, mode, *args, **kwargs):
+		pass
+
+	def cleanup(self, *args):
+		pass
+
+	def input(self, pin):
+		self._advance(self._now + self.trace.readCost)
+		return Trace.valueAt(self.trace.levels.get(pin), self._now, 0)
+
+	def output(self, pin, value):
+		self.writes.append((self._now, pin, 1 if value else 0))
+
+	def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+		self._callbacks[pin] = (edge, [callback] if callback else [])
+
+	def add_event_callback(self, pin, callback):
+		self._callbacks[pin][1].append(callback)
+
+	def remove_event_detect(self, pin):
+		self._callbacks.pop(pin, None)
+
+	def event_detected(self, pin):
+		if pin in self._detected:
+			self._detected.discard(pin)
+			return True
+		return False
+
+	def note(self, tag, value):
+		if (tag == "warning"):
+			self.warnings.append(self._now)
+			return value
+		return Trace.valueAt(self.trace.notes.get(tag), self._now, value)
+
+	def time(self):
+		return self._now
+
+	def now(self):
+		return datetime.datetime.fromtimestamp(self._now)
+
+	def sleep(self, seconds):
+		if (self.speed):
+			time.sleep(seconds / self.speed)
+		self._advance(self._now + seconds)
+
+	def _advance(self, target):
+		if (target > self.trace.end):
+			self._now = self.trace.end
+			raise TraceFinished()
+
+		# fire any edge callbacks for level changes between now and target, in order.
+		events = []
+		for (pin, (edge, callbacks)) in self._callbacks.items():
+			timeline = self.trace.levels.get(pin)
+			if timeline is None:
+				continue
+			(times, values) = timeline
+			i = bisect.bisect_right(times, self._now)
+			while (i < len(times) and times[i] <= target):
+				rising = values[i] > (values[i - 1] if i > 0 else 0)
+				if (edge == self.BOTH or (edge == self.RISING) == rising):
+					events.append((times[i], pin, callbacks))
+				i += 1
+
+		for (t, pin, callbacks) in sorted(events, key=lambda e: e[0]):
+			self._now = t
+			self._detected.add(pin)
+			for callback in callbacks:
+				callback(pin)
+
+		self._now = target
+
+
+def _loadDaemon():
+	path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "garage-daemon.py")
+	spec = importlib.util.spec_from_file_location("garage_daemon", path)
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module
+
+
+# match expected (time, key) events against observed ones, in order, allowing tolerance seconds either way.
+def _match(expected, observed, tolerance):
+	missed = []
+	remaining = list(observed)
+
+	for (t, key) in expected:
+		for (i, (ot, okey)) in enumerate(remaining):
+			if (ot > t + tolerance):
+				missed.append((t, key))
+				break
+			if (okey == key and abs(ot - t) <= tolerance):
+				del remaining[i]
+				break
+		else:
+			missed.append((t, key))
+
+	return (missed, remaining)
+
+
+# What the door was actually doing over the trace, from the reeds and the ventilate marker.
+def groundTruth(trace, door):
+	bottom = trace.levels.get(door.REED_BOTTOM)
+	top = trace.levels.get(door.REED_TOP)
+	ventilate = trace.notes.get("ventilate")
+
+	times = set()
+	for timeline in (bottom, top, ventilate):
+		if timeline is not None:
+			times.update(timeline[0])
+
+	states = []
+	for t in sorted(times):
+		state = door.stateFor(Trace.valueAt(bottom, t, 0), Trace.valueAt(top, t, 0), lambda: Trace.valueAt(ventilate, t, False))
+		if not states or states[-1][1] != state:
+			states.append((t, state))
+
+	return states
+
+
+# Run the daemon's main loop over a recorded trace and compare what it saw with what really happened.
+def replay(path, speed=None, tolerance=None):
+	from garage import Garage
+	from doorstate import DoorState
+	from journal import Journal
+
+	trace = Trace(path)
+	backend = TraceReplay(trace, speed)
+	previous = garagegpio.setBackend(backend)
+
+	try:
+		daemon = _loadDaemon()
+		app = daemon.App(Garage(30, weather=False))
+		# only the door is being replayed. step() is driven directly, without the sensor workers.
+		app.rollupFile = None
+		app.historyPath = None
+		app.garage.door.travel.path = None
+		app.garage.door.state = DoorState(None)
+		app.garage.door.journal = Journal(None)
+
+		if tolerance is None:
+			tolerance = 2 * app.pollInterval
+
+		transitions = []
+
+		def transition(lastStatus, status, lastTime, nowTime):
+			transitions.append((backend.time(), (lastStatus, status)))
+			daemon.App.transition(app, lastStatus, status, lastTime, nowTime)
+
+		app.transition = transition
+
+		wallStart = time.time()
+		try:
+			app.start()
+			while True:
+				app.step()
+				garagegpio.clock.sleep(app.pollInterval)
+		except TraceFinished:
+			pass
+		wall = time.time() - wallStart
+
+		states = groundTruth(trace, app.garage.door)
+		expected = [(t, (states[i - 1][1], state)) for (i, (t, state)) in enumerate(states) if i > 0 and t > trace.start + tolerance]
+		(missedTransitions, extraTransitions) = _match(expected, transitions, tolerance)
+
+		expectedWarnings = [(t, "warning") for t in trace.noteTimes("warning")]
+		observedWarnings = [(t, "warning") for t in backend.warnings]
+		(missedWarnings, extraWarnings) = _match(expectedWarnings, observedWarnings, tolerance)
+	finally:
+		garagegpio.setBackend(previous)
+
+	virtual = trace.end - trace.start
+
+	return {
+		'virtualSeconds': virtual,
+		'wallSeconds': wall,
+		'speedup': virtual / wall if wall > 0 else float('inf'),
+		'transitions': len(expected),
+		'missedTransitions': missedTransitions,
+		'extraTransitions': extraTransitions,
+		'warnings': len(expectedWarnings),
+		'missedWarnings': missedWarnings,
+		'extraWarnings': extraWarnings,
+		'ok': not (missedTransitions or extraTransitions or missedWarnings or extraWarnings),
+	}
+
+
+def dump(path):
+	trace = Trace(path)
+	print("Trace started {0}, {1:.1f} seconds, {2} reads ({3:.1f}us each), {4} records".format(time.ctime(trace.start), trace.end - trace.start, trace.reads, trace.readCost * 1000000, len(trace.records)))
+	for (t, op, pin, value) in trace.records:
+		name = TAGS[pin] if (op == OP_NOTE and pin < len(TAGS)) else pin
+		print("{0:.6f} {1:6} {2} {3}".format(t - trace.start, OPS.get(op, op), name, value))
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Replay or inspect a GPIO trace recorded with garage-daemon.py --trace.')
+	parser.add_argument("action", choices=["replay", "dump"])
+	parser.add_argument("trace", help="trace file")
+	parser.add_argument("-s", "--speed", type=float, help="replay at this many times real time (default: as fast as possible)")
+	parser.add_argument("-t", "--tolerance", type=float, help="seconds an event may be out by and still match (default: two polls)")
+	args = parser.parse_args()
+
+	if (args.action == "dump"):
+		dump(args.trace)
+		sys.exit()
+
+	result = replay(args.trace, args.speed, args.tolerance)
+
+	print("Replayed {0:.0f} seconds in {1:.2f} seconds ({2:.0f}x)".format(result['virtualSeconds'], result['wallSeconds'], result['speedup']))
+	print("Transitions: {0} recorded, {1} missed, {2} unexpected".format(result['transitions'], len(result['missedTransitions']), len(result['extraTransitions'])))
+	print("Warnings: {0} recorded, {1} missed, {2} unexpected".format(result['warnings'], len(result['missedWarnings']), len(result['extraWarnings'])))
+
+	for (t, key) in result['missedTransitions'] + result['missedWarnings']:
+		print("  missed {0} at {1}".format(key, time.ctime(t)))
+	for (t, key) in result['extraTransitions'] + result['extraWarnings']:
+		print("  unexpected {0} at {1}".format(key, time.ctime(t)))
+
+	sys.exit(0 if result['ok'] else 1)
@@ -0,0 +1,271 @@
+#!/usr/bin/python3
+#
+# On-disk history of the daemon's readings, for export.py.
+#
+# Whenever a reading changes what the daemon knows (door state, car, inside or outside climate) one fixed size
+# record holding all of them is appended to that day's (UTC) file in /var/tmp/garage.history:
+#
+#   header  magic (4s), version (B), 3 pad bytes
+#   record  time (d), carPresent (b), doorState (B), then temperature, humidity, heatIndex, oTemperature,
+#           oHumidity, oHeatIndex and rainfall as float32
+#
+# A missing value is NaN (-1 for carPresent, 255 for doorState). Records are in time order, so a time range is
+# found by bisecting the file. A field is pulled out of a run of records with extended slice copies, one byte
+# lane at a time, rather than unpacking each record in Python, so reading a year of 1 Hz data takes seconds.
+#
+#   store = HistoryStore()
+#   store.add({'doorState': 'open'})
+#   for chunk in store.chunks(start, end, ['time', 'humidity']):
+#       chunk['humidity']     -> array.array('f') of up to 'size' values
+#
+# Files older than keepDays are removed as new days start.
+# -----------------------
+
+from __future__ import print_function
+import array
+import math
+import mmap
+import os
+import struct
+import sys
+import time
+from wireformat import DOOR_STATES
+
+__author__ = "Ryan Hunt <ryan@ryanhunt.net>"
+__copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
+
+DEFAULT_PATH = "/var/tmp/garage.history"
+
+MAGIC = b"GHST"
+VERSION = 1
+HEADER = struct.Struct("<4sB3x")
+
+# (name, struct/array type code). Order is the record order, append only (and bump VERSION).
+FIELDS = (
+	('time', 'd'),
+	('carPresent', 'b'),
+	('doorState', 'B'),
+	('temperature', 'f'),
+	('humidity', 'f'),
+	('heatIndex', 'f'),
+	('oTemperature', 'f'),
+	('oHumidity', 'f'),
+	('oHeatIndex', 'f'),
+	('rainfall', 'f'),
+)
+
+NAMES = tuple(f[0] for f in FIELDS)
+TYPES = dict(FIELDS)
+RECORD = struct.Struct("<" + "".join(f[1] for f in FIELDS))
+
+# where each field starts in a record, and how long it is
+OFFSETS = {}
+_offset = 0
+for (_name, _code) in FIELDS:
+	OFFSETS[_name] = (_offset, struct.calcsize("<" + _code))
+	_offset += OFFSETS[_name][1]
+
+MISSING = {'b': -1, 'B': 255, 'f': float('nan')}
+
+SUFFIX = ".ghs"
+
+
+def _day(t):
+	return time.strftime("%Y%m%d", time.gmtime(t))
+
+
+def _pack(t, values):
+	fields = []
+	for (name, code) in FIELDS[1:]:
+		value = values.get(name)
+		if value is None:
+			fields.append(MISSING[code])
+		elif (name == 'doorState'):
+			fields.append(DOOR_STATES.index(value) if value in DOOR_STATES else DOOR_STATES.index("error"))
+		elif (code == 'b'):
+			fields.append(max(-128, min(127, int(value))))
+		else:
+			fields.append(float(value))
+	return RECORD.pack(t, *fields)
+
+
+# the bytes of 'fields' from each of the 'count' records in raw, packed back to back (row by row)
+def select(raw, count, fields):
+	if (tuple(fields) == NAMES):
+		return raw[:count * RECORD.size]
+	width = sum(OFFSETS[name][1] for name in fields)
+	out = bytearray(count * width)
+	at = 0
+	for name in fields:
+		(offset, size) = OFFSETS[name]
+		for b in range(size):
+			out[at + b::width] = raw[offset + b:count * RECORD.size:RECORD.size]
+		at += size
+	return out
+
+
+def column(raw, count, name):
+	values = array.array(TYPES[name], bytes(select(raw, count, [name])))
+	if (sys.byteorder != "little"):
+		values.byteswap()
+	return values
+
+
+class Segment():
+	# one day's file, read only
+	def __init__(self, path):
+		self.path = path
+		with open(path, "rb") as f:
+			size = os.fstat(f.fileno()).st_size
+			self.count = max(0, (size - HEADER.size) // RECORD.size)
+			if self.count:
+				self._map = mmap.mmap(f.fileno(), HEADER.size + self.count * RECORD.size, access=mmap.ACCESS_READ)
+				(magic, version) = HEADER.unpack_from(self._map, 0)
+				if (magic != MAGIC or version != VERSION):
+					self.close()
+					self.count = 0
+
+	def close(self):
+		if self.count:
+			self._map.close()
+
+	def time(self, i):
+		return struct.unpack_from("<d", self._map, HEADER.size + i * RECORD.size)[0]
+
+	# index of the first record at or after t
+	def bisect(self, t):
+		(low, high) = (0, self.count)
+		while (low < high):
+			middle = (low + high) // 2
+			if (self.time(middle) < t):
+				low = middle + 1
+			else:
+				high = middle
+		return low
+
+	def records(self, first, last):
+		return self._map[HEADER.size + first * RECORD.size:HEADER.size + last * RECORD.size]
+
+
+class HistoryStore():
+	def __init__(self, path=DEFAULT_PATH, keepDays=400):
+		self.path = path
+		self.keepDays = keepDays
+		self.values = {}
+
+		self._fd = None
+		self._day = None
+
+	def close(self):
+		if self._fd is not None:
+			os.close(self._fd)
+			self._fd = None
+			self._day = None
+
+	def _segmentPath(self, day):
+		return os.path.join(self.path, day + SUFFIX)
+
+	def days(self):
+		try:
+			names = os.listdir(self.path)
+		except OSError:
+			return []
+		return sorted(name[:-len(SUFFIX)] for name in names if name.endswith(SUFFIX))
+
+	def _open(self, day):
+		self.close()
+		if not os.path.isdir(self.path):
+			os.makedirs(self.path)
+
+		path = self._segmentPath(day)
+		fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+		size = os.fstat(fd).st_size
+		if (size < HEADER.size):
+			os.ftruncate(fd, 0)
+			os.write(fd, HEADER.pack(MAGIC, VERSION))
+		elif ((size - HEADER.size) % RECORD.size):
+			# a crash part way through a record, drop the partial one so the rest stay aligned
+			os.ftruncate(fd, size - (size - HEADER.size) % RECORD.size)
+
+		(self._fd, self._day) = (fd, day)
+		self._prune(day)
+
+	def _prune(self, today):
+		oldest = _day(time.mktime(time.strptime(today, "%Y%m%d")) - self.keepDays * 86400)
+		for day in self.days():
+			if (day < oldest):
+				try:
+					os.remove(self._segmentPath(day))
+				except OSError:
+					pass
+
+	# merge in some Garage.status() fields read at time t, and record them if anything changed
+	def add(self, fields, t=None):
+		if t is None:
+			t = time.time()
+
+		changed = False
+		for name in NAMES[1:]:
+			if (name in fields and self.values.get(name) != fields[name]):
+				self.values[name] = fields[name]
+				changed = True
+		if not changed:
+			return False
+
+		day = _day(t)
+		if (day != self._day):
+			self._open(day)
+		os.write(self._fd, _pack(t, self.values))
+		return True
+
+	# (segment, first, last) for the records from start up to (not including) end
+	def _ranges(self, start, end):
+		first = _day(start) if start is not None else None
+		last = _day(end) if end is not None else None
+
+		for day in self.days():
+			if ((first is not None and day < first) or (last is not None and day > last)):
+				continue
+			segment = Segment(self._segmentPath(day))
+			low = segment.bisect(start) if start is not None else 0
+			high = segment.bisect(end) if end is not None else segment.count
+			if (low < high):
+				yield (segment, low, high)
+			else:
+				segment.close()
+
+	def count(self, start=None, end=None):
+		total = 0
+		for (segment, low, high) in self._ranges(start, end):
+			total += high - low
+			segment.close()
+		return total
+
+	# Raw records between start and end, 'size' at a time: yields (count, bytes) with the selected fields of
+	# each record packed back to back. Nothing is read ahead of what's asked for.
+	def rows(self, start=None, end=None, fields=NAMES, size=65536):
+		for (segment, low, high) in self._ranges(start, end):
+			try:
+				for first in range(low, high, size):
+					last = min(high, first + size)
+					yield (last - first, select(segment.records(first, last), last - first, fields))
+			finally:
+				segment.close()
+
+	# The same, a column at a time: yields {field: array.array} with up to 'size' values each
+	def chunks(self, start=None, end=None, fields=NAMES, size=65536):
+		for (segment, low, high) in self._ranges(start, end):
+			try:
+				for first in range(low, high, size):
+					last = min(high, first + size)
+					raw = segment.records(first, last)
+					yield dict((name, column(raw, last - first, name)) for name in fields)
+			finally:
+				segment.close()
+
+
+def isMissing(name, value):
+	code = TYPES[name]
+	if (code == 'f'):
+		return math.isnan(value)
+	return (code in MISSING and value == MISSING[code])
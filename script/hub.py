@@ -0,0 +1,416 @@
+#!/usr/bin/python3
+#
+# One view of every site: a hub that follows many garage daemons at once and answers questions about the fleet.
+#
+# Each site's garage-daemon.py runs its MQTT bus where the hub can reach it (--bus 1883 --bus-address 0.0.0.0, with
+# getBusPassword() and getBusTLS() in garagesecret.py, see bus.py). The hub only reads, so it's given the site's
+# getBusReadPassword(): with that the bus lets it subscribe but not publish, and whoever gets hold of it can't move
+# the door. The connection's TLS, trusting the site's certificate, so the password doesn't cross the network in the
+# clear. A site can instead keep its bus on localhost, with a tunnel from the hub (ssh -L 21001:localhost:1883
+# site), listed here as 127.0.0.1:21001. The hub won't talk to a site elsewhere without TLS.
+#
+# The hub keeps a connection open to every one of them, all on one
+# asyncio loop, subscribed to garage/#. The retained messages bring it up to date as soon as it connects, and
+# from then on only changes come in. A site that drops off is retried with backoff and shown as offline, with
+# what was last heard from it.
+#
+# What's heard goes into an in-memory Fleet, indexed by door state (sorted by how long each door's been in it),
+# by failing sensor worker and by who's offline, so the questions below are a lookup rather than a scan of every
+# site. They're answered over HTTP, as JSON:
+#
+#   /fleet.json                     every site
+#   /site.json?name=home            one site
+#   /open.json?minutes=10           doors open for more than 10 minutes (state=ventilate etc. for other states)
+#   /doors.json?state=error         doors in a state
+#   /failing.json?worker=dht11      sites whose DHT11 worker is failing or hung (any worker, without ?worker)
+#   /offline.json                   sites the hub can't reach
+#
+# The sites are listed in a JSON file:
+#
+#   [{"name": "home", "host": "10.0.0.5", "port": 1883, "password": "(its read-only password)", "cafile": "home.pem"}, ...]
+#
+# cafile is the site's certificate (or its CA's). "tls": true instead trusts the system's CAs. A certificate's name
+# is checked against host unless "checkHostname": false (usual for a self-signed one, trusted on its own).
+#
+#   ./hub.py sites.json                       follow them, answering queries on localhost port 8088
+#   ./hub.py simulate 200 > sites.json        200 pretend daemons (bus.py brokers) on this machine, to try it on
+# -----------------------
+
+from __future__ import print_function
+import argparse
+import asyncio
+import bisect
+import collections
+import json
+import logging
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+from urllib.parse import parse_qsl, urlparse
+import bus
+
+__author__ = "Ryan Hunt <ryan@ryanhunt.net>"
+__copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
+
+DEFAULT_PORT = 8088
+
+KEEPALIVE = 60
+CONNECT_TIMEOUT = 10
+
+# backoff between attempts to reach a site, in seconds
+MIN_BACKOFF = 1
+MAX_BACKOFF = 300
+
+# worker states that count as failing
+FAILING = ("failing", "hung")
+
+# topic (under bus.PREFIX) -> Garage.status() field
+FIELDS = dict((topic, name) for (name, topic) in bus.TOPICS.items())
+
+
+def _value(text):
+	for kind in (int, float):
+		try:
+			return kind(text)
+		except ValueError:
+			pass
+	return text
+
+
+class Site():
+	# tls is an ssl.SSLContext for the site's bus (bus.clientContext()), None for a plain connection
+	def __init__(self, name, host, port=bus.DEFAULT_PORT, password=None, tls=None):
+		self.name = name
+		self.host = host
+		self.port = port
+		self.password = password
+		self.tls = tls
+
+		self.online = False
+		self.lastHeard = None
+		self.lastError = None
+		self.fields = {}
+		self.doorState = None
+		self.doorSince = None
+		self.health = {}
+
+	def toDict(self):
+		return {
+			'name': self.name,
+			'online': self.online,
+			'lastHeard': self.lastHeard,
+			'lastError': self.lastError,
+			'doorState': self.doorState,
+			'doorSince': self.doorSince,
+			'status': self.fields,
+			'health': self.health,
+		}
+
+
+class Fleet():
+	# Every site, as last heard, with indexes for the queries. Only the event loop's thread changes it.
+	def __init__(self):
+		self.sites = collections.OrderedDict()
+
+		# door state -> sorted [(since, name)], worker -> names failing, names offline
+		self._doors = collections.defaultdict(list)
+		self._failing = collections.defaultdict(set)
+		self._offline = set()
+
+	def add(self, site):
+		self.sites[site.name] = site
+		self._offline.add(site.name)
+
+	def _unindexDoor(self, site):
+		if site.doorState is not None:
+			entries = self._doors[site.doorState]
+			i = bisect.bisect_left(entries, (site.doorSince, site.name))
+			if (i < len(entries) and entries[i] == (site.doorSince, site.name)):
+				del entries[i]
+
+	def _indexDoor(self, site):
+		if site.doorState is not None:
+			bisect.insort(self._doors[site.doorState], (site.doorSince, site.name))
+
+	def setDoor(self, name, state, since):
+		site = self.sites[name]
+		if (state == site.doorState and since == site.doorSince):
+			return
+		self._unindexDoor(site)
+		(site.doorState, site.doorSince) = (state, since)
+		self._indexDoor(site)
+
+	def setOnline(self, name, online, error=None):
+		site = self.sites[name]
+		site.online = online
+		site.lastError = error
+		if online:
+			self._offline.discard(name)
+		else:
+			self._offline.add(name)
+
+	# a message from a site's bus, topic without the prefix
+	def heard(self, name, topic, payload, now=None):
+		site = self.sites[name]
+		site.lastHeard = time.time() if now is None else now
+		text = payload.decode('utf-8', 'replace')
+
+		if (topic == "door"):
+			if (site.doorState is None and site.doorSince is not None):
+				# door/since got here first
+				self.setDoor(name, text, site.doorSince)
+			elif (text != site.doorState):
+				# when it changed is on its way in door/since, until then it's now
+				self.setDoor(name, text, site.lastHeard)
+			site.fields['doorState'] = text
+		elif (topic == bus.DOOR_SINCE):
+			try:
+				self.setDoor(name, site.doorState, float(text))
+			except ValueError:
+				return
+		elif topic.startswith(bus.HEALTH):
+			worker = topic[len(bus.HEALTH):]
+			try:
+				health = json.loads(text)
+			except ValueError:
+				return
+			site.health[worker] = health
+			if (health.get('state') in FAILING):
+				self._failing[worker].add(name)
+			else:
+				self._failing[worker].discard(name)
+		elif topic in FIELDS:
+			site.fields[FIELDS[topic]] = _value(text)
+
+	# Queries. Each is a lookup in an index, then the matching sites.
+	def site(self, name):
+		return self.sites.get(name)
+
+	def inState(self, state):
+		return [self.sites[name] for (since, name) in self._doors.get(state, ())]
+
+	# doors that have been in state for longer than seconds, longest first
+	def inStateFor(self, state, seconds, now=None):
+		entries = self._doors.get(state, ())
+		cutoff = (time.time() if now is None else now) - seconds
+		end = bisect.bisect_right(entries, (cutoff, "\U0010ffff"))
+		return [self.sites[name] for (since, name) in entries[:end]]
+
+	def failing(self, worker=None):
+		if worker is not None:
+			names = self._failing.get(worker, ())
+		else:
+			names = set().union(*self._failing.values()) if self._failing else ()
+		return [self.sites[name] for name in sorted(names)]
+
+	def offline(self):
+		return [self.sites[name] for name in sorted(self._offline)]
+
+
+# (type, flags, body) of the next MQTT packet from an asyncio stream, like bus.readPacket()
+async def readPacket(reader):
+	first = await reader.readexactly(1)
+	(length, shift) = (0, 0)
+	for i in range(4):
+		byte = await reader.readexactly(1)
+		length |= (byte[0] & 0x7f) << shift
+		shift += 7
+		if not (byte[0] & 0x80):
+			break
+	else:
+		raise bus.ProtocolError("Bad remaining length")
+	if (length > bus.MAX_PACKET):
+		raise bus.ProtocolError("Packet too big ({0} bytes)".format(length))
+	return (first[0] >> 4, first[0] & 0x0f, await reader.readexactly(length))
+
+
+class Hub():
+	def __init__(self, sites, clientId=None):
+		self.fleet = Fleet()
+		for site in sites:
+			self.fleet.add(site)
+		self.clientId = clientId or "hub-{0}".format(socket.gethostname())
+
+	# Keep following a site, for as long as the hub runs.
+	async def follow(self, site):
+		backoff = MIN_BACKOFF
+		while True:
+			started = time.time()
+			try:
+				(reader, writer) = await asyncio.wait_for(asyncio.open_connection(site.host, site.port, ssl=site.tls), CONNECT_TIMEOUT)
+				try:
+					await self._session(site, reader, writer)
+				finally:
+					writer.close()
+				error = "Disconnected"
+			except (OSError, EOFError, asyncio.TimeoutError, bus.ProtocolError) as e:
+				error = "{0}: {1}".format(type(e).__name__, e)
+
+			if site.online:
+				logging.warning("Lost %s (%s)", site.name, error)
+			self.fleet.setOnline(site.name, False, error)
+
+			if (time.time() - started > MAX_BACKOFF):
+				backoff = MIN_BACKOFF
+			# spread out, so a network blip at the hub doesn't have every site retried at the same moment
+			await asyncio.sleep(backoff * random.uniform(0.5, 1.5))
+			backoff = min(backoff * 2, MAX_BACKOFF)
+
+	async def _session(self, site, reader, writer):
+		writer.write(bus.connectPacket(self.clientId, site.password, KEEPALIVE))
+		(kind, flags, body) = await asyncio.wait_for(readPacket(reader), CONNECT_TIMEOUT)
+		if (kind != bus.CONNACK or len(body) < 2 or body[1] != bus.ACCEPTED):
+			raise bus.ProtocolError("Connection refused ({0})".format(body[1] if len(body) > 1 else kind))
+
+		writer.write(bus.subscribePacket(1, [bus.PREFIX + "#"]))
+		await writer.drain()
+
+		logging.info("Following %s at %s:%d", site.name, site.host, site.port)
+		self.fleet.setOnline(site.name, True)
+
+		quiet = 0
+		while True:
+			try:
+				(kind, flags, body) = await asyncio.wait_for(readPacket(reader), KEEPALIVE / 2.0)
+			except asyncio.TimeoutError:
+				# the retained messages came in long ago and nothing's changed: check the site's still there
+				quiet += 1
+				if (quiet > 2):
+					raise asyncio.TimeoutError("no reply to our pings")
+				writer.write(bus.packet(bus.PINGREQ, 0))
+				await writer.drain()
+				continue
+			quiet = 0
+
+			if (kind == bus.PUBLISH):
+				(topic, payload, qos, packetId, retained) = bus.parsePublish(flags, body)
+				if qos:
+					writer.write(bus.packet(bus.PUBACK, 0, struct.pack(">H", packetId)))
+				if topic.startswith(bus.PREFIX):
+					self.fleet.heard(site.name, topic[len(bus.PREFIX):], payload)
+
+	# The queries, for a GET of path?query: (HTTP status, JSON-able answer)
+	def query(self, path, query):
+		fleet = self.fleet
+		if (path == "/fleet.json"):
+			return (200, [site.toDict() for site in fleet.sites.values()])
+		if (path == "/site.json"):
+			site = fleet.site(query.get('name'))
+			return (200, site.toDict()) if site is not None else (404, {'error': "No such site"})
+		if (path == "/open.json"):
+			try:
+				minutes = float(query.get('minutes', 10))
+			except ValueError:
+				return (400, {'error': "minutes should be a number"})
+			return (200, [site.toDict() for site in fleet.inStateFor(query.get('state', "open"), minutes * 60)])
+		if (path == "/doors.json"):
+			return (200, [site.toDict() for site in fleet.inState(query.get('state', "open"))])
+		if (path == "/failing.json"):
+			return (200, [site.toDict() for site in fleet.failing(query.get('worker'))])
+		if (path == "/offline.json"):
+			return (200, [site.toDict() for site in fleet.offline()])
+		return (404, {'error': "Not here"})
+
+	async def _serve(self, reader, writer):
+		try:
+			request = await asyncio.wait_for(reader.readline(), 5)
+			while True:
+				line = await asyncio.wait_for(reader.readline(), 5)
+				if line in (b"\r\n", b"\n", b""):
+					break
+			parts = request.decode('latin-1').split()
+			if (len(parts) < 2 or parts[0] != "GET"):
+				(code, answer) = (405, {'error': "GET only"})
+			else:
+				url = urlparse(parts[1])
+				(code, answer) = self.query(url.path, dict(parse_qsl(url.query)))
+			body = json.dumps(answer).encode('utf-8')
+			writer.write("HTTP/1.0 {0} {1}\r\nContent-Type: application/json\r\nContent-Length: {2}\r\n\r\n".format(code, {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}[code], len(body)).encode('latin-1') + body)
+			await writer.drain()
+		except (OSError, asyncio.TimeoutError):
+			pass
+		finally:
+			writer.close()
+
+	async def run(self, port=DEFAULT_PORT, address="127.0.0.1"):
+		server = await asyncio.start_server(self._serve, address, port)
+		logging.info("Following %d sites, answering queries on %s:%d", len(self.fleet.sites), address, port)
+		await asyncio.gather(*[self.follow(site) for site in self.fleet.sites.values()])
+
+
+def loadSites(path):
+	with open(path) as f:
+		listed = json.load(f)
+	sites = []
+	for s in listed:
+		tls = None
+		if (s.get('cafile') or s.get('tls')):
+			tls = bus.clientContext(s.get('cafile'), s.get('checkHostname', True))
+		elif s['host'] not in ("127.0.0.1", "localhost", "::1"):
+			# the password would go over the network as it is
+			raise ValueError("Site {0} isn't on localhost, it needs a cafile (or \"tls\": true), or a tunnel to it".format(s['name']))
+		sites.append(Site(s['name'], s['host'], s.get('port', bus.DEFAULT_PORT), s.get('password'), tls))
+	if (len(set(site.name for site in sites)) != len(sites)):
+		raise ValueError("Two sites in {0} have the same name".format(path))
+	return sites
+
+
+# Pretend daemons for trying the hub out: a bus.py broker per site on this machine, with doors opening and closing
+# and DHT11s failing now and then. Returns the sites, for a sites file.
+def simulate(count, basePort, interval=1.0, password=None):
+	brokers = []
+	sites = []
+	for i in range(count):
+		port = basePort + i
+		# the hub's given the read-only password, as it would be for a real site
+		brokers.append(bus.start(port, command=lambda name: True, readPassword=password))
+		sites.append({'name': "site{0:03d}".format(i), 'host': "127.0.0.1", 'port': port, 'password': password})
+
+	def run():
+		states = ["closed"] * count
+		failures = [0] * count
+		while True:
+			for (i, broker) in enumerate(brokers):
+				if (random.random() < 0.05):
+					states[i] = random.choice(("open", "closed", "closed", "ventilate", "operating"))
+				broker.update({'doorState': states[i], 'carPresent': int(states[i] == "closed"), 'temperature': round(random.gauss(18, 3), 1), 'humidity': random.randint(30, 80)})
+				failing = random.random() < 0.02
+				failures[i] += int(failing)
+				broker.health([{'name': "dht11", 'state': "failing" if failing else "ok", 'failures': failures[i], 'restarts': 0, 'lastError': "checksum" if failing else None}])
+			time.sleep(interval)
+
+	thread = threading.Thread(target=run, name="Simulated sites")
+	thread.daemon = True
+	thread.start()
+	return sites
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Follow many garage daemons and answer questions about the fleet.')
+	parser.add_argument("sites", help="JSON file listing the sites, or 'simulate' to run pretend ones")
+	parser.add_argument("count", nargs="?", type=int, default=20, help="how many sites to simulate (default 20)")
+	parser.add_argument("-l", "--listen", default="127.0.0.1", help="address to answer queries on (default 127.0.0.1)")
+	parser.add_argument("-p", "--port", type=int, default=DEFAULT_PORT, help="port to answer queries on (default {0})".format(DEFAULT_PORT))
+	parser.add_argument("-b", "--base-port", dest="basePort", type=int, default=21883, help="first port for simulated sites (default 21883)")
+	parser.add_argument("-v", "--verbose", help="Verbose", action='store_true')
+	args = parser.parse_args()
+
+	logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format='%(asctime)s %(levelname)s %(message)s')
+
+	if (args.sites == "simulate"):
+		print(json.dumps(simulate(args.count, args.basePort), indent=1))
+		sys.stdout.flush()
+		try:
+			while True:
+				time.sleep(3600)
+		except KeyboardInterrupt:
+			sys.exit()
+
+	hub = Hub(loadSites(args.sites))
+	try:
+		asyncio.run(hub.run(args.port, args.listen))
+	except KeyboardInterrupt:
+		pass
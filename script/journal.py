@@ -0,0 +1,178 @@
+#!/usr/bin/python3
+#
+# Write-ahead journal for door operations that take more than one relay pulse.
+#
+# Ventilate is two pulses with a wait in between: up, then stop it a crack open. If whatever's running it (the
+# daemon's DoorCommander, main.py --ventilate) dies in the wait, the door carries on to fully open while the
+# ventilating flag in doorstate.py says otherwise. So each step is written down (and fsynced) before it's
+# taken and again once it's done:
+#
+#   {"op": 12, "step": "begin", "kind": "ventilate", "target": 10, "deadline": ..., "pid": 812, "t": ...}
+#   {"op": 12, "step": "intend", "pulse": 1, ...}
+#   {"op": 12, "step": "pulsed", "pulse": 1, "due": ..., ...}      due = when the next pulse should go
+#   {"op": 12, "step": "intend", "pulse": 2, ...}
+#   {"op": 12, "step": "pulsed", "pulse": 2, ...}
+#   {"op": 12, "step": "end", "outcome": "done", ...}
+#
+# one JSON line each, appended to /var/tmp/garage.journal under an flock. op is the doorstate.py operation id.
+# The file is emptied whenever nothing's left in flight, so normally it's empty and checking it is one stat().
+#
+# An operation that hasn't ended, whose process has gone (or that's past its deadline), is reconciled against
+# where the reeds say the door is now (see reconcile() and GarageDoor.recover()), by the daemon when it starts
+# and every few seconds after.
+# -----------------------
+
+from __future__ import print_function
+import contextlib
+import fcntl
+import json
+import os
+import threading
+import time
+
+__author__ = "Ryan Hunt <ryan@ryanhunt.net>"
+__copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
+
+DEFAULT_PATH = "/var/tmp/garage.journal"
+
+# what reconcile() decides
+FINISH = "finish"           # every pulse went, only the bookkeeping's missing
+ROLLBACK = "rollback"       # the door's (still, or back) down: nothing happened, it's not ventilating
+RESUME = "resume"           # the door's still on its way up: send the next pulse to stop it
+COMPENSATE = "compensate"   # the door got all the way up, or stopped somewhere by itself: record where it is
+ABANDON = "abandon"         # the reeds make no sense, leave the door alone
+
+
+def _alive(pid):
+	if (pid == os.getpid()):
+		return True
+	try:
+		os.kill(pid, 0)
+	except ProcessLookupError:
+		return False
+	except OSError:
+		# it's there, just not ours
+		return True
+	return True
+
+
+class Journal():
+	# path=None journals nothing (e.g. when replaying a trace)
+	def __init__(self, path=DEFAULT_PATH):
+		self.path = path
+		self._lock = threading.Lock()
+
+	@contextlib.contextmanager
+	def _locked(self):
+		with self._lock:
+			fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o666)
+			try:
+				fcntl.flock(fd, fcntl.LOCK_EX)
+				yield fd
+			finally:
+				os.close(fd)
+
+	def _log(self, operationId, step, **fields):
+		if self.path is None:
+			return
+		entry = dict(fields, op=operationId, step=step, pid=os.getpid(), t=time.time())
+		with self._locked() as fd:
+			os.write(fd, (json.dumps(entry, sort_keys=True) + "\n").encode('utf-8'))
+			os.fsync(fd)
+
+	def begin(self, operationId, kind, deadline, **fields):
+		self._log(operationId, "begin", kind=kind, deadline=deadline, **fields)
+
+	# about to pulse the relay
+	def intend(self, operationId, pulse):
+		self._log(operationId, "intend", pulse=pulse)
+
+	# the relay's been pulsed, and the next pulse (if there is one) is due in 'wait' seconds
+	def pulsed(self, operationId, pulse, wait=None):
+		self._log(operationId, "pulsed", pulse=pulse, due=time.time() + wait if wait is not None else None)
+
+	def end(self, operationId, outcome="done"):
+		if self.path is None:
+			return
+		self._log(operationId, "end", outcome=outcome)
+		with self._locked() as fd:
+			if not self._fold(self._read(fd)):
+				os.ftruncate(fd, 0)
+
+	def _read(self, fd):
+		data = b""
+		os.lseek(fd, 0, os.SEEK_SET)
+		while True:
+			chunk = os.read(fd, 65536)
+			if not chunk:
+				break
+			data += chunk
+		entries = []
+		for line in data.decode('utf-8', 'replace').splitlines():
+			try:
+				entries.append(json.loads(line))
+			except ValueError:
+				# torn by a crash mid write
+				continue
+		return entries
+
+	# operation id -> what's known about each operation that hasn't ended
+	def _fold(self, entries):
+		operations = {}
+		for entry in entries:
+			op = entry.get('op')
+			step = entry.get('step')
+			if (step == "begin"):
+				operations[op] = dict(entry, intended=0, pulses=0, due=None, moved=None)
+			elif op not in operations:
+				continue
+			elif (step == "intend"):
+				operations[op]['intended'] = entry['pulse']
+				if (entry['pulse'] == 1):
+					operations[op]['moved'] = entry['t']
+			elif (step == "pulsed"):
+				operations[op]['pulses'] = entry['pulse']
+				operations[op]['due'] = entry.get('due')
+			elif (step == "end"):
+				del operations[op]
+		return operations
+
+	# Operations that haven't ended and nobody's running any more: their process has gone, or it's run past its
+	# deadline. Only a stat() when there's nothing in the journal.
+	def orphans(self, now=None):
+		if self.path is None:
+			return {}
+		try:
+			if (os.path.getsize(self.path) == 0):
+				return {}
+		except OSError:
+			return {}
+		if now is None:
+			now = time.time()
+		with self._locked() as fd:
+			operations = self._fold(self._read(fd))
+		return dict((op, o) for (op, o) in operations.items() if not (_alive(o['pid']) and now <= o['deadline']))
+
+
+# What to do about an operation that was cut short, given where the door is now ("closed", "open", "between" or
+# "error"), and how long the door takes to open.
+def reconcile(operation, position, now, timeOpen):
+	if (operation['pulses'] >= 2):
+		return FINISH
+	if (position == "error"):
+		return ABANDON
+	if (position == "closed"):
+		return ROLLBACK
+	if (position == "open"):
+		return COMPENSATE
+	if (operation['intended'] >= 2):
+		# the process went between meaning to send the second pulse and writing down that it had. If it did go
+		# the door's stopped where it was meant to, and another pulse would set it off again (back down). If it
+		# didn't, the door carries on up and the daemon sees it arrive open. Either way, leave the relay alone.
+		return COMPENSATE
+	# part way up. If the first pulse might not have gone, the door moving says it did.
+	moved = operation['moved'] if operation['moved'] is not None else operation['t']
+	if (now < moved + timeOpen):
+		return RESUME
+	# it's stopped part way by itself (something in the way, or someone stopped it)
+	return COMPENSATE
@@ -0,0 +1,225 @@
+#!/usr/bin/python3
+#
+# Load test for the IFTTT webhook (webhook.py), against a simulated door (fakegpio.py) on localhost.
+#
+# Two phases. First, each logical command is a burst of concurrent POSTs that all mean "open the door": IFTTT
+# retries, a double tap, two phones arriving together. Between commands it waits for the simulated door to finish
+# moving. The rate limiter is the webhook's own, sped up as much as the door is, so it sees the same traffic a
+# real one would rather than starving every command after the first few. Every command has to pulse the relay
+# exactly once: more is a command getting through twice, none is one lost.
+#
+# Then the throughput phase sends --requests POSTs from away from home (so the door isn't touched), each with its
+# own nonce, as fast as --concurrency allows, with rate limiting off. That's what the latency (p50/p95/p99) and
+# throughput are measured on, rather than on 429s.
+#
+#   ./loadtest.py --commands 20 --burst 16 --concurrency 8
+#   ./loadtest.py --nonces --unlimited      # each request distinct, and no rate limiting in the commands either
+#
+# Nothing here touches a real pin.
+# -----------------------
+
+from __future__ import print_function
+import argparse
+import collections
+import http.client
+import json
+import sys
+import threading
+import time
+import uuid
+from urllib.parse import urlencode
+
+__author__ = "Ryan Hunt <ryan@ryanhunt.net>"
+__copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
+
+SECRET = "loadtest"
+HOME = (-33.8568, 151.2153)
+# well outside the geofence
+AWAY = (-33.9568, 151.2153)
+
+
+class _Secret():
+	# stands in for garagesecret.py
+	def getWebhookSecret(self):
+		return SECRET
+
+	def getCoords(self):
+		return HOME
+
+	def getOWMKey(self):
+		return ""
+
+
+def percentile(ordered, p):
+	if not ordered:
+		return None
+	index = min(len(ordered) - 1, max(0, int(round(p / 100.0 * len(ordered) + 0.5)) - 1))
+	return ordered[index]
+
+
+def _post(port, body, results):
+	started = time.time()
+	try:
+		connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+		connection.request("POST", "/", body, {'Content-Type': 'application/x-www-form-urlencoded'})
+		status = connection.getresponse().status
+		connection.close()
+	except Exception as e:
+		status = type(e).__name__
+	results.append((time.time() - started, status))
+
+
+def _burst(port, bodies, concurrency, results):
+	pending = list(bodies)
+	lock = threading.Lock()
+
+	def worker():
+		while True:
+			with lock:
+				if not pending:
+					return
+				body = pending.pop()
+			_post(port, body, results)
+
+	threads = [threading.Thread(target=worker) for i in range(min(concurrency, len(bodies)))]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+
+
+def _summary(results, busy):
+	latencies = sorted(r[0] for r in results)
+	statuses = collections.Counter(r[1] for r in results)
+	accepted = statuses.get(200, 0)
+	return {
+		'requests': len(results),
+		'p50': percentile(latencies, 50),
+		'p95': percentile(latencies, 95),
+		'p99': percentile(latencies, 99),
+		'max': latencies[-1] if latencies else None,
+		'throughput': len(results) / busy if busy else None,
+		'statuses': dict((str(k), v) for (k, v) in statuses.items()),
+		'rejectedRate': (len(results) - accepted) / float(len(results)) if results else 0.0,
+	}
+
+
+def run(commands=10, burst=8, concurrency=8, speed=100.0, nonces=False, unlimited=False, requests=500):
+	import garagegpio
+	from fakegpio import FakeGPIO
+	from garage import Garage
+	from doorstate import DoorState
+	from ratelimit import TokenBuckets
+	import webhook
+
+	fake = FakeGPIO(speed=speed)
+	previous = garagegpio.setBackend(fake)
+
+	try:
+		garage = Garage(weather=False)
+		garage.door.travel.path = None
+		garage.door.state = DoorState(None)
+
+		# the simulated door is 'speed' times quicker, so is the cooldown
+		travel = garage.door.travel
+		cooldown = max(travel.worstCase("open"), travel.worstCase("close")) / speed
+		commander = webhook.DoorCommander(garage, cooldown=cooldown)
+
+		server = webhook.WebhookServer(("127.0.0.1", 0), garage, _Secret(), commander=commander)
+		# every request comes from here, let them all in at once
+		server.maxPerClient = max(server.maxPerClient, concurrency)
+		server.maxThreads = max(server.maxThreads, concurrency)
+		limiter = server.limiter
+		if unlimited:
+			server.limiter = TokenBuckets(rate=1e6, burst=1e6, totalRate=1e6, totalBurst=1e6)
+		else:
+			server.limiter = TokenBuckets(rate=limiter.rate * speed, burst=limiter.burst, totalRate=limiter.total.rate * speed, totalBurst=limiter.total.burst)
+		port = server.server_address[1]
+
+		thread = threading.Thread(target=server.serve_forever, name="Webhook")
+		thread.daemon = True
+		thread.start()
+
+		results = []
+		perCommand = []
+		busy = 0.0
+
+		for command in range(commands):
+			form = {'secret': SECRET, 'lat': HOME[0], 'long': HOME[1]}
+			if nonces:
+				bodies = [urlencode(dict(form, nonce=uuid.uuid4().hex, ts=int(time.time()))) for i in range(burst)]
+			else:
+				# IFTTT sends exactly the same body every time
+				form['attempt'] = command
+				bodies = [urlencode(form)] * burst
+
+			before = len(fake.pulses)
+			started = time.time()
+			_burst(port, bodies, concurrency, results)
+			busy += time.time() - started
+
+			# let the door and the commander finish before the next command
+			time.sleep(cooldown + 0.5 + 1.0 / speed)
+			perCommand.append(len(fake.pulses) - before)
+			if garage.door.status() in ("open", "closed"):
+				# as the daemon does when the reeds see the door arrive
+				garage.door.state.finish(ventilating=False)
+
+		# throughput, on requests that don't move the door, with nothing turned away for coming too quickly
+		server.limiter = TokenBuckets(rate=1e6, burst=1e6, totalRate=1e6, totalBurst=1e6)
+		form = {'secret': SECRET, 'lat': AWAY[0], 'long': AWAY[1]}
+		bodies = [urlencode(dict(form, nonce=uuid.uuid4().hex, ts=int(time.time()))) for i in range(requests)]
+		throughputResults = []
+		started = time.time()
+		_burst(port, bodies, concurrency, throughputResults)
+		throughputBusy = time.time() - started
+
+		server.shutdown()
+		server.server_close()
+	finally:
+		garagegpio.setBackend(previous)
+
+	result = _summary(results, busy)
+	result.update({
+		'commands': commands,
+		'pulses': sum(perCommand),
+		'pulsesPerCommand': perCommand,
+		'throughputPhase': _summary(throughputResults, throughputBusy),
+		'ok': all(n == 1 for n in perCommand),
+	})
+	return result
+
+
+def display(result):
+	ms = lambda s: "-" if s is None else "{0:.1f}ms".format(s * 1000)
+	responses = lambda r: ", ".join("{0}: {1}".format(k, v) for (k, v) in sorted(r['statuses'].items()))
+	phase = result['throughputPhase']
+	extra = [n for n in result['pulsesPerCommand'] if n > 1]
+	lines = [
+		"{0} requests for {1} commands".format(result['requests'], result['commands']),
+		"responses {0}".format(responses(result)),
+		"rejected {0:.1%}".format(result['rejectedRate']),
+		"relay pulses {0} ({1})".format(result['pulses'], " ".join(str(n) for n in result['pulsesPerCommand'])),
+		"throughput phase: {0} requests, {1}".format(phase['requests'], responses(phase)),
+		"latency p50 {0}, p95 {1}, p99 {2}, max {3}".format(ms(phase['p50']), ms(phase['p95']), ms(phase['p99']), ms(phase['max'])),
+		"throughput {0:.0f} requests/s".format(phase['throughput'] or 0),
+		"OK" if result['ok'] else ("FAIL: more than one pulse for a single command" if extra else "FAIL: a command never pulsed the relay"),
+	]
+	return "\n".join(lines)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Load test the IFTTT webhook against a simulated door.')
+	parser.add_argument("-n", "--commands", type=int, default=10, help="logical door commands to send")
+	parser.add_argument("-b", "--burst", type=int, default=8, help="requests per command")
+	parser.add_argument("-c", "--concurrency", type=int, default=8, help="requests in flight at once")
+	parser.add_argument("-s", "--speed", type=float, default=100.0, help="how much faster than the real door the simulated one moves")
+	parser.add_argument("--nonces", help="give every request its own nonce, rather than repeating the same body", action='store_true')
+	parser.add_argument("--unlimited", help="turn off rate limiting for the commands too", action='store_true')
+	parser.add_argument("-r", "--requests", type=int, default=500, help="requests for the throughput phase (default 500)")
+	parser.add_argument("-j", "--json", help="print the result as JSON", action='store_true')
+	args = parser.parse_args()
+
+	result = run(args.commands, args.burst, args.concurrency, args.speed, args.nonces, args.unlimited, args.requests)
+	print(json.dumps(result) if args.json else display(result))
+	sys.exit(0 if result['ok'] else 1)
@@ -8,6 +8,8 @@ import sys
 import os
 import RPi.GPIO as GPIO
 import meteocalc as mc
+import sharedstatus
+import tracing
 from garage import *
 from pathlib import Path
 
@@ -28,6 +30,39 @@ def checkPerms():
 		if 997 not in groups:
 			sys.stderr.write("Not a member of 'gpio', unable to read/write required pins. Add the current user to the 'gpio' group and try again.\n")
 			sys.exit()
+
+# where --cron remembers how long the door has been as it is, between runs
+CRON_STATE = '/var/tmp/garage.cron'
+
+# The daemon's "door left open" warning, for when it isn't running: every warningTime seconds the door's been
+# open (or ventilating too long), an alert through the same channels and queue as the daemon's (see notify.py).
+def cronWarning(garage, now=None):
+	if now is None:
+		now = time.time()
+	
+	status = garage.door.status()
+	try:
+		with open(CRON_STATE) as f:
+			last = json.load(f)
+	except (IOError, ValueError):
+		last = {}
+	if (last.get('status') != status):
+		last = {'status': status, 'since': now, 'warnings': 0}
+	
+	duration = now - last['since'] - garage.warningTime * last['warnings']
+	if garage.door.isTimeToWorry(duration):
+		import garagesecret as sekret
+		import notify
+		channels = notify.channelsFromSecret(sekret)
+		if channels:
+			# nothing to batch with, send it now
+			notifier = notify.Notifier(channels, window=0).start()
+			notifier.notify("door-" + status, "Garage door has been {0} for {1} minutes".format(status, int((now - last['since']) // 60)))
+			notifier.flush(notify.SEND_TIMEOUT * (len(channels) + 1))
+		last['warnings'] += 1
+	
+	with open(CRON_STATE, "w") as f:
+		json.dump(last, f)
 		
 
 #GPIO.cleanup()
@@ -43,11 +78,25 @@ if __name__ == '__main__':
 	parser.add_argument("-f", "--force", help="Force/Override Open/Close", action='store_true')
 	parser.add_argument("-v", "--ventilate", help="Open the door a crack, to let some air in.", action='store_true')
 	parser.add_argument("-i", "--ifttt", help="Dumb trigger for IFTTT, which simply triggers the door.", action='store_true')
+	parser.add_argument("--requested", type=float, help="when the web request for this came in, in seconds since the epoch (see tracing.py)", metavar="TIME")
 	args = parser.parse_args()
 	
 	checkPerms()
 	
-	garage = Garage()
+	# door commands are traced, from the web request (if we're told when that was) to the reeds seeing the door move
+	commands = [name for name in ("force", "ifttt", "open", "close", "ventilate") if getattr(args, name)]
+	if commands:
+		tracing.scriptTrace(" ".join(commands), args.requested)
+	
+	if (args.json and not commands):
+		# the daemon's latest readings, if it's running, rather than reading every sensor again (see sharedstatus.py)
+		status = sharedstatus.read()
+		if status is not None:
+			print(json.dumps(status))
+			sys.exit()
+	
+	with tracing.span("garage"):
+		garage = Garage()
 	
 	if args.force:
 		if args.open:
@@ -82,6 +131,8 @@ if __name__ == '__main__':
 		# this will update the LED lights on a regular basis, unsure what happens in a race condition when cron runs and user triggers the script.
 		garage.car.status()
 		
-		#TODO: log status elsewhere - and setup triggers such as SMS alerts for periods when door is open too long.
+		if sharedstatus.read() is None:
+			# the daemon sends the warnings while it's running
+			cronWarning(garage)
 	else:
 		print(garage.display())
@@ -0,0 +1,329 @@
+#!/usr/bin/python3
+#
+# Sending alerts (door left open, door getting slow) somewhere a person will see them.
+#
+# notify() just hands the alert to a background thread and returns, so a slow SMS gateway or mail server never
+# holds up the door monitoring. That thread:
+#   * merges alerts with the same key that arrive within 'window' seconds (a repeat just bumps a count), and
+#     sends everything collected in that window as one batch per channel
+#   * keeps both the alerts waiting to be batched and the batches waiting to be delivered in a small SQLite
+#     database, so nothing is lost if the daemon restarts
+#   * retries a failed delivery with exponential backoff, for up to 'maxAge' seconds
+#
+# Channels are configured in garagesecret.py, and any of them can be left out:
+#
+# def getNotifiers():
+#    return [
+#        {'type': 'sms', 'url': 'https://sms.example.com/send', 'numbers': ['+61400000000'], 'token': '...'},
+#        {'type': 'email', 'host': 'smtp.example.com', 'sender': 'garage@example.com', 'recipients': ['me@example.com'],
+#         'username': '...', 'password': '...'},
+#        {'type': 'webhook', 'url': 'https://maker.ifttt.com/trigger/garage/with/key/...'},
+#    ]
+#
+# LogChannel and MemoryChannel stand in for the real ones when trying things out locally.
+# -----------------------
+
+from __future__ import print_function
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+
+__author__ = "Ryan Hunt <ryan@ryanhunt.net>"
+__copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
+
+DEFAULT_PATH = "/var/tmp/garage.notify"
+
+# how long a request to a gateway may take
+SEND_TIMEOUT = 10
+
+# seconds to wait after the database fails (locked, disk full) before trying it again
+ERROR_WAIT = 30
+
+
+def _format(alerts):
+	lines = []
+	for alert in alerts:
+		when = time.strftime("%H:%M", time.localtime(alert['time']))
+		if (alert['count'] > 1):
+			lines.append("{0} {1} (x{2})".format(when, alert['message'], alert['count']))
+		else:
+			lines.append("{0} {1}".format(when, alert['message']))
+	return "\n".join(lines)
+
+
+def _post(url, data, headers=None, contentType="application/x-www-form-urlencoded"):
+	from urllib.request import Request, urlopen
+
+	request = Request(url, data=data, headers=dict(headers or {}, **{'Content-Type': contentType}))
+	with urlopen(request, timeout=SEND_TIMEOUT) as response:
+		if not (200 <= response.status < 300):
+			raise IOError("{0} answered {1}".format(url, response.status))
+
+
+class Channel():
+	# send(alerts) delivers a batch (a list of {'key', 'message', 'time', 'count'}), raising if it couldn't.
+	name = "channel"
+
+	def send(self, alerts):
+		raise NotImplementedError
+
+
+class SMSChannel(Channel):
+	# a plain HTTP SMS gateway: POSTs 'to' and 'message' (field names configurable) once per number
+	name = "sms"
+
+	def __init__(self, url, numbers, token=None, toField="to", messageField="message", maxLength=480):
+		self.url = url
+		self.numbers = list(numbers)
+		self.token = token
+		self.toField = toField
+		self.messageField = messageField
+		self.maxLength = maxLength
+
+	def send(self, alerts):
+		from urllib.parse import urlencode
+
+		text = _format(alerts)[:self.maxLength]
+		headers = {'Authorization': "Bearer {0}".format(self.token)} if self.token else None
+		for number in self.numbers:
+			_post(self.url, urlencode({self.toField: number, self.messageField: text}).encode('utf-8'), headers)
+
+
+class EmailChannel(Channel):
+	name = "email"
+
+	def __init__(self, host, sender, recipients, port=587, username=None, password=None, starttls=True, subject="Garage"):
+		self.host = host
+		self.port = port
+		self.sender = sender
+		self.recipients = list(recipients)
+		self.username = username
+		self.password = password
+		self.starttls = starttls
+		self.subject = subject
+
+	def send(self, alerts):
+		import smtplib
+		from email.message import EmailMessage
+
+		message = EmailMessage()
+		message['From'] = self.sender
+		message['To'] = ", ".join(self.recipients)
+		message['Subject'] = "{0}: {1}".format(self.subject, alerts[0]['message']) if len(alerts) == 1 else "{0}: {1} alerts".format(self.subject, len(alerts))
+		message.set_content(_format(alerts))
+
+		with smtplib.SMTP(self.host, self.port, timeout=SEND_TIMEOUT) as smtp:
+			if self.starttls:
+				smtp.starttls()
+			if self.username:
+				smtp.login(self.username, self.password)
+			smtp.send_message(message)
+
+
+class WebhookChannel(Channel):
+	# POSTs {"value1": text, "alerts": [...]} as JSON, which an IFTTT Maker 'receive a web request' applet understands
+	name = "webhook"
+
+	def __init__(self, url):
+		self.url = url
+
+	def send(self, alerts):
+		_post(self.url, json.dumps({'value1': _format(alerts), 'alerts': alerts}).encode('utf-8'), contentType="application/json")
+
+
+class LogChannel(Channel):
+	name = "log"
+
+	def send(self, alerts):
+		logging.warning("ALERT: %s", _format(alerts).replace("\n", " / "))
+
+
+class MemoryChannel(Channel):
+	# keeps what it was sent in .sent, failing the first 'failures' sends
+	name = "memory"
+
+	def __init__(self, failures=0):
+		self.failures = failures
+		self.sent = []
+
+	def send(self, alerts):
+		if (self.failures > 0):
+			self.failures -= 1
+			raise IOError("MemoryChannel told to fail")
+		self.sent.append(alerts)
+
+
+CHANNELS = {'sms': SMSChannel, 'email': EmailChannel, 'webhook': WebhookChannel, 'log': LogChannel}
+
+
+def channelsFromSecret(sekret):
+	channels = []
+	if hasattr(sekret, 'getNotifiers'):
+		for spec in sekret.getNotifiers():
+			spec = dict(spec)
+			kind = spec.pop('type')
+			channels.append(CHANNELS[kind](**spec))
+	return channels
+
+
+class Notifier():
+	def __init__(self, channels, path=DEFAULT_PATH, window=30.0, backoff=30.0, maxBackoff=3600.0, maxAge=86400.0):
+		# channels by name, each name must be unique (it's what the queue remembers)
+		self.channels = dict((self._channelName(c, i), c) for (i, c) in enumerate(channels))
+		self.path = path
+		self.window = window
+		self.backoff = backoff
+		self.maxBackoff = maxBackoff
+		self.maxAge = maxAge
+
+		self._queue = queue.Queue()
+		self._thread = None
+		self._db = None
+		# when the database started failing, None while it's working
+		self.failing = None
+
+	@staticmethod
+	def _channelName(channel, i):
+		return "{0}{1}".format(channel.name, i) if i else channel.name
+
+	def start(self):
+		self._thread = threading.Thread(target=self._run, name="Notifier")
+		self._thread.daemon = True
+		self._thread.start()
+		return self
+
+	# Never blocks. Alerts with the same key within the batching window are merged.
+	def notify(self, key, message, t=None):
+		self._queue.put(("alert", key, message, time.time() if t is None else t))
+
+	# Wait until everything notified so far has been batched, and had one go at being sent (for a short-lived
+	# process like main.py --cron, and trying things out). Whatever couldn't be sent stays queued for next time.
+	def flush(self, timeout=None):
+		done = threading.Event()
+		self._queue.put(("flush", done))
+		return done.wait(timeout)
+
+	def _open(self):
+		db = sqlite3.connect(self.path) if self.path else sqlite3.connect(":memory:")
+		# time is when the alert was raised, queued when it started waiting for its batch
+		db.execute("CREATE TABLE IF NOT EXISTS pending (key TEXT PRIMARY KEY, message TEXT, time REAL, count INTEGER, queued REAL)")
+		db.execute("CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY, channel TEXT, alerts TEXT, created REAL, attempts INTEGER, due REAL)")
+		db.commit()
+		return db
+
+	def _run(self):
+		# alerts and flushes taken off the queue but not stored yet, because the database failed
+		alerts = []
+		flushes = []
+
+		while True:
+			try:
+				if self._db is None:
+					self._db = self._open()
+
+				# take everything that's queued up, so a burst of alerts is stored in one transaction
+				items = []
+				try:
+					items.append(self._queue.get(timeout=0 if (alerts or flushes) else self._nextWake(time.time())))
+					while True:
+						items.append(self._queue.get_nowait())
+				except queue.Empty:
+					pass
+				alerts += [item[1:] for item in items if item[0] == "alert"]
+				flushes += [item[1] for item in items if item[0] == "flush"]
+
+				self._store(alerts)
+				alerts = []
+				now = time.time()
+				self._batch(now, force=bool(flushes))
+				self._deliver(now)
+				for done in flushes:
+					done.set()
+				flushes = []
+			except Exception:
+				# never let it take the thread down: alerts keep queueing up in memory until the database is back
+				logging.exception("Notifier queue failed, trying again in %ds", ERROR_WAIT)
+				if self.failing is None:
+					self.failing = time.time()
+				if self._db is not None:
+					self._db.close()
+					self._db = None
+				time.sleep(ERROR_WAIT)
+				continue
+
+			if self.failing is not None:
+				logging.info("Notifier queue working again after %.0fs", time.time() - self.failing)
+				self.failing = None
+
+	def _store(self, alerts):
+		if not alerts:
+			return
+		queued = time.time()
+		with self._db:
+			for (key, message, t) in alerts:
+				updated = self._db.execute("UPDATE pending SET message = ?, count = count + 1 WHERE key = ?", (message, key)).rowcount
+				if not updated:
+					self._db.execute("INSERT INTO pending (key, message, time, count, queued) VALUES (?, ?, ?, 1, ?)", (key, message, t, queued))
+
+	# once the oldest pending alert has waited a whole window, send everything pending as one batch
+	def _batch(self, now, force=False):
+		rows = self._db.execute("SELECT key, message, time, count, queued FROM pending ORDER BY queued").fetchall()
+		if not rows or (not force and now - rows[0][4] < self.window):
+			return
+
+		alerts = json.dumps([{'key': k, 'message': m, 'time': t, 'count': c} for (k, m, t, c, q) in rows])
+		with self._db:
+			self._db.execute("DELETE FROM pending")
+			for name in self.channels:
+				self._db.execute("INSERT INTO outbox (channel, alerts, created, attempts, due) VALUES (?, ?, ?, 0, ?)", (name, alerts, now, now))
+
+	def _deliver(self, now):
+		due = self._db.execute("SELECT id, channel, alerts, created, attempts FROM outbox WHERE due <= ? ORDER BY id", (now,)).fetchall()
+
+		for (rowid, name, alerts, created, attempts) in due:
+			channel = self.channels.get(name)
+			if channel is None or now - created > self.maxAge:
+				logging.warning("Giving up on alerts for %s: %s", name, alerts)
+				with self._db:
+					self._db.execute("DELETE FROM outbox WHERE id = ?", (rowid,))
+				continue
+
+			try:
+				channel.send(json.loads(alerts))
+			except Exception as e:
+				delay = min(self.maxBackoff, self.backoff * 2 ** attempts)
+				logging.warning("Couldn't send alerts via %s (%s), trying again in %.0fs", name, e, delay)
+				with self._db:
+					self._db.execute("UPDATE outbox SET attempts = attempts + 1, due = ? WHERE id = ?", (time.time() + delay, rowid))
+				continue
+
+			with self._db:
+				self._db.execute("DELETE FROM outbox WHERE id = ?", (rowid,))
+
+	# how long the thread can sleep before there's something to batch or retry
+	def _nextWake(self, now):
+		wakes = []
+		row = self._db.execute("SELECT MIN(queued) FROM pending").fetchone()
+		if row[0] is not None:
+			wakes.append(row[0] + self.window)
+		row = self._db.execute("SELECT MIN(due) FROM outbox").fetchone()
+		if row[0] is not None:
+			wakes.append(row[0])
+		return max(0.0, min(wakes) - now) if wakes else None
+
+	# what's waiting, for a health page or the command line
+	def backlog(self):
+		if not self.path:
+			return None
+		db = sqlite3.connect(self.path)
+		try:
+			pending = db.execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+			outbox = db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+		except sqlite3.Error:
+			return {'failing': self.failing}
+		finally:
+			db.close()
+		return {'pending': pending, 'outbox': outbox, 'failing': self.failing}
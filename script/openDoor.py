@@ -8,31 +8,42 @@
 
 
 import RPi.GPIO as GPIO
-from pathlib import Path
 import time
 import sys
+import argparse
+import tracing
+from doorstate import DoorState
 
 
-# If door is opening, or code barfed this file will exist - and then do nothing. 
-tempFile = Path("/tmp/GarageDoor.opening")
+# garagedoor.php passes on when it got the request, so the trace (see tracing.py) covers its exec() too
+parser = argparse.ArgumentParser(description='Pulse the garage door relay.')
+parser.add_argument("--requested", type=float, help="when the web request came in, in seconds since the epoch", metavar="TIME")
+args = parser.parse_args()
+tracing.scriptTrace("trigger", args.requested)
+
+
+# If the door is already moving (by this script, the daemon or anyone else) do nothing. 
+# If the script barfed, its claim on the door runs out after 20 seconds by itself.
+doorState = DoorState()
 
 GPIO.setmode(GPIO.BCM)
 GPIO.setwarnings(False)
 GPIO.setup(4,GPIO.OUT)
 
-if tempFile.is_file():
-	sys.stderr.write("Door is already opening, or script barfed. Quitting...\n")
+# Ensure the garage door has enough time to open and/or close
+with tracing.span("claim"):
+	claimed = doorState.begin("trigger", time.time() + 20)
+
+if claimed is None:
+	sys.stderr.write("Door is already opening. Quitting...\n")
 	sys.exit()
 else:
 	print("Opening or Closing door...")
-	tempFile.touch()
-	GPIO.output(4,GPIO.HIGH)
-	# Allow wires to short for long enough.
-	time.sleep(0.5)
-	GPIO.output(4,GPIO.LOW)	
-	# Ensure the garage door has enough time to open and/or close
-	time.sleep(20)
-	tempFile.unlink()
+	with tracing.relay():
+		GPIO.output(4,GPIO.HIGH)
+		# Allow wires to short for long enough.
+		time.sleep(0.5)
+		GPIO.output(4,GPIO.LOW)	
 
 print("Thanks for opening the door with IFTTT")
 
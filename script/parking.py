@@ -0,0 +1,206 @@
+#!/usr/bin/python3
+#
+# Parking assist: the red/green LEDs as a distance gauge while the car comes in.
+#
+# Car.status() only says present or not (nearer than 110cm), and takes most of a second to say it. While the door
+# is open or moving, the assist pings the HC-SR04 10-20 times a second instead and shows how far the car has to
+# go:
+#
+#   further than stop + span     solid green
+#   closing in                   green blinks, faster the nearer the car gets to the stop point
+#   at or past the stop point    solid red
+#
+# Each ping goes through a median of the last three (the sensor throws the odd wild reading off the door or a
+# wing mirror), then an alpha-beta filter, which tracks the car's speed as well as its distance so it lags by
+# less than a plain average would. Once the car's been still for a few seconds the assist drops to a ping a
+# second, and picks up again as soon as it moves. When the door closes it stops pinging and leaves the LEDs
+# showing whether the car's there, like GarageLights.set().
+#
+#   assist = ParkingAssist(garage.car, GarageLights(), stopDistance=40).start()
+#   assist.doorChanged("open")
+# -----------------------
+
+from __future__ import print_function
+import logging
+import threading
+import time
+
+__author__ = "Ryan Hunt <ryan@ryanhunt.net>"
+__copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
+
+# door states (GarageDoor.status()) the assist runs in
+ACTIVE = ("open", "operating")
+
+
+class DistanceFilter():
+	def __init__(self, alpha=0.5, beta=0.1):
+		self.alpha = alpha
+		self.beta = beta
+		self.reset()
+
+	def reset(self):
+		self.distance = None
+		self.speed = 0.0
+		self._t = None
+		self._recent = []
+
+	# a new ping at time t, returns the filtered distance. speed is in cm/s, negative = coming closer.
+	def update(self, measured, t):
+		self._recent = (self._recent + [measured])[-3:]
+		median = sorted(self._recent)[len(self._recent) // 2]
+
+		if (self.distance is None or t <= self._t):
+			self.distance = median
+			self._t = t
+			return self.distance
+
+		dt = t - self._t
+		predicted = self.distance + self.speed * dt
+		residual = median - predicted
+		self.distance = predicted + self.alpha * residual
+		self.speed += self.beta * residual / dt
+		self._t = t
+		return self.distance
+
+
+class ParkingAssist():
+	# blink half periods, in seconds, at the far end of the span and at the stop point
+	SLOWEST = 0.5
+	FASTEST = 0.05
+
+	# once red, the car has to back off this much (cm) before it goes green again, so it doesn't flicker at the line
+	HYSTERESIS = 5.0
+
+	# publish(carPresent) is called whenever presence changes while the assist is running
+	def __init__(self, car, lights, stopDistance=40.0, span=150.0, rate=15.0, idleRate=1.0, stillSpeed=3.0, settle=3.0, publish=None):
+		self.car = car
+		self.lights = lights
+		self.stopDistance = float(stopDistance)
+		self.span = float(span)
+		self.rate = float(rate)
+		self.idleRate = float(idleRate)
+		self.stillSpeed = float(stillSpeed)
+		self.settle = float(settle)
+		self.publish = publish
+
+		self.filter = DistanceFilter()
+		self.active = False
+		self.stationary = False
+		self.present = None
+		self.pings = 0
+		self.failures = 0
+
+		self._cond = threading.Condition()
+		self._thread = None
+		self._running = False
+		self._pattern = None
+		self._stillSince = None
+
+	def start(self):
+		with self._cond:
+			if self._thread is not None:
+				return self
+			self._running = True
+			self._thread = threading.Thread(target=self._run, name="ParkingAssist")
+			self._thread.daemon = True
+			self._thread.start()
+		return self
+
+	def stop(self):
+		with self._cond:
+			self._running = False
+			self._cond.notify_all()
+		if self._thread is not None:
+			self._thread.join(2)
+			self._thread = None
+
+	def doorChanged(self, status):
+		self.setActive(status in ACTIVE)
+
+	def setActive(self, active):
+		with self._cond:
+			if (active == self.active):
+				return
+			self.active = active
+			self._cond.notify_all()
+		logging.info("Parking assist {0}".format("on" if active else "off"))
+
+	# how long to wait between pings
+	def interval(self):
+		return 1.0 / (self.idleRate if self.stationary else self.rate)
+
+	# the LED pattern for a (filtered) distance
+	def pattern(self, distance):
+		if (distance <= self.stopDistance or (self._pattern == "solid red" and distance <= self.stopDistance + self.HYSTERESIS)):
+			return "solid red"
+		if (distance >= self.stopDistance + self.span):
+			return "solid green"
+		fraction = (distance - self.stopDistance) / self.span
+		period = self.FASTEST + (self.SLOWEST - self.FASTEST) * fraction
+		# in steps, so the blink isn't restarted on every ping
+		return "blink green {0:.2f}".format(round(period / self.FASTEST) * self.FASTEST)
+
+	def _run(self):
+		while True:
+			with self._cond:
+				if (not self.active and self.filter.distance is not None):
+					self._finish()
+				while (self._running and not self.active):
+					self._cond.wait()
+				if not self._running:
+					return
+
+			started = time.time()
+			self._step(started)
+
+			with self._cond:
+				if self.active:
+					self._cond.wait(max(0.0, self.interval() - (time.time() - started)))
+
+	def _step(self, now):
+		try:
+			measured = self.car.ping()
+		except IOError as e:
+			# a missed echo now and then is normal, the filter carries on with the next one
+			self.failures += 1
+			if (self.failures % 100 == 1):
+				logging.warning("Parking assist: {0}".format(e))
+			return
+
+		self.pings += 1
+		distance = self.filter.update(measured, now)
+
+		# still, or on the move again
+		if (abs(self.filter.speed) < self.stillSpeed):
+			if self._stillSince is None:
+				self._stillSince = now
+			self.stationary = (now - self._stillSince >= self.settle)
+		else:
+			self._stillSince = None
+			self.stationary = False
+
+		self._show(self.pattern(distance))
+
+		present = 1 if distance < self.car.presentDistance else 0
+		if (present != self.present):
+			self.present = present
+			if self.publish is not None:
+				self.publish(present)
+
+	def _show(self, pattern):
+		if (pattern == self._pattern):
+			return
+		if (pattern.startswith("blink") and (self._pattern is None or not self._pattern.startswith("blink"))):
+			# blink leaves the other LED as it is
+			self.lights.animate("off red")
+		self.lights.animate(pattern)
+		self._pattern = pattern
+
+	# the door's shut, back to showing whether the car's there
+	def _finish(self):
+		if self.present is not None:
+			self.lights.set(self.present)
+		self.filter.reset()
+		self._pattern = None
+		self._stillSince = None
+		self.stationary = False
@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+#
+# Rate limiting and replay protection for the webhook.
+#
+# Every accepted webhook can pulse the relay, so IFTTT retries, double taps, or anyone who has learnt the
+# secret shouldn't be able to fire it as often as they can send requests. TokenBuckets limits how often each
+# client (and everyone put together) may knock, and ReplayGuard refuses a request it has already seen.
+# Both are a dictionary lookup and some arithmetic, so a rejected request costs microseconds.
+# -----------------------
+
+from __future__ import print_function
+import collections
+import heapq
+import time
+
+__author__ = "Ryan Hunt <ryan@ryanhunt.net>"
+__copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
+
+
+class TokenBucket():
+	# holds up to 'burst' tokens, refilled at 'rate' tokens a second. Each request takes one.
+	__slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+	def __init__(self, rate, burst, now=None):
+		self.rate = float(rate)
+		self.burst = float(burst)
+		self.tokens = self.burst
+		self.updated = time.time() if now is None else now
+
+	# whether there's a token to take, without taking it
+	def ready(self, now=None):
+		if now is None:
+			now = time.time()
+
+		# refill lazily, for however long it's been since we last looked
+		self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+		self.updated = now
+		return (self.tokens >= 1)
+
+	def take(self, now=None):
+		if self.ready(now):
+			self.tokens -= 1
+			return True
+		return False
+
+
+class TokenBuckets():
+	# One bucket per client, plus one shared by everybody so lots of clients can't add up to a flood.
+	# Only the most recently seen maxClients are remembered.
+	def __init__(self, rate=0.1, burst=3, totalRate=1.0, totalBurst=10, maxClients=1024):
+		self.rate = rate
+		self.burst = burst
+		self.maxClients = maxClients
+		self.total = TokenBucket(totalRate, totalBurst)
+		self._clients = collections.OrderedDict()
+
+	def allow(self, client, now=None):
+		if now is None:
+			now = time.time()
+
+		bucket = self._clients.get(client)
+		if bucket is None:
+			bucket = TokenBucket(self.rate, self.burst, now)
+			self._clients[client] = bucket
+			if (len(self._clients) > self.maxClients):
+				self._clients.popitem(last=False)
+		else:
+			self._clients.move_to_end(client)
+
+		# the client's own bucket first, so one noisy client doesn't use up everyone else's allowance. And a token
+		# is only taken from either once both have one: a request turned away by the total costs the client nothing.
+		if not (bucket.ready(now) and self.total.ready(now)):
+			return False
+		bucket.take(now)
+		self.total.take(now)
+		return True
+
+
+class ReplayGuard():
+	# Remembers nonces for 'window' seconds and rejects any it has already seen. If a request also carries
+	# a timestamp, it has to be within the window as well, and the nonce is kept until that timestamp is
+	# out of it (so a nonce can't be reused once it's forgotten).
+	def __init__(self, window=300, maxNonces=4096):
+		self.window = window
+		self.maxNonces = maxNonces
+		self._seen = {}
+		# (expiry, nonce), a heap: a timestamp ahead of ours keeps its nonce longer than one that's behind
+		self._expiries = []
+
+	def check(self, nonce, timestamp=None, now=None):
+		if now is None:
+			now = time.time()
+
+		if timestamp is not None and abs(now - timestamp) > self.window:
+			return False
+
+		self._expire(now)
+
+		if nonce in self._seen:
+			return False
+
+		if (len(self._seen) >= self.maxNonces):
+			# full of nonces that could still be replayed: turn this one away rather than forget one of them
+			return False
+
+		expiry = max(now, timestamp if timestamp is not None else now) + self.window
+		self._seen[nonce] = expiry
+		heapq.heappush(self._expiries, (expiry, nonce))
+		return True
+
+	def _expire(self, now):
+		while self._expiries and self._expiries[0][0] <= now:
+			(expiry, nonce) = heapq.heappop(self._expiries)
+			if (self._seen.get(nonce) == expiry):
+				del self._seen[nonce]
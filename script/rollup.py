@@ -0,0 +1,276 @@
+#!/usr/bin/python3
+#
+# Running min/max/mean/count of the climate readings, per minute, hour and day.
+#
+# Each reading updates one slot per resolution (O(1), no raw samples kept). Slots live in fixed-size arrays
+# used as rings, so memory never grows: a day of minutes, five weeks of hours and a bit over a year of days.
+# Questions like "average garage humidity over the last week" are answered from the coarsest resolution that
+# still gives a sensible number of buckets, so long range charts stay cheap.
+#
+#   rollups = ClimateRollups()
+#   rollups.add(garage.status())
+#   rollups.query('humidity', time.time() - 7 * 86400)      -> {'mean': .., 'min': .., 'max': .., 'count': ..}
+#   rollups.series('oTemperature', time.time() - 86400)      -> [(bucket start, mean, min, max, count), ...]
+#
+# save() writes every ring out (the best part of 700KB). On an SD card that's too much to do every few minutes
+# for a handful of changed buckets, so flush() just appends the buckets that have changed since to a log beside
+# it (path.log), and only writes the whole lot again once the log has grown to COMPACT_AT. load() reads the rings
+# and then replays the log over them. The log carries the generation of the file it goes with, so a log left
+# from before the last save() is ignored.
+# -----------------------
+
+from __future__ import print_function
+import array
+import os
+import random
+import struct
+import time
+
+__author__ = "Ryan Hunt <ryan@ryanhunt.net>"
+__copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
+
+# Garage.status() fields we keep rollups for
+METRICS = ('temperature', 'humidity', 'heatIndex', 'oTemperature', 'oHumidity', 'oHeatIndex', 'rainfall')
+
+# just the ones from the DHT11, when there's no outside weather
+INSIDE = METRICS[:3]
+
+# (name, seconds per bucket, number of buckets)
+RESOLUTIONS = (
+	('minute', 60, 1440),
+	('hour', 3600, 24 * 35),
+	('day', 86400, 400),
+)
+
+# a query uses the coarsest resolution that still gives at least this many buckets over its range
+MIN_BUCKETS = 24
+
+MAGIC = b"GROL"
+VERSION = 1
+# magic, version, number of metrics, number of resolutions, generation
+HEADER = struct.Struct("<4sBBBQ")
+
+LOG_MAGIC = b"GRLL"
+LOG_HEADER = struct.Struct("<4sQ")
+# metric, resolution, slot, then the slot: bucket, count, sum, min, max
+LOG_RECORD = struct.Struct("<BBIqIddd")
+
+# bytes of log before flush() writes the whole file again instead
+COMPACT_AT = 256 * 1024
+
+
+class Ring():
+	# count/sum/min/max for one metric at one resolution
+	def __init__(self, period, size):
+		self.period = period
+		self.size = size
+		self.bucket = array.array('q', [-1]) * size
+		self.count = array.array('I', [0]) * size
+		self.sum = array.array('d', [0.0]) * size
+		self.min = array.array('d', [0.0]) * size
+		self.max = array.array('d', [0.0]) * size
+		# slots changed since the last save or flush
+		self.dirty = set()
+
+	def add(self, t, value):
+		bucket = int(t // self.period)
+		slot = bucket % self.size
+		self.dirty.add(slot)
+
+		if (self.bucket[slot] != bucket):
+			# slot last held a bucket that's now out of range, start it afresh
+			self.bucket[slot] = bucket
+			self.count[slot] = 1
+			self.sum[slot] = value
+			self.min[slot] = value
+			self.max[slot] = value
+			return
+
+		self.count[slot] += 1
+		self.sum[slot] += value
+		if (value < self.min[slot]):
+			self.min[slot] = value
+		if (value > self.max[slot]):
+			self.max[slot] = value
+
+	# oldest time this ring can still answer for, given the time now
+	def oldest(self, now):
+		return (int(now // self.period) - self.size + 1) * self.period
+
+	# (bucket start, count, sum, min, max) for each bucket with data that overlaps [start, end)
+	def buckets(self, start, end):
+		first = int(start // self.period)
+		last = int((end - 1e-9) // self.period)
+		first = max(first, last - self.size + 1)
+
+		for bucket in range(first, last + 1):
+			slot = bucket % self.size
+			if (self.bucket[slot] == bucket and self.count[slot]):
+				yield (bucket * self.period, self.count[slot], self.sum[slot], self.min[slot], self.max[slot])
+
+	def arrays(self):
+		return (self.bucket, self.count, self.sum, self.min, self.max)
+
+	def slot(self, slot):
+		return (self.bucket[slot], self.count[slot], self.sum[slot], self.min[slot], self.max[slot])
+
+	def setSlot(self, slot, bucket, count, total, low, high):
+		(self.bucket[slot], self.count[slot], self.sum[slot], self.min[slot], self.max[slot]) = (bucket, count, total, low, high)
+
+
+class ClimateRollups():
+	def __init__(self, metrics=METRICS, resolutions=RESOLUTIONS):
+		self.metrics = tuple(metrics)
+		self.resolutions = tuple(resolutions)
+		self.rings = dict((m, [Ring(period, size) for (name, period, size) in self.resolutions]) for m in self.metrics)
+		# which save() the log on disk goes with
+		self.generation = 0
+
+	# add whatever metrics are in a Garage.status() style dictionary, read at time t (default now)
+	def add(self, status, t=None):
+		if t is None:
+			t = time.time()
+
+		for metric in self.metrics:
+			value = status.get(metric)
+			if value is None:
+				continue
+			value = float(value)
+			for ring in self.rings[metric]:
+				ring.add(t, value)
+
+	def _ring(self, metric, start, end, resolution=None):
+		rings = self.rings[metric]
+
+		if resolution is not None:
+			names = [r[0] for r in self.resolutions]
+			return rings[names.index(resolution)]
+
+		# coarsest ring with enough buckets over the range, that still goes back far enough
+		usable = [r for r in rings if r.oldest(end) <= start] or [max(rings, key=lambda r: r.period * r.size)]
+		fine = [r for r in usable if (end - start) / r.period >= MIN_BUCKETS]
+		return max(fine, key=lambda r: r.period) if fine else min(usable, key=lambda r: r.period)
+
+	# summary of metric between start and end (default now). Returns None if there's no data.
+	def query(self, metric, start, end=None, resolution=None):
+		if end is None:
+			end = time.time()
+
+		count = 0
+		total = 0.0
+		low = None
+		high = None
+
+		for (bucketStart, n, s, mn, mx) in self._ring(metric, start, end, resolution).buckets(start, end):
+			count += n
+			total += s
+			low = mn if low is None else min(low, mn)
+			high = mx if high is None else max(high, mx)
+
+		if not count:
+			return None
+
+		return {'mean': total / count, 'min': low, 'max': high, 'count': count}
+
+	# per bucket (start, mean, min, max, count) between start and end, for charts
+	def series(self, metric, start, end=None, resolution=None):
+		if end is None:
+			end = time.time()
+
+		return [(b, s / n, mn, mx, n) for (b, n, s, mn, mx) in self._ring(metric, start, end, resolution).buckets(start, end)]
+
+	# write every ring out, e.g. on shutdown. Starts a new generation, so the old log no longer applies.
+	def save(self, path):
+		generation = random.getrandbits(63) or 1
+		tmp = "{0}.tmp".format(path)
+		with open(tmp, "wb") as f:
+			f.write(HEADER.pack(MAGIC, VERSION, len(self.metrics), len(self.resolutions), generation))
+			for metric in self.metrics:
+				for ring in self.rings[metric]:
+					for a in ring.arrays():
+						a.tofile(f)
+		# swap it in whole, so a crash mid save leaves the previous file alone
+		os.replace(tmp, path)
+		self.generation = generation
+		for metric in self.metrics:
+			for ring in self.rings[metric]:
+				ring.dirty.clear()
+		try:
+			os.remove(self._logPath(path))
+		except OSError:
+			pass
+
+	# append the buckets that have changed since the last save() or flush() to the log, or save() if it's
+	# got big (or there's nothing for it to go with yet)
+	def flush(self, path):
+		log = self._logPath(path)
+		try:
+			size = os.path.getsize(log)
+		except OSError:
+			size = 0
+		if (not self.generation or not os.path.exists(path) or size >= COMPACT_AT):
+			self.save(path)
+			return
+
+		records = []
+		for (m, metric) in enumerate(self.metrics):
+			for (r, ring) in enumerate(self.rings[metric]):
+				for slot in sorted(ring.dirty):
+					records.append(LOG_RECORD.pack(m, r, slot, *ring.slot(slot)))
+				ring.dirty.clear()
+		if not records:
+			return
+
+		with open(log, "ab") as f:
+			if (f.tell() == 0):
+				f.write(LOG_HEADER.pack(LOG_MAGIC, self.generation))
+			f.write(b"".join(records))
+
+	def _logPath(self, path):
+		return "{0}.log".format(path)
+
+	# load a file written by save(). Does nothing if it doesn't exist or was written with different settings.
+	def load(self, path):
+		try:
+			f = open(path, "rb")
+		except IOError:
+			return False
+
+		with f:
+			header = f.read(HEADER.size)
+			if (len(header) != HEADER.size):
+				return False
+			(magic, version, metrics, resolutions, generation) = HEADER.unpack(header)
+			if ((magic, version, metrics, resolutions) != (MAGIC, VERSION, len(self.metrics), len(self.resolutions))):
+				return False
+
+			try:
+				for metric in self.metrics:
+					for ring in self.rings[metric]:
+						for a in ring.arrays():
+							size = len(a)
+							del a[:]
+							a.fromfile(f, size)
+			except EOFError:
+				self.__init__(self.metrics, self.resolutions)
+				return False
+
+		self.generation = generation
+		self._replay(self._logPath(path), generation)
+		return True
+
+	def _replay(self, log, generation):
+		try:
+			with open(log, "rb") as f:
+				data = f.read()
+		except IOError:
+			return
+		if (len(data) < LOG_HEADER.size or LOG_HEADER.unpack_from(data, 0) != (LOG_MAGIC, generation)):
+			return
+
+		rings = [self.rings[metric] for metric in self.metrics]
+		# a record cut short by a crash mid append is left off
+		end = LOG_HEADER.size + (len(data) - LOG_HEADER.size) // LOG_RECORD.size * LOG_RECORD.size
+		for (m, r, slot, bucket, count, total, low, high) in LOG_RECORD.iter_unpack(data[LOG_HEADER.size:end]):
+			if (m < len(rings) and r < len(rings[m]) and slot < rings[m][r].size):
+				rings[m][r].setSlot(slot, bucket, count, total, low, high)
@@ -0,0 +1,222 @@
+#!/usr/bin/python3
+#
+# Automatic door actions from the sensor readings.
+#
+# A rule is a condition over the status fields (doorState, carPresent, temperature, humidity, heatIndex,
+# oTemperature, oHumidity, oHeatIndex, rainfall, ...), an optional hold time it must stay true for, and an
+# action. Rules come from garagesecret.py:
+#
+# def getRules():
+#    return [
+#        {'name': 'air', 'when': "humidity > 75 and rainfall == 0 and doorState == 'closed'", 'hold': 600, 'do': 'ventilate'},
+#        {'name': 'rain', 'when': "rainfall > 0 and doorState == 'ventilate'", 'do': 'close'},
+#        {'name': 'autoclose', 'when': "carPresent == 1 and doorState == 'open'", 'hold': 900, 'do': 'close'},
+#    ]
+#
+# Each condition is checked (only comparisons, arithmetic, and/or/not and the field names are allowed) and
+# compiled once. The engine indexes rules by the fields they use, so a new reading only re-evaluates the rules
+# that depend on a field that actually changed. Hold times are kept in a heap of deadlines, and tick() just
+# looks at the earliest one.
+#
+# A rule fires once when its condition becomes (and stays, for 'hold' seconds) true, and won't fire again until
+# the condition has been false. That state is saved, so restarting the daemon doesn't repeat an action.
+# -----------------------
+
+from __future__ import print_function
+import ast
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+
+__author__ = "Ryan Hunt <ryan@ryanhunt.net>"
+__copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
+
+DEFAULT_PATH = "/var/tmp/garage.rules"
+
+# what a condition may contain
+ALLOWED = (
+	ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd,
+	ast.Compare, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn,
+	ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Name, ast.Load, ast.Tuple, ast.List, ast.Constant,
+) + tuple(getattr(ast, name) for name in ('Num', 'Str') if name in ast.__dict__)
+
+
+class Rule():
+	def __init__(self, name, when, do, hold=0):
+		self.name = name
+		self.when = when
+		self.do = do
+		self.hold = float(hold)
+
+		tree = ast.parse(when, mode="eval")
+		for node in ast.walk(tree):
+			if not isinstance(node, ALLOWED):
+				raise ValueError("Rule {0}: '{1}' isn't allowed in a condition".format(name, type(node).__name__))
+
+		self.signals = frozenset(node.id for node in ast.walk(tree) if isinstance(node, ast.Name))
+		self._code = compile(tree, "<rule {0}>".format(name), "eval")
+
+		# is the condition true, since when, and has it fired since it last became true
+		self.active = False
+		self.since = None
+		self.fired = False
+
+	# False if any field it needs hasn't been read yet
+	def evaluate(self, signals):
+		try:
+			return bool(eval(self._code, {'__builtins__': {}}, signals))
+		except (NameError, TypeError, ZeroDivisionError):
+			return False
+
+	def key(self):
+		return "{0}|{1}|{2}|{3}".format(self.when, self.do, self.hold, self.name)
+
+
+class RuleEngine():
+	# act(rule) is called when a rule fires. It should hand the action off rather than run it there and then.
+	def __init__(self, rules, act, path=DEFAULT_PATH):
+		self.rules = list(rules)
+		self.act = act
+		self.path = path
+		self.signals = {}
+
+		# field name -> rules that use it
+		self.index = {}
+		for rule in self.rules:
+			for signal in rule.signals:
+				self.index.setdefault(signal, []).append(rule)
+
+		# (deadline, rule name) for rules waiting out their hold time
+		self._timers = []
+		self._byName = dict((rule.name, rule) for rule in self.rules)
+
+		# saved state from before a restart, used when each rule is first evaluated
+		self._restored = {}
+
+		# readings arrive from several sensor workers, timers are run from the main loop
+		self._lock = threading.Lock()
+
+	@classmethod
+	def fromSecret(cls, sekret, act, path=DEFAULT_PATH):
+		specs = sekret.getRules() if hasattr(sekret, 'getRules') else []
+		return cls([Rule(s['name'], s['when'], s['do'], s.get('hold', 0)) for s in specs], act, path)
+
+	# new values for some fields, read at time now
+	def update(self, fields, now=None):
+		if now is None:
+			now = time.time()
+
+		with self._lock:
+			self._update(fields, now)
+
+	def _update(self, fields, now):
+		affected = []
+		for (name, value) in fields.items():
+			if (self.signals.get(name, self) == value):
+				continue
+			self.signals[name] = value
+			for rule in self.index.get(name, ()):
+				if rule not in affected:
+					affected.append(rule)
+
+		changed = False
+		for rule in affected:
+			changed = self._evaluate(rule, now) or changed
+
+		if changed:
+			self.save()
+
+	# fire any rules whose hold time is up. Cheap enough to call every loop.
+	def tick(self, now=None):
+		if now is None:
+			now = time.time()
+
+		# nearly always nothing due, skip the lock
+		if not (self._timers and self._timers[0][0] <= now):
+			return
+
+		with self._lock:
+			self._tick(now)
+
+	def _tick(self, now):
+		changed = False
+		while (self._timers and self._timers[0][0] <= now):
+			(deadline, name) = heapq.heappop(self._timers)
+			rule = self._byName[name]
+			# stale if the condition has gone false (and maybe true again) since this was scheduled
+			if (rule.active and not rule.fired and rule.since + rule.hold == deadline):
+				self._fire(rule)
+				changed = True
+
+		if changed:
+			self.save()
+
+	def _evaluate(self, rule, now):
+		restored = self._restored.get(rule.name)
+		if restored is not None:
+			# each worker's fields come in separately after a restart: wait for all of them before deciding
+			# whether the rule is still where it was, or it'd look false for now and fire again when it isn't
+			if not rule.signals.issubset(self.signals):
+				return False
+			del self._restored[rule.name]
+
+		active = rule.evaluate(self.signals)
+		if (active == rule.active):
+			return False
+
+		rule.active = active
+		if not active:
+			rule.since = None
+			rule.fired = False
+			return True
+
+		if (restored and restored['active']):
+			# still true after a restart, carry on where we were
+			rule.since = restored['since']
+			rule.fired = bool(restored['fired'])
+			if rule.fired:
+				return True
+		else:
+			rule.since = now
+
+		if (rule.since + rule.hold <= now):
+			self._fire(rule)
+		else:
+			heapq.heappush(self._timers, (rule.since + rule.hold, rule.name))
+		return True
+
+	def _fire(self, rule):
+		rule.fired = True
+		logging.info("Rule %s: %s", rule.name, rule.do)
+		try:
+			self.act(rule)
+		except Exception:
+			logging.exception("Rule %s failed to %s", rule.name, rule.do)
+
+	def save(self):
+		if not self.path:
+			return
+		state = dict((r.key(), {'active': r.active, 'since': r.since, 'fired': r.fired}) for r in self.rules)
+		tmp = "{0}.tmp".format(self.path)
+		with open(tmp, "w") as f:
+			json.dump(state, f)
+		os.replace(tmp, self.path)
+
+	# Restore what each rule was doing before a restart, applied once its fields have been read again (so a
+	# condition that was true and is still true doesn't fire twice). A rule that's been edited starts afresh.
+	def load(self):
+		if not self.path:
+			return
+		try:
+			with open(self.path) as f:
+				state = json.load(f)
+		except (IOError, ValueError):
+			return
+
+		for rule in self.rules:
+			saved = state.get(rule.key())
+			if saved:
+				self._restored[rule.name] = saved
@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+#
+# The daemon's latest Garage.status() readings, in shared memory for any local process to read.
+#
+# main.py --json (and so garagedoorstate.php) and cron jobs used to build a Garage and read every sensor again,
+# DHT11 retries and all, to find out what the daemon already knew. Now the daemon keeps its snapshot (the
+# wireformat.py fields) in a POSIX shared memory segment, /dev/shm/garage.status (multiprocessing.shared_memory
+# can attach to it by name), and a reader maps it once and then reads it with no system calls, no GPIO and no locks:
+#
+#   header  magic (4s), version (B), seq (Q at offset 8)
+#   body    snapshot seq (I), updated (d), then each wireformat.py field packed as it is on the wire
+#   crc     CRC32 of the body (I)
+#
+# The seq is a seqlock: the writer makes it odd, writes the body, then makes it even again. A reader takes an
+# even seq, copies the body, and keeps the copy if the seq hasn't moved and the CRC matches, otherwise it tries
+# again. Readers never hold anything up, the writer doesn't know they're there.
+#
+#   import sharedstatus
+#   sharedstatus.read()         -> {'doorState': 'closed', 'carPresent': 1, ...}, or None if the daemon isn't running
+#
+#   ./sharedstatus.py           prints the same as main.py --json
+# -----------------------
+
+from __future__ import print_function
+import argparse
+import collections
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+from wireformat import FIELDS, toStatus
+
+__author__ = "Ryan Hunt <ryan@ryanhunt.net>"
+__copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
+
+NAME = "garage.status"
+
+# where POSIX shared memory lives on Linux
+SHM_DIR = "/dev/shm"
+
+MAGIC = b"GSTS"
+VERSION = 1
+
+HEADER = struct.Struct("<4sB3xQ")
+SEQ = struct.Struct("<Q")
+SEQ_OFFSET = 8
+BODY = struct.Struct("<Id" + "".join(f[1] for f in FIELDS))
+CRC = struct.Struct("<I")
+BODY_OFFSET = HEADER.size
+SIZE = BODY_OFFSET + BODY.size + CRC.size
+
+# the daemon updates it every poll (half a second), much older than this and it's not running
+MAX_AGE = 10
+
+# A write takes microseconds, but the writer can be switched out part way (on a single core Pi, for the whole of
+# the reader's time slice). Spin this many tries at a seq that isn't moving, then sleep between tries, and give up
+# after STUCK seconds: the writer died part way.
+SPINS = 100
+STUCK = 1.0
+
+Snapshot = collections.namedtuple("Snapshot", "seq updated status")
+
+
+class StatusWriter():
+	# The daemon's end. Only one thread writes at a time (the daemon's publishLock).
+	#
+	# The segment's made straight in /dev/shm, which is all shm_open() does on Linux, rather than through
+	# multiprocessing.shared_memory: importing that costs a 256MB Pi 6MB, and (before Python 3.13) it starts a
+	# resource tracker process too. It's the same segment SharedMemory("garage.status") attaches to.
+	def __init__(self, name=NAME):
+		self.path = os.path.join(SHM_DIR, name)
+		fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+		try:
+			# the web server's user reads it too, whatever our umask
+			os.fchmod(fd, 0o644)
+			if (os.fstat(fd).st_size != SIZE):
+				os.ftruncate(fd, SIZE)
+			self._map = mmap.mmap(fd, SIZE)
+		finally:
+			os.close(fd)
+
+		(magic, version, seq) = HEADER.unpack_from(self._map, 0)
+		# left by a daemon before us: carry on from its seq, so a reader that still has it open sees our writes as new
+		self._seq = seq + (seq & 1) if (magic == MAGIC and version == VERSION) else 0
+		HEADER.pack_into(self._map, 0, MAGIC, VERSION, self._seq)
+
+	# the wireformat.SnapshotEncoder's seq and values, as of updated
+	def update(self, seq, values, updated=None):
+		body = BODY.pack(seq, time.time() if updated is None else updated, *values)
+		body += CRC.pack(zlib.crc32(body) & 0xFFFFFFFF)
+
+		m = self._map
+		self._seq += 1
+		SEQ.pack_into(m, SEQ_OFFSET, self._seq)
+		m[BODY_OFFSET:SIZE] = body
+		self._seq += 1
+		SEQ.pack_into(m, SEQ_OFFSET, self._seq)
+
+	def close(self):
+		self._map.close()
+		try:
+			os.unlink(self.path)
+		except OSError:
+			pass
+
+
+class StatusReader():
+	# Maps the segment read only. Attaching through multiprocessing.shared_memory would (before Python 3.13) also
+	# start a resource tracker, which removes the segment when the reader exits.
+	def __init__(self, name=NAME):
+		fd = os.open(os.path.join(SHM_DIR, name), os.O_RDONLY)
+		try:
+			if (os.fstat(fd).st_size < SIZE):
+				raise IOError("{0} is too small for a status snapshot".format(name))
+			self._map = mmap.mmap(fd, SIZE, access=mmap.ACCESS_READ)
+		finally:
+			os.close(fd)
+
+		(magic, version, seq) = HEADER.unpack_from(self._map, 0)
+		if (magic != MAGIC or version != VERSION):
+			self._map.close()
+			raise IOError("{0} isn't a version {1} status snapshot".format(name, VERSION))
+
+	# The latest Snapshot, or None if nothing's been written yet
+	def read(self):
+		m = self._map
+		last = None
+		tries = 0
+		while True:
+			(seq,) = SEQ.unpack_from(m, SEQ_OFFSET)
+			if (seq != last):
+				(last, tries) = (seq, 0)
+			elif (tries >= SPINS):
+				if (tries == SPINS):
+					since = time.time()
+				elif (time.time() - since > STUCK):
+					raise IOError("The status snapshot is stuck part way through a write, the daemon may have died in it")
+				time.sleep(0.0001)
+			tries += 1
+
+			if (seq & 1):
+				continue
+			raw = m[BODY_OFFSET:SIZE]
+			(after,) = SEQ.unpack_from(m, SEQ_OFFSET)
+			if (after != seq):
+				continue
+			(crc,) = CRC.unpack_from(raw, BODY.size)
+			if (zlib.crc32(raw[:BODY.size]) & 0xFFFFFFFF != crc):
+				if (seq == 0):
+					return None
+				continue
+
+			fields = BODY.unpack_from(raw)
+			return Snapshot(fields[0], fields[1], toStatus(fields[2:]))
+
+	def close(self):
+		self._map.close()
+
+
+_readers = {}
+
+
+# The daemon's latest status, or None if it isn't running (or hasn't updated it for maxAge seconds).
+def read(name=NAME, maxAge=MAX_AGE):
+	for attempt in (1, 2):
+		snapshot = None
+		try:
+			if name not in _readers:
+				_readers[name] = StatusReader(name)
+			snapshot = _readers[name].read()
+		except (IOError, OSError, ValueError):
+			pass
+
+		if (snapshot is not None and (maxAge is None or time.time() - snapshot.updated <= maxAge)):
+			return snapshot.status
+
+		# an old segment a restarted daemon has since replaced is still mapped here, look again
+		reader = _readers.pop(name, None)
+		if reader is not None:
+			reader.close()
+
+	return None
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description="Print the garage daemon's latest status, as main.py --json does.")
+	parser.add_argument("-a", "--max-age", dest="maxAge", type=float, default=MAX_AGE, help="ignore a snapshot older than SECONDS (default {0})".format(MAX_AGE), metavar="SECONDS")
+	parser.add_argument("-n", "--name", default=NAME, help="shared memory segment (default {0})".format(NAME))
+	args = parser.parse_args()
+
+	status = read(args.name, args.maxAge)
+	if status is None:
+		sys.stderr.write("No recent status from the daemon in {0}\n".format(os.path.join(SHM_DIR, args.name)))
+		sys.exit(1)
+	print(json.dumps(status))
@@ -0,0 +1,234 @@
+#!/usr/bin/python3
+#
+# Supervised sensor workers.
+#
+# The daemon used to do everything on one thread, so one sensor throwing an exception killed the whole monitor,
+# and a read that never came back (the HC-SR04 waiting on an echo that never arrives) stopped it checking the
+# door. Each sensor now gets a Worker: its own thread, reading every 'interval' seconds. If a read raises, the
+# worker backs off exponentially and tries again. If a read takes longer than its 'deadline', the watchdog
+# (Supervisor.check(), called from the main thread) gives up on that thread and starts a fresh one after a
+# backoff. A slow or broken sensor only ever holds up itself.
+#
+# Python can't kill a thread, so an abandoned read is left to finish (or not) on its own and its result is
+# ignored. The sensor code has timeouts of its own to make sure they do finish.
+#
+# A worker doesn't have to read at a fixed rate: give it a schedule, a function returning the seconds until the
+# next read (e.g. quicker while the door's open), and call wake() to have it read straight away (e.g. on a GPIO
+# edge). Stable backs a sensor off while its readings aren't changing.
+# -----------------------
+
+from __future__ import print_function
+import logging
+import threading
+import time
+
+__author__ = "Ryan Hunt <ryan@ryanhunt.net>"
+__copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
+
+
+class Worker():
+	def __init__(self, name, read, interval, deadline, backoff=1.0, maxBackoff=300.0, schedule=None):
+		self.name = name
+		self.read = read
+		self.interval = interval
+		self.schedule = schedule
+		self.deadline = deadline
+		self.backoff = backoff
+		self.maxBackoff = maxBackoff
+
+		self.state = "stopped"
+		self.failures = 0
+		self.restarts = 0
+		self.consecutive = 0
+		self.lastSuccess = None
+		self.lastError = None
+		self.lastDuration = None
+
+		self._generation = 0
+		self._busySince = None
+		self._restartAt = None
+		self._stop = threading.Event()
+		self._wake = threading.Event()
+
+	def start(self):
+		self._generation += 1
+		self._busySince = None
+		self._restartAt = None
+		self._stop.clear()
+		self._wake.clear()
+		self._setState("starting")
+
+		thread = threading.Thread(target=self._run, args=(self._generation,), name="Worker-{0}".format(self.name))
+		thread.daemon = True
+		thread.start()
+
+	def stop(self):
+		self._generation += 1
+		self._stop.set()
+		self._wake.set()
+		self._setState("stopped")
+
+	# read now rather than waiting for the next one (or, if a read's under way, straight after it)
+	def wake(self):
+		self._wake.set()
+
+	# seconds from the start of one read to the start of the next
+	def nextInterval(self):
+		return self.interval if self.schedule is None else self.schedule()
+
+	# True if stopped
+	def _wait(self, delay):
+		self._wake.wait(delay)
+		self._wake.clear()
+		return self._stop.is_set()
+
+	def _delay(self):
+		return min(self.maxBackoff, self.backoff * 2 ** max(0, self.consecutive - 1))
+
+	def _run(self, generation):
+		delay = 0
+
+		while (generation == self._generation):
+			if self._wait(delay):
+				return
+
+			started = time.time()
+			self._busySince = started
+
+			try:
+				self.read()
+			except Exception as e:
+				if (generation != self._generation):
+					# the watchdog already gave up on us
+					return
+				self._busySince = None
+				self.failures += 1
+				self.consecutive += 1
+				self.lastError = "{0}: {1}".format(type(e).__name__, e)
+				delay = self._delay()
+				self._setState("failing")
+				logging.warning("%s read failed (%s), trying again in %.0fs", self.name, self.lastError, delay)
+				continue
+
+			if (generation != self._generation):
+				return
+
+			now = time.time()
+			self._busySince = None
+			self.lastDuration = now - started
+			self.lastSuccess = now
+			self.consecutive = 0
+			self._setState("ok")
+
+			delay = max(0, self.nextInterval() - self.lastDuration)
+
+	# watchdog, called regularly from the supervising thread
+	def check(self, now=None):
+		if now is None:
+			now = time.time()
+
+		if (self.state == "hung"):
+			if (now >= self._restartAt):
+				self.restarts += 1
+				logging.warning("Restarting %s (restart %d)", self.name, self.restarts)
+				self.start()
+			return
+
+		busy = self._busySince
+		if (busy is not None and now - busy > self.deadline):
+			# abandon the stuck thread, anything it returns from now on is ignored
+			self._generation += 1
+			self.failures += 1
+			self.consecutive += 1
+			self.lastError = "no result after {0:.0f}s".format(now - busy)
+			self._restartAt = now + self._delay()
+			self._setState("hung")
+			logging.error("%s is hung (%s), restarting it in %.0fs", self.name, self.lastError, self._restartAt - now)
+
+	def _setState(self, state):
+		if (state != self.state):
+			logging.info("Worker %s: %s -> %s", self.name, self.state, state)
+		self.state = state
+
+	def health(self):
+		return {
+			'name': self.name,
+			'state': self.state,
+			'failures': self.failures,
+			'restarts': self.restarts,
+			'lastSuccess': self.lastSuccess,
+			'lastError': self.lastError,
+			'lastDuration': self.lastDuration,
+		}
+
+
+class Supervisor():
+	def __init__(self):
+		self.workers = []
+
+	def add(self, worker):
+		self.workers.append(worker)
+		return worker
+
+	def start(self):
+		for worker in self.workers:
+			worker.start()
+
+	def stop(self):
+		for worker in self.workers:
+			worker.stop()
+
+	def check(self, now=None):
+		for worker in self.workers:
+			worker.check(now)
+
+	def health(self):
+		return [worker.health() for worker in self.workers]
+
+	def isHealthy(self):
+		return all(worker.state == "ok" for worker in self.workers)
+
+	def worker(self, name):
+		for worker in self.workers:
+			if (worker.name == name):
+				return worker
+		return None
+
+
+# An interval for a sensor that's often unchanged: doubles (up to maxInterval) each time a reading is the same as
+# the one it started backing off from, and drops back to interval as soon as one differs (so a slow drift still
+# counts as a change eventually). same(old, new) decides what counts as the same.
+class Stable():
+	def __init__(self, interval, maxInterval, same=None):
+		self.interval = interval
+		self.maxInterval = maxInterval
+		self.same = same if same is not None else (lambda old, new: old == new)
+		self.current = interval
+		self.last = None
+
+	def observe(self, value):
+		if (self.last is not None and self.same(self.last, value)):
+			self.current = min(self.maxInterval, self.current * 2)
+		else:
+			self.current = self.interval
+			self.last = value
+
+	def __call__(self):
+		return min(self.maxInterval, max(self.interval, self.current))
+
+
+# This process's resident memory (now, at its peak, and how much of it is our own heap rather than shared
+# libraries, in kB) and thread count, from /proc. None if there's no /proc. A steady climb in the heap over days
+# means something is holding on to readings, or abandoned reads are piling up.
+def memoryUsage():
+	fields = {'VmRSS': 'rss', 'VmHWM': 'peakRss', 'RssAnon': 'heap', 'Threads': 'threads'}
+	usage = {}
+	try:
+		with open("/proc/self/status") as f:
+			for line in f:
+				(name, sep, value) = line.partition(":")
+				if name in fields:
+					usage[fields[name]] = int(value.split()[0])
+	except (IOError, ValueError):
+		return None
+	return usage
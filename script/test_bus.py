@@ -0,0 +1,61 @@
+#!/usr/bin/python3
+#
+# python3 -m unittest discover -s script
+# -----------------------
+
+from __future__ import print_function
+import socket
+import time
+import unittest
+import bus
+
+__author__ = "Ryan Hunt <ryan@ryanhunt.net>"
+__copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
+
+
+class WillTest(unittest.TestCase):
+	def setUp(self):
+		self.commands = []
+		self.broker = bus.start(0, command=self.command, password="pw", readPassword="ro")
+		self.port = self.broker.server_address[1]
+
+	def tearDown(self):
+		self.broker.shutdown()
+		self.broker.server_close()
+
+	def command(self, name):
+		self.commands.append(name)
+		return True
+
+	# connects with a will to open the door, then goes without a DISCONNECT. Returns the CONNACK's code.
+	def connectAndVanish(self, password):
+		connection = socket.create_connection(("127.0.0.1", self.port), timeout=5)
+		try:
+			connection.sendall(bus.connectPacket("will", password, will=(bus.PREFIX + bus.COMMAND, "open")))
+			(kind, flags, body) = bus.readPacket(connection.makefile("rb"))
+		finally:
+			connection.close()
+		self.assertEqual(kind, bus.CONNACK)
+		return body[1]
+
+	def waitForCommands(self, timeout=1.0):
+		end = time.time() + timeout
+		while not self.commands and time.time() < end:
+			time.sleep(0.01)
+		return self.commands
+
+	def testWillPublished(self):
+		self.assertEqual(self.connectAndVanish("pw"), bus.ACCEPTED)
+		self.assertEqual(self.waitForCommands(), ["open"])
+
+	def testRefusedClientsWillIgnored(self):
+		self.assertEqual(self.connectAndVanish("wrong"), bus.BAD_PASSWORD)
+		self.assertEqual(self.waitForCommands(), [])
+
+	def testReadOnlyClientsWillIgnored(self):
+		self.assertEqual(self.connectAndVanish("ro"), bus.ACCEPTED)
+		self.assertEqual(self.waitForCommands(), [])
+
+
+if __name__ == '__main__':
+	unittest.main()
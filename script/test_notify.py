@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+#
+# python3 -m unittest discover -s script
+# -----------------------
+
+from __future__ import print_function
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+import notify
+from notify import MemoryChannel, Notifier
+
+__author__ = "Ryan Hunt <ryan@ryanhunt.net>"
+__copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
+
+
+class TimedChannel(MemoryChannel):
+	# a MemoryChannel that also remembers when each send was tried
+	def __init__(self, failures=0):
+		MemoryChannel.__init__(self, failures)
+		self.tries = []
+
+	def send(self, alerts):
+		self.tries.append(time.time())
+		MemoryChannel.send(self, alerts)
+
+
+def waitFor(condition, timeout=5.0):
+	end = time.time() + timeout
+	while not condition():
+		if (time.time() > end):
+			return False
+		time.sleep(0.01)
+	return True
+
+
+class NotifierTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir, "garage.notify")
+		self.errorWait = notify.ERROR_WAIT
+		notify.ERROR_WAIT = 0.05
+
+	def tearDown(self):
+		notify.ERROR_WAIT = self.errorWait
+		shutil.rmtree(self.dir)
+
+	def testRepeatsMerged(self):
+		channel = MemoryChannel()
+		notifier = Notifier([channel], path=None, window=60.0).start()
+		notifier.notify("door-open", "Garage door has been open for 10 minutes", t=100)
+		notifier.notify("slow-up", "Door took 20s to open")
+		notifier.notify("door-open", "Garage door has been open for 20 minutes", t=200)
+		self.assertTrue(notifier.flush(5))
+		self.assertTrue(waitFor(lambda: channel.sent))
+
+		self.assertEqual(len(channel.sent), 1)
+		alerts = dict((alert['key'], alert) for alert in channel.sent[0])
+		self.assertEqual(alerts['door-open']['count'], 2)
+		self.assertEqual(alerts['door-open']['message'], "Garage door has been open for 20 minutes")
+		self.assertEqual(alerts['door-open']['time'], 100)
+		self.assertEqual(alerts['slow-up']['count'], 1)
+
+	def testBatchedAfterWindow(self):
+		channel = MemoryChannel()
+		notifier = Notifier([channel], path=None, window=0.2).start()
+		notifier.notify("a", "first")
+		notifier.notify("b", "second")
+		self.assertTrue(waitFor(lambda: channel.sent))
+		self.assertEqual([alert['key'] for alert in channel.sent[0]], ["a", "b"])
+
+	def testRetriedWithBackoff(self):
+		channel = TimedChannel(failures=3)
+		notifier = Notifier([channel], path=self.path, window=0.0, backoff=0.1).start()
+		notifier.notify("a", "first")
+		self.assertTrue(notifier.flush(5))
+		self.assertTrue(waitFor(lambda: channel.sent))
+
+		self.assertEqual(len(channel.tries), 4)
+		self.assertEqual(len(channel.sent), 1)
+		gaps = [b - a for (a, b) in zip(channel.tries, channel.tries[1:])]
+		for (gap, delay) in zip(gaps, [0.1, 0.2, 0.4]):
+			self.assertGreaterEqual(gap, delay)
+		self.assertTrue(waitFor(lambda: notifier.backlog()['outbox'] == 0))
+
+	def testGivesUp(self):
+		channel = MemoryChannel(failures=100)
+		notifier = Notifier([channel], path=self.path, window=0.0, backoff=0.05, maxAge=0.2).start()
+		notifier.notify("a", "first")
+		self.assertTrue(notifier.flush(5))
+		self.assertTrue(waitFor(lambda: notifier.backlog()['outbox'] == 0))
+		self.assertEqual(channel.sent, [])
+
+	def testSurvivesDatabaseError(self):
+		channel = MemoryChannel()
+		notifier = Notifier([channel], path=None, window=0.0)
+		nextWake = notifier._nextWake
+		fails = [sqlite3.OperationalError("database is locked")]
+
+		def failOnce(now):
+			if fails:
+				raise fails.pop()
+			return nextWake(now)
+		notifier._nextWake = failOnce
+
+		notifier.start()
+		notifier.notify("a", "first")
+		self.assertTrue(notifier.flush(5))
+		self.assertTrue(waitFor(lambda: channel.sent))
+		self.assertEqual([alert['key'] for alert in channel.sent[0]], ["a"])
+		self.assertTrue(waitFor(lambda: notifier.failing is None))
+		self.assertTrue(notifier._thread.is_alive())
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,36 @@
+#!/usr/bin/python3
+#
+# python3 -m unittest discover -s script
+# -----------------------
+
+from __future__ import print_function
+import unittest
+from ratelimit import TokenBuckets
+
+__author__ = "Ryan Hunt <ryan@ryanhunt.net>"
+__copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
+
+
+class TokenBucketsTest(unittest.TestCase):
+	def testClientLimited(self):
+		buckets = TokenBuckets(rate=0.1, burst=2, totalRate=1.0, totalBurst=10)
+		buckets.total.updated = 100
+		self.assertEqual([buckets.allow("a", now=100) for i in range(3)], [True, True, False])
+		self.assertTrue(buckets.allow("b", now=100))
+		self.assertTrue(buckets.allow("a", now=110))
+
+	def testRefusedByTotalCostsNothing(self):
+		buckets = TokenBuckets(rate=0.1, burst=2, totalRate=0.01, totalBurst=2)
+		buckets.total.updated = 100
+		self.assertTrue(buckets.allow("a", now=100))
+		self.assertTrue(buckets.allow("b", now=100))
+
+		# everyone's allowance is gone, so these are turned away without touching the clients' own
+		for i in range(5):
+			self.assertFalse(buckets.allow("a", now=101))
+		buckets.total.tokens = 2
+		self.assertEqual([buckets.allow("a", now=101) for i in range(2)], [True, False])
+
+
+if __name__ == '__main__':
+	unittest.main()
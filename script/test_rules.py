@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+#
+# python3 -m unittest discover -s script
+# -----------------------
+
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import unittest
+from rules import Rule, RuleEngine
+
+__author__ = "Ryan Hunt <ryan@ryanhunt.net>"
+__copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
+
+
+class RestartTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir, "garage.rules")
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def engine(self):
+		fired = []
+		engine = RuleEngine([Rule("rain", "rainfall > 0 and doorState == 'ventilate'", "close")], lambda rule: fired.append(rule.name), self.path)
+		engine.load()
+		return (engine, fired)
+
+	def testFiresOnce(self):
+		(engine, fired) = self.engine()
+		engine.update({'doorState': "ventilate", 'rainfall': 2.0}, now=100)
+		self.assertEqual(fired, ["rain"])
+
+	def testRestartWithFieldsTogether(self):
+		(engine, fired) = self.engine()
+		engine.update({'doorState': "ventilate", 'rainfall': 2.0}, now=100)
+
+		(engine, fired) = self.engine()
+		engine.update({'doorState': "ventilate", 'rainfall': 2.0}, now=200)
+		self.assertEqual(fired, [])
+
+	def testRestartWithFieldsSeparately(self):
+		(engine, fired) = self.engine()
+		engine.update({'doorState': "ventilate", 'rainfall': 2.0}, now=100)
+
+		# the door worker publishes before the weather one
+		(engine, fired) = self.engine()
+		engine.update({'doorState': "ventilate"}, now=200)
+		engine.update({'rainfall': 2.0}, now=201)
+		self.assertEqual(fired, [])
+
+		# and it's still armed for the next time
+		engine.update({'rainfall': 0.0}, now=300)
+		engine.update({'rainfall': 1.0}, now=400)
+		self.assertEqual(fired, ["rain"])
+
+	def testRestartAfterConditionWentFalse(self):
+		(engine, fired) = self.engine()
+		engine.update({'doorState': "ventilate", 'rainfall': 2.0}, now=100)
+		engine.update({'doorState': "closed"}, now=150)
+
+		(engine, fired) = self.engine()
+		engine.update({'doorState': "ventilate"}, now=200)
+		engine.update({'rainfall': 2.0}, now=201)
+		self.assertEqual(fired, ["rain"])
+
+
+if __name__ == '__main__':
+	unittest.main()
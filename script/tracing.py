@@ -0,0 +1,360 @@
+#!/usr/bin/python3
+#
+# Where the time goes between "open the door" and the door actually moving.
+#
+# Every door command gets a trace: an id, and a timed span for each stage it goes through on the way to the
+# relay, then the reed switches confirming the door did something. For a command from IFTTT through the daemon's
+# webhook that's
+#
+#   intake       request received, checked (secret, replay, geofence) and handed to the DoorCommander
+#   queue        waiting for the commander's thread
+#   command      door.ifttt() / open() / ..., with status (reading the reeds), claim (doorstate.py), relay
+#                (the 0.5s pulse) and, for ventilate, the wait before the second pulse inside it
+#   door start   relay pulse to the reeds seeing the door leave where it was
+#   travel       from there to the reeds seeing it arrive
+#
+# and for garagedoor.php -> exec(openDoor.py or main.py), exec (PHP, sudo and fork, if the script is told when
+# the request came in with --requested), python (the interpreter and imports) and garage (Garage() construction,
+# OWM lookup included) come first. The command keeps its spans in memory and writes them out to a small SQLite
+# database (/var/tmp/garage.traces, the last KEEP traces) straight after the relay pulse and again when it's
+# done. The daemon adds the door start and travel spans as it sees the reeds change.
+#
+#   ./tracing.py                 the latest traces
+#   ./tracing.py 3f2a9c01...     one trace's spans, as a timeline
+#
+# Code on the path just says "with tracing.span('relay'):"; it costs nothing when there's no trace running on
+# that thread.
+# -----------------------
+
+from __future__ import print_function
+import argparse
+import atexit
+import collections
+import contextlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+__author__ = "Ryan Hunt <ryan@ryanhunt.net>"
+__copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
+
+DEFAULT_PATH = "/var/tmp/garage.traces"
+
+# traces kept, oldest dropped first
+KEEP = 500
+
+# seconds after the relay pulse for the reeds to confirm a command, after that it's left unconfirmed
+DEFAULT_TIMEOUT = 60
+
+# the door's resting places, as GarageDoor.status() has them
+ENDS = ("open", "closed")
+
+_local = threading.local()
+
+
+class Trace():
+	# with a store, the trace is saved as soon as the relay's pulsed (so the daemon can start timing the door) and
+	# again when it's finished
+	def __init__(self, command, source="", traceId=None, started=None, store=None, timeout=DEFAULT_TIMEOUT):
+		self.id = traceId or os.urandom(8).hex()
+		self.command = command
+		self.source = source
+		self.started = time.time() if started is None else started
+		# started -> moving (relay pulsed, waiting on the reeds) -> confirmed or unconfirmed, or done (nothing to
+		# do, e.g. it's already open) or failed
+		self.status = "started"
+		self.attrs = {}
+		# (name, start, end, attrs)
+		self.spans = []
+		self.queued = None
+		self.triggered = None
+		self.deadline = None
+		self.store = store
+		self.timeout = timeout
+		# spans already in the store
+		self.saved = 0
+
+	def add(self, name, start, end=None, **attrs):
+		self.spans.append((name, start, time.time() if end is None else end, attrs))
+
+	@contextlib.contextmanager
+	def span(self, name, **attrs):
+		start = time.time()
+		try:
+			yield attrs
+		except Exception as e:
+			attrs['error'] = "{0}: {1}".format(type(e).__name__, e)
+			raise
+		finally:
+			self.add(name, start, **attrs)
+
+	# The relay's just been pulsed, starting at 'start'. The door is timed from the first pulse (ventilate has two),
+	# and the reeds get timeout seconds from the last one to confirm it.
+	def pulsed(self, start):
+		if self.triggered is None:
+			self.triggered = start
+		self.deadline = time.time() + self.timeout
+		self.status = "moving"
+		if self.store is not None:
+			self.store.save(self)
+
+	# the command's done its part
+	def finish(self, error=None):
+		if error is not None:
+			self.status = "failed"
+			self.attrs['error'] = error
+		elif self.triggered is None:
+			self.status = "done"
+		if self.store is not None:
+			self.store.save(self)
+		return self
+
+	def ended(self):
+		return max([self.started] + [s[2] for s in self.spans])
+
+	def toDict(self):
+		return {
+			'id': self.id,
+			'command': self.command,
+			'source': self.source,
+			'started': self.started,
+			'status': self.status,
+			'attrs': self.attrs,
+			'spans': [{'name': n, 'start': s, 'end': e, 'attrs': a} for (n, s, e, a) in self.spans],
+		}
+
+
+# the trace running on this thread, if any
+def current():
+	return getattr(_local, 'trace', None)
+
+
+@contextlib.contextmanager
+def activate(trace):
+	previous = current()
+	_local.trace = trace
+	try:
+		yield trace
+	finally:
+		_local.trace = previous
+
+
+# a span on this thread's trace, or nothing at all if there isn't one
+@contextlib.contextmanager
+def span(name, **attrs):
+	trace = current()
+	if trace is None:
+		yield attrs
+		return
+	with trace.span(name, **attrs) as a:
+		yield a
+
+
+# attributes for the whole trace, e.g. what the door was doing when the command came in
+def annotate(**attrs):
+	trace = current()
+	if trace is not None:
+		trace.attrs.update(attrs)
+
+
+# around pulsing the relay: a relay span, and the door is timed from the start of the pulse
+@contextlib.contextmanager
+def relay():
+	trace = current()
+	if trace is None:
+		yield
+		return
+	start = time.time()
+	with trace.span("relay"):
+		yield
+	trace.pulsed(start)
+
+
+# when this process started, from /proc, or None where there isn't one
+def processStarted():
+	try:
+		with open("/proc/self/stat") as f:
+			# the fields after the command name, which can have spaces in it. starttime is the 22nd field.
+			fields = f.read().rsplit(")", 1)[1].split()
+		ticks = int(fields[19]) / float(os.sysconf("SC_CLK_TCK"))
+		return time.time() - (time.clock_gettime(time.CLOCK_BOOTTIME) - ticks)
+	except (IOError, OSError, ValueError, IndexError, AttributeError):
+		return None
+
+
+# The trace for a door command run as a script (openDoor.py, main.py), running on the main thread from now on and
+# saved when the script exits. requested is when garagedoor.php got the request, if it passed it on.
+def scriptTrace(command, requested=None, path=DEFAULT_PATH, timeout=DEFAULT_TIMEOUT):
+	now = time.time()
+	began = processStarted()
+
+	trace = Trace(command, os.path.basename(sys.argv[0]), started=requested or began or now, store=TraceStore(path), timeout=timeout)
+	if requested is not None:
+		trace.add("exec", requested, began or now)
+	if began is not None:
+		trace.add("python", began, now)
+
+	_local.trace = trace
+	atexit.register(trace.finish)
+	return trace
+
+
+class TraceStore():
+	def __init__(self, path=DEFAULT_PATH, keep=KEEP):
+		self.path = path
+		self.keep = keep
+		# the reeds' latest changes (time, old, new), in the daemon
+		self.transitions = collections.deque(maxlen=16)
+
+	# one connection per call, so any thread (or process) can use the store
+	@contextlib.contextmanager
+	def _connect(self):
+		created = not os.path.exists(self.path)
+		db = sqlite3.connect(self.path, timeout=5)
+		try:
+			db.execute("CREATE TABLE IF NOT EXISTS traces (id TEXT PRIMARY KEY, command TEXT, source TEXT, started REAL, status TEXT, attrs TEXT, triggered REAL, moved REAL, deadline REAL)")
+			db.execute("CREATE TABLE IF NOT EXISTS spans (trace TEXT, name TEXT, start REAL, end REAL, attrs TEXT)")
+			db.execute("CREATE INDEX IF NOT EXISTS spansByTrace ON spans (trace)")
+			if created:
+				# openDoor.py runs as root, the daemon doesn't
+				os.chmod(self.path, 0o666)
+			yield db
+		finally:
+			db.close()
+
+	# Adds the trace, or brings it up to date: its status (unless the reeds have already settled it) and any new
+	# spans. Never raises, a trace that can't be saved isn't worth failing a door command over.
+	def save(self, trace):
+		try:
+			with self._connect() as db, db:
+				db.execute("INSERT OR IGNORE INTO traces (id, started, status) VALUES (?, ?, ?)", (trace.id, trace.started, trace.status))
+				db.execute("UPDATE traces SET command = ?, source = ?, started = ?, attrs = ?, triggered = ?, deadline = ?, status = CASE WHEN status IN ('confirmed', 'unconfirmed') THEN status ELSE ? END WHERE id = ?",
+					(trace.command, trace.source, trace.started, json.dumps(trace.attrs), trace.triggered, trace.deadline, trace.status, trace.id))
+				db.executemany("INSERT INTO spans (trace, name, start, end, attrs) VALUES (?, ?, ?, ?, ?)",
+					[(trace.id, n, s, e, json.dumps(a)) for (n, s, e, a) in trace.spans[trace.saved:]])
+				trace.saved = len(trace.spans)
+				self._prune(db)
+		except (sqlite3.Error, OSError):
+			logging.exception("Couldn't save trace %s", trace.id)
+
+	def _prune(self, db):
+		row = db.execute("SELECT started FROM traces ORDER BY started DESC LIMIT 1 OFFSET ?", (self.keep - 1,)).fetchone()
+		if row is not None:
+			db.execute("DELETE FROM traces WHERE started < ?", (row[0],))
+			db.execute("DELETE FROM spans WHERE trace NOT IN (SELECT id FROM traces)")
+
+	# The reeds went from old to new at time t (the daemon calls this on every change).
+	def observe(self, old, new, t=None):
+		self.transitions.append((time.time() if t is None else t, old, new))
+		return self.settle()
+
+	# Time the latest command still waiting on the door against the reeds: door start is from its relay pulse to
+	# the door leaving where it was, travel from there to arriving at an end, which confirms it. A ventilate
+	# command stops the door itself, so for that leaving is enough. The door often moves before the command has
+	# saved its trace, so the daemon calls this every second or so while the door's been moving recently; it
+	# doesn't touch the database otherwise.
+	def settle(self, now=None):
+		if now is None:
+			now = time.time()
+		if not (self.transitions and now - self.transitions[-1][0] <= DEFAULT_TIMEOUT):
+			return None
+		try:
+			with self._connect() as db, db:
+				db.execute("UPDATE traces SET status = 'unconfirmed' WHERE status = 'moving' AND deadline < ?", (now,))
+				row = db.execute("SELECT id, attrs, triggered, moved FROM traces WHERE status = 'moving' ORDER BY triggered DESC LIMIT 1").fetchone()
+				if row is None:
+					return None
+				(traceId, attrs, triggered, moved) = row
+
+				for (t, old, new) in self.transitions:
+					if (t < triggered or (moved is not None and t <= moved)):
+						continue
+					if (moved is None and old in ENDS):
+						db.execute("INSERT INTO spans (trace, name, start, end, attrs) VALUES (?, 'door start', ?, ?, ?)", (traceId, triggered, t, json.dumps({'from': old, 'to': new})))
+						db.execute("UPDATE traces SET moved = ? WHERE id = ?", (t, traceId))
+						moved = t
+						if (json.loads(attrs).get('operation') == "ventilate"):
+							db.execute("UPDATE traces SET status = 'confirmed' WHERE id = ?", (traceId,))
+							break
+					elif new in ENDS:
+						db.execute("INSERT INTO spans (trace, name, start, end, attrs) VALUES (?, 'travel', ?, ?, ?)", (traceId, moved or triggered, t, json.dumps({'to': new})))
+						db.execute("UPDATE traces SET status = 'confirmed' WHERE id = ?", (traceId,))
+						break
+				return traceId
+		except (sqlite3.Error, OSError):
+			logging.exception("Couldn't time a trace against the reeds")
+			return None
+
+	def _load(self, db, row):
+		(traceId, command, source, started, status, attrs) = row
+		trace = Trace(command, source, traceId, started)
+		trace.status = status
+		trace.attrs = json.loads(attrs)
+		for (name, start, end, spanAttrs) in db.execute("SELECT name, start, end, attrs FROM spans WHERE trace = ? ORDER BY start, rowid", (traceId,)):
+			trace.add(name, start, end, **json.loads(spanAttrs))
+		return trace
+
+	# one trace by id (or the start of one), None if it's not there
+	def get(self, traceId):
+		if not os.path.exists(self.path):
+			return None
+		with self._connect() as db:
+			row = db.execute("SELECT id, command, source, started, status, attrs FROM traces WHERE id LIKE ? ORDER BY started DESC LIMIT 1", (traceId + "%",)).fetchone()
+			return self._load(db, row) if row is not None else None
+
+	# the latest traces, newest first
+	def recent(self, limit=20):
+		if not os.path.exists(self.path):
+			return []
+		with self._connect() as db:
+			rows = db.execute("SELECT id, command, source, started, status, attrs FROM traces ORDER BY started DESC LIMIT ?", (limit,)).fetchall()
+			return [self._load(db, row) for row in rows]
+
+
+def _ms(seconds):
+	return "{0:.0f}ms".format(seconds * 1000) if seconds < 10 else "{0:.1f}s".format(seconds)
+
+
+def summary(trace):
+	return "{0}  {1}  {2:<11} {3:>8}  {4} ({5})".format(trace.id, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(trace.started)),
+		trace.status, _ms(trace.ended() - trace.started), trace.command, trace.source)
+
+
+# a trace's spans, each as an offset from the start of the trace and a bar, so the slow stage stands out
+def timeline(trace, width=40):
+	total = max(trace.ended() - trace.started, 1e-6)
+	lines = [summary(trace)]
+	for (key, value) in sorted(trace.attrs.items()):
+		lines.append("  {0}: {1}".format(key, value))
+	for (name, start, end, attrs) in trace.spans:
+		offset = int((start - trace.started) / total * width)
+		length = max(1, int((end - start) / total * width))
+		details = " ".join("{0}={1}".format(k, v) for (k, v) in sorted(attrs.items()))
+		lines.append("  {0:>8} +{1:<8} {2:<14} |{3:<{4}}| {5}".format(_ms(end - start), _ms(start - trace.started), name,
+			" " * offset + "#" * length, width, details).rstrip())
+	return "\n".join(lines)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Show how long each stage of recent door commands took.')
+	parser.add_argument("trace", nargs="?", help="show this trace (or the latest whose id starts with this)")
+	parser.add_argument("-n", "--count", type=int, default=20, help="how many recent traces to list (default 20)")
+	parser.add_argument("-j", "--json", help="print as JSON", action='store_true')
+	parser.add_argument("-d", "--db", default=DEFAULT_PATH, help="the trace database (default {0})".format(DEFAULT_PATH))
+	args = parser.parse_args()
+
+	store = TraceStore(args.db)
+
+	if args.trace:
+		trace = store.get(args.trace)
+		if trace is None:
+			sys.stderr.write("No trace {0}\n".format(args.trace))
+			sys.exit(1)
+		print(json.dumps(trace.toDict()) if args.json else timeline(trace))
+	else:
+		traces = store.recent(args.count)
+		print(json.dumps([t.toDict() for t in traces]) if args.json else "\n".join(summary(t) for t in traces))
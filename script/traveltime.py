@@ -0,0 +1,139 @@
+#!/usr/bin/python3
+#
+# How long the door actually takes to open and close.
+#
+# The 15.59/19.77 second figures were timed once with a stopwatch. The daemon now times every full traversal
+# (from the reed it leaves to the reed it arrives at) and keeps an exponentially weighted mean and variance for
+# each direction. Those feed the ventilate timing and the 'operating too long' timeout, and a traversal well
+# outside the usual spread is flagged - a door getting slower is an early sign of a tired opener motor.
+#
+# The estimates are saved to a small JSON file, so the command line scripts use them too.
+# -----------------------
+
+from __future__ import print_function
+import json
+import math
+import os
+
+__author__ = "Ryan Hunt <ryan@ryanhunt.net>"
+__copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
+
+DEFAULT_PATH = "/var/tmp/garage.travel"
+
+# Time to open fully (from closed) = 15.59 seconds
+# time to close fully (from open) = 19.77 seconds
+DEFAULTS = {'open': 15.59, 'close': 19.77}
+
+
+class TravelEstimate():
+	# weight given to each new traversal
+	ALPHA = 0.2
+
+	# traversals needed before we start calling anything unusual
+	MIN_SAMPLES = 5
+
+	# how many standard deviations out counts as unusual, and the smallest deviation we'll believe (the daemon only polls twice a second)
+	THRESHOLD = 3.0
+	MIN_DEVIATION = 0.5
+
+	def __init__(self, mean, variance=0.0, count=0):
+		self.mean = float(mean)
+		self.variance = float(variance)
+		self.count = int(count)
+
+	def deviation(self):
+		return max(math.sqrt(self.variance), self.MIN_DEVIATION)
+
+	def isAnomaly(self, duration):
+		return (self.count >= self.MIN_SAMPLES and abs(duration - self.mean) > self.THRESHOLD * self.deviation())
+
+	# add a traversal, returns True if it was unusual compared to the ones before it
+	def update(self, duration):
+		anomaly = self.isAnomaly(duration)
+
+		if (self.count == 0):
+			# replace the stopwatch guess outright
+			self.mean = duration
+		else:
+			diff = duration - self.mean
+			increment = self.ALPHA * diff
+			self.mean += increment
+			self.variance = (1 - self.ALPHA) * (self.variance + diff * increment)
+
+		self.count += 1
+		return anomaly
+
+
+class TravelTimes():
+	def __init__(self, path=DEFAULT_PATH):
+		self.path = path
+		self.estimates = dict((d, TravelEstimate(t)) for (d, t) in DEFAULTS.items())
+
+		# traversal in progress: (direction, start time)
+		self._moving = None
+
+	@classmethod
+	def load(cls, path=DEFAULT_PATH):
+		travel = cls(path)
+
+		try:
+			with open(path) as f:
+				saved = json.load(f)
+			for (direction, values) in saved.items():
+				if direction in travel.estimates:
+					travel.estimates[direction] = TravelEstimate(values['mean'], values['variance'], values['count'])
+		except (IOError, ValueError, KeyError, TypeError):
+			pass
+
+		return travel
+
+	def save(self):
+		if not self.path:
+			return
+
+		tmp = "{0}.tmp".format(self.path)
+		with open(tmp, "w") as f:
+			json.dump(dict((d, {'mean': e.mean, 'variance': e.variance, 'count': e.count}) for (d, e) in self.estimates.items()), f)
+		os.replace(tmp, self.path)
+
+	def expected(self, direction):
+		return self.estimates[direction].mean
+
+	# a generous upper bound on a traversal, mean plus THRESHOLD deviations
+	def worstCase(self, direction):
+		estimate = self.estimates[direction]
+		return estimate.mean + estimate.THRESHOLD * estimate.deviation()
+
+	# Feed in door state changes (from GarageDoor.status()) with the time they were seen.
+	# Returns (direction, duration, anomaly) when a full traversal finishes, otherwise None.
+	def observe(self, lastStatus, status, t):
+		if (lastStatus == "closed"):
+			self._moving = ("open", t)
+			return None
+		elif (lastStatus == "open"):
+			self._moving = ("close", t)
+			return None
+
+		moving = self._moving
+		arrived = {"open": "open", "closed": "close"}.get(status)
+
+		if (status in ("operating", "ventilate") and lastStatus in ("operating", "ventilate")):
+			# ventilate marker coming or going mid traversal, keep timing
+			return None
+
+		self._moving = None
+
+		if (moving is None or arrived != moving[0]):
+			# stopped part way, reversed or lost track, nothing to learn
+			return None
+
+		duration = t - moving[1]
+		default = DEFAULTS[arrived]
+
+		if not (0.3 * default < duration < 3 * default):
+			# someone stopped the door and started it again, or similar
+			return None
+
+		anomaly = self.estimates[arrived].update(duration)
+		self.save()
+		return (arrived, duration, anomaly)
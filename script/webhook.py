@@ -0,0 +1,477 @@
+#!/usr/bin/python3
+#
+# IFTTT webhook, served by the daemon itself.
+#
+# This replaces garagedoor.php -> exec(openDoor.py): the request is checked and the door triggered inside the
+# daemon, so there's no Python process started (and no 20 second sleep held) per request. The IFTTT 'Do'
+# recipe stays the same (POST secret=SEKRETHASH&long={{Longitude}}&lat={{Latitude}}), just point it at this port.
+#
+# garagesecret.py needs:
+#
+# def getWebhookSecret():
+#    return "SEKRETHASH"
+#
+# and can optionally have:
+#
+# def getGeofences():
+#    return {"home": (lat, long, 0.2), "work": (lat, long, 0.5)}    # radius in km
+#
+# def getMembers():
+#    return ["ryan", "partner"]    # names allowed in the optional 'member' field
+#
+# def getArrival():
+#    return {'fence': 'home'}      # open the door ahead of a member driving home (see arrival.py)
+#
+# A request is accepted if either its 'secret' matches, or it carries a 'sig' field holding the hex
+# HMAC-SHA256 (keyed with the secret) of its other fields, sorted and joined as key=value&key=value.
+# Both comparisons are constant time.
+#
+# In front of all that, each client is rate limited and replays are refused (see ratelimit.py). A signed request
+# has to carry a 'nonce' and a 'ts' (unix time, within REPLAY_WINDOW seconds of ours), and each nonce is only
+# accepted once. So does a request with a nonce and the plain secret. Plain IFTTT requests have neither, so an
+# identical body seen again within DUPLICATE_WINDOW seconds (a retry or a double tap) is refused instead.
+#
+# The daemon's latest status is also available, to anyone who passes the secret in an X-Garage-Secret header
+# (never in the URL, which ends up in logs):
+#   GET /status.json            the same JSON as main.py --json
+#   GET /status?since=<seq>&epoch=<epoch>
+#                               a wireformat.py frame with just the fields changed since <seq> (of the same <epoch>)
+#   GET /climate.json?metric=humidity&hours=168[&series=1][&resolution=hour]
+#                               min/max/mean (or a series for charts) from rollup.py
+#   GET /health.json            state of each sensor worker, and the daemon's memory use (see supervisor.py)
+#   GET /traces.json[?id=<id>]  the latest door command traces, or one of them with its spans (see tracing.py)
+#
+# With tracing on, an accepted command's reply has its trace id in an X-Garage-Trace header.
+# -----------------------
+
+from __future__ import print_function
+import hashlib
+import hmac
+import json
+import logging
+import queue
+import threading
+import time
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qsl, urlparse
+from geofence import Geofences, toVector
+from ratelimit import TokenBuckets, ReplayGuard
+import tracing
+
+__author__ = "Ryan Hunt <ryan@ryanhunt.net>"
+__copyright__ = "Copyright (c) 2016-2017 Ryan Hunt"
+
+# IFTTT bodies are tiny, anything bigger isn't for us
+MAX_BODY = 4096
+
+DEFAULT_MEMBER = "default"
+
+# how long nonces are remembered, and how far out a timestamp may be
+REPLAY_WINDOW = 300
+
+# how long an identical request without a nonce is treated as a repeat
+DUPLICATE_WINDOW = 30
+
+# seconds a client gets to send its request before we give up on it
+REQUEST_TIMEOUT = 5
+
+# requests are answered on a thread each, up to this many at once, and no more than MAX_PER_CLIENT for any one
+# address, so a few slow (or idle) connections can't hold up everyone else. Beyond that it's 503 straight away.
+MAX_THREADS = 16
+MAX_PER_CLIENT = 4
+
+BUSY = b"HTTP/1.0 503 Service Unavailable\r\nContent-Length: 0\r\nConnection: close\r\n\r\n"
+
+
+class DoorCommander():
+	# Runs door commands one at a time on a worker thread so the web request can answer straight away.
+	# Like openDoor.py's claim on the door (see doorstate.py), once the relay has been pulsed further commands are
+	# refused until the door has had time to finish moving (cooldown seconds, by default the slowest the door
+	# has been measured to take). With a tracer (a tracing.TraceStore) every command is traced.
+	def __init__(self, garage, cooldown=None, tracer=None):
+		self.garage = garage
+		self.cooldown = cooldown
+		self.tracer = tracer
+
+		self._lock = threading.Lock()
+		self._busyUntil = 0
+		self._queue = queue.Queue()
+
+		self._thread = threading.Thread(target=self._run, name="DoorCommander")
+		self._thread.daemon = True
+		self._thread.start()
+
+	# returns False (and does nothing) if the door is still busy with the last command. trace carries on one
+	# that's already started (the web request's), otherwise a new one is started here.
+	def submit(self, name, command, trace=None):
+		with self._lock:
+			now = time.time()
+			if (now < self._busyUntil):
+				return False
+			cooldown = self.getCooldown()
+			self._busyUntil = now + cooldown
+
+		if self.tracer is None:
+			trace = None
+		else:
+			if trace is None:
+				trace = tracing.Trace(name, "daemon", started=now)
+			trace.command = name
+			trace.store = self.tracer
+			trace.timeout = cooldown
+			trace.queued = now
+
+		self._queue.put((name, command, trace))
+		return True
+
+	def getCooldown(self):
+		if self.cooldown is not None:
+			return self.cooldown
+		travel = self.garage.door.travel
+		return max(travel.worstCase("open"), travel.worstCase("close"))
+
+	def _run(self):
+		while True:
+			(name, command, trace) = self._queue.get()
+			error = None
+			if trace is not None:
+				trace.add("queue", trace.queued)
+			with tracing.activate(trace):
+				try:
+					logging.info("Door command: %s", name)
+					with tracing.span("command"):
+						command()
+				except Exception as e:
+					error = "{0}: {1}".format(type(e).__name__, e)
+					logging.exception("Door command %s failed", name)
+			if trace is not None:
+				trace.finish(error)
+
+
+class WebhookServer(ThreadingMixIn, HTTPServer):
+	# let a burst of connections queue rather than have them refused (and retried a second later) beyond the default 5
+	request_queue_size = 64
+	daemon_threads = True
+	maxThreads = MAX_THREADS
+	maxPerClient = MAX_PER_CLIENT
+
+	def __init__(self, address, garage, sekret, commander=None, snapshots=None, rollups=None, health=None, tracer=None, arrivals=None):
+		secret = sekret.getWebhookSecret().strip()
+
+		if not secret:
+			raise ValueError("getWebhookSecret() is empty, refusing to serve the webhook without a secret")
+
+		self.garage = garage
+		self.snapshots = snapshots
+		self.rollups = rollups
+		self.health = health
+		self.commander = commander if commander is not None else DoorCommander(garage, tracer=tracer)
+		self.tracer = self.commander.tracer
+		self.geofences = Geofences.fromSecret(sekret)
+		self.members = set(sekret.getMembers()) if hasattr(sekret, 'getMembers') else None
+		# opens the door ahead of members on their way home, if it's set up (see arrival.py)
+		self.arrivals = arrivals
+
+		self._key = secret.encode('utf-8')
+		self._secretDigest = self._digest(secret)
+
+		# last reported position (as a unit vector) for each member
+		self.positions = {}
+		
+		self.limiter = TokenBuckets()
+		# dashboards poll, so reading the status gets a much bigger allowance than triggering the door
+		self.readLimiter = TokenBuckets(rate=2, burst=10, totalRate=20, totalBurst=50)
+		self.replays = ReplayGuard(REPLAY_WINDOW)
+		self.duplicates = ReplayGuard(DUPLICATE_WINDOW)
+		self.rejected = 0
+
+		# requests are handled on their own threads: the limiters, replay checks and positions are shared
+		self._lock = threading.Lock()
+		self._active = 0
+		self._connections = {}
+
+		HTTPServer.__init__(self, address, WebhookHandler)
+
+	def _digest(self, message):
+		return hmac.new(self._key, message.encode('utf-8'), hashlib.sha256).digest()
+
+	def authenticate(self, form):
+		sig = form.get('sig')
+		if sig:
+			message = "&".join("{0}={1}".format(k, form[k]) for k in sorted(form) if k != 'sig')
+			return hmac.compare_digest(self._digest(message).hex(), sig.strip().lower())
+
+		given = form.get('secret', '').strip()
+		if not given:
+			return False
+
+		# comparing digests means the time taken doesn't depend on how much of the secret was right, or its length.
+		return hmac.compare_digest(self._digest(given), self._secretDigest)
+
+	# Before a request gets a thread (or anything's read from it): refused if all the threads are busy, or this
+	# client already has its share of them.
+	def process_request(self, request, client_address):
+		client = client_address[0]
+		with self._lock:
+			busy = (self._active >= self.maxThreads or self._connections.get(client, 0) >= self.maxPerClient)
+			if busy:
+				self.rejected += 1
+			else:
+				self._active += 1
+				self._connections[client] = self._connections.get(client, 0) + 1
+
+		if busy:
+			try:
+				request.sendall(BUSY)
+			except OSError:
+				pass
+			self.shutdown_request(request)
+			return
+
+		try:
+			ThreadingMixIn.process_request(self, request, client_address)
+		except Exception:
+			self._finished(client)
+			raise
+
+	def process_request_thread(self, request, client_address):
+		try:
+			ThreadingMixIn.process_request_thread(self, request, client_address)
+		finally:
+			self._finished(client_address[0])
+
+	def _finished(self, client):
+		with self._lock:
+			self._active -= 1
+			count = self._connections.pop(client, 1) - 1
+			if count:
+				self._connections[client] = count
+
+	# cheap enough to run before even reading the request body
+	def allow(self, client):
+		with self._lock:
+			if self.limiter.allow(client):
+				return True
+			self.rejected += 1
+			return False
+
+	def allowRead(self, client):
+		with self._lock:
+			return self.readLimiter.allow(client)
+
+	def isReplay(self, form, body):
+		nonce = form.get('nonce')
+		if not (nonce or form.get('sig')):
+			return not self.duplicates.check(hashlib.sha256(body.encode('utf-8')).digest())
+
+		# without a nonce a signed body could be sent again once it's out of the duplicate window, and without a
+		# timestamp a nonce could be used again once it's forgotten
+		if not nonce:
+			return True
+		try:
+			timestamp = float(form['ts'])
+		except (KeyError, ValueError):
+			return True
+
+		return not self.replays.check(nonce, timestamp)
+
+	# returns (http status, text) for a parsed form. trace, if given, is used for the door command.
+	def handle(self, form, client, body="", trace=None):
+		# all quick (the door command is only queued), so one at a time: a replay can't slip in alongside the original
+		with self._lock:
+			return self._handle(form, client, body, trace)
+
+	def _handle(self, form, client, body, trace):
+		if not self.authenticate(form):
+			self.rejected += 1
+			return (403, "Nope.")
+
+		if self.isReplay(form, body):
+			self.rejected += 1
+			return (409, "Nope.")
+
+		member = form.get('member', DEFAULT_MEMBER)
+		if (self.members is not None and member != DEFAULT_MEMBER and member not in self.members):
+			return (403, "Nope.")
+
+		lat = form.get('lat', '').strip()
+		long = form.get('long', '').strip()
+
+		if not (lat and long):
+			return (200, "Yep.\nGot no location")
+
+		try:
+			vector = toVector(lat, long)
+		except ValueError:
+			return (400, "Yep.\nCouldn't read that location")
+
+		self.positions[member] = vector
+
+		# True if the door was opened ahead of them, and this is them getting home
+		expected = self.arrivals.report(member, vector) if self.arrivals is not None else False
+
+		members = list(self.positions)
+		inside = self.geofences.checkVectors(members, [self.positions[m] for m in members])[member]
+
+		if not inside:
+			nearest = min(self.geofences.fences, key=lambda f: f.distance(vector))
+			return (200, "Yep.\nYou're more than {0:.0f}m away.".format(nearest.radius * 1000))
+
+		if expected:
+			# a trigger now would close it on them
+			return (200, "Yep.\nThe door's already open for you.")
+
+		if trace is not None:
+			trace.add("intake", trace.started, member=member)
+
+		if self.commander.submit("ifttt ({0} at {1})".format(member, ", ".join(inside)), self.garage.door.ifttt, trace):
+			return (200, "Yep.\nI think you're in the safe zone ({0}).".format(", ".join(inside)))
+
+		return (200, "Yep.\nI think you're in the safe zone, but the door is already on the move.")
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+	server_version = "GarageDoor/1.0"
+	timeout = REQUEST_TIMEOUT
+
+	def do_POST(self):
+		trace = tracing.Trace("ifttt", "webhook {0}".format(self.client_address[0])) if self.server.tracer is not None else None
+
+		if not self.server.allow(self.client_address[0]):
+			self._reply(429, "Nope.")
+			return
+
+		try:
+			length = int(self.headers.get('Content-Length') or 0)
+		except ValueError:
+			length = -1
+
+		if (length < 0 or length > MAX_BODY):
+			self._reply(413, "Nope.")
+			return
+
+		body = self.rfile.read(length).decode('utf-8', 'replace')
+		form = dict(parse_qsl(body))
+
+		(code, text) = self.server.handle(form, self.client_address[0], body, trace)
+		if (trace is not None and trace.queued is not None):
+			self._reply(code, text, headers={'X-Garage-Trace': trace.id})
+		else:
+			self._reply(code, text)
+
+	def do_GET(self):
+		if not self.server.allowRead(self.client_address[0]):
+			self._reply(429, "Nope.")
+			return
+
+		url = urlparse(self.path)
+		query = dict(parse_qsl(url.query))
+		snapshots = self.server.snapshots
+		rollups = self.server.rollups
+		health = self.server.health
+		tracer = self.server.tracer
+
+		if not ((snapshots is not None and url.path in ("/status", "/status.json")) or (rollups is not None and url.path == "/climate.json") or (health is not None and url.path == "/health.json") or (tracer is not None and url.path == "/traces.json")):
+			self._reply(404, "Nope.")
+			return
+
+		if not self.server.authenticate({'secret': self.headers.get('X-Garage-Secret', '')}):
+			self._reply(403, "Nope.")
+			return
+
+		if (url.path == "/climate.json"):
+			self._climate(rollups, query)
+			return
+
+		if (url.path == "/health.json"):
+			self._reply(200, json.dumps(health()), "application/json")
+			return
+
+		if (url.path == "/traces.json"):
+			self._traces(tracer, query)
+			return
+
+		if (url.path == "/status.json"):
+			self._reply(200, snapshots.json(), "application/json")
+			return
+
+		try:
+			(since, epoch) = (int(query.get('since', 0)), int(query.get('epoch', 0)))
+		except ValueError:
+			(since, epoch) = (0, 0)
+
+		self._reply(200, snapshots.frame(since, epoch), "application/octet-stream")
+
+	def _climate(self, rollups, query):
+		metric = query.get('metric', 'temperature')
+		if metric not in rollups.metrics:
+			self._reply(400, "Unknown metric, try one of: {0}".format(", ".join(rollups.metrics)))
+			return
+
+		try:
+			hours = float(query.get('hours', 24))
+		except ValueError:
+			hours = 24
+
+		resolution = query.get('resolution')
+		if resolution not in (None, 'minute', 'hour', 'day'):
+			resolution = None
+
+		start = time.time() - hours * 3600
+		if query.get('series'):
+			result = rollups.series(metric, start, resolution=resolution)
+		else:
+			result = rollups.query(metric, start, resolution=resolution)
+
+		self._reply(200, json.dumps(result), "application/json")
+
+	def _traces(self, tracer, query):
+		if query.get('id'):
+			trace = tracer.get(query['id'])
+			if trace is None:
+				self._reply(404, "No such trace")
+				return
+			self._reply(200, json.dumps(trace.toDict()), "application/json")
+			return
+
+		try:
+			count = max(1, min(100, int(query.get('count', 20))))
+		except ValueError:
+			count = 20
+
+		self._reply(200, json.dumps([t.toDict() for t in tracer.recent(count)]), "application/json")
+
+	def _reply(self, code, text, contentType="text/plain; charset=utf-8", headers=None):
+		data = text if isinstance(text, bytes) else text.encode('utf-8')
+		self.send_response(code)
+		self.send_header("Content-Type", contentType)
+		for (name, value) in (headers or {}).items():
+			self.send_header(name, value)
+		self.send_header("Content-Length", str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def log_message(self, format, *args):
+		message = format % args
+		# leave out any query string, in case someone's put the secret in it anyway
+		path = getattr(self, 'path', "")
+		if ("?" in path):
+			message = message.replace(path, path.split("?", 1)[0] + "?...")
+		logging.debug("webhook %s: %s", self.client_address[0], message)
+
+
+# Start serving the webhook on a background thread.
+# health is a function returning something JSON friendly for /health.json. Pass a commander to share it (and
+# its cooldown) with anything else that moves the door, and a tracer (tracing.TraceStore) to trace its commands.
+# arrivals (an arrival.ArrivalPredictor) is given every member's position as it comes in.
+def start(garage, port, address='', snapshots=None, rollups=None, health=None, commander=None, tracer=None, arrivals=None):
+	import garagesecret as sekret
+
+	server = WebhookServer((address, port), garage, sekret, commander=commander, snapshots=snapshots, rollups=rollups, health=health, tracer=tracer, arrivals=arrivals)
+
+	thread = threading.Thread(target=server.serve_forever, name="Webhook")
+	thread.daemon = True
+	thread.start()
+
+	return server
@@ -33,7 +33,8 @@ function distance($lat1, $lon1, $lat2, $lon2, $unit) {
 }
 
 
-if(isset($_POST['secret']) && (trim($_POST['secret']) != '') && (trim($_POST['secret']) == $secret) ) {
+// hash_equals() takes the same time however much of the secret matched.
+if(isset($_POST['secret']) && (trim($_POST['secret']) != '') && hash_equals($secret, trim($_POST['secret'])) ) {
     $s=$_POST['secret'];
     echo "Yep.";
     
@@ -46,7 +47,8 @@ if(isset($_POST['secret']) && (trim($_POST['secret']) != '') && (trim($_POST['se
     		echo "\nYou're more than 200m away.";
     	} else {
     		echo "\nI think you're in the safe zone, less than 200m away.";
-			exec($openCommand);
+			// tell the script when the request came in, so its trace (see tracing.py) includes getting this far
+			exec($openCommand . ' --requested ' . escapeshellarg(sprintf('%.6F', $_SERVER['REQUEST_TIME_FLOAT'])));
     	}
     	
     } else {